@@ -0,0 +1,255 @@
+"""
+Nightly Task Pre-generation
+Generates the next day's dailyTask documents for recently active users ahead
+of the morning peak, so opening the app only reads /api/tasks/today. Run it
+once a night, e.g. from cron:
+
+    cd backend && python -m jobs.pregenerate_tasks
+    python -m jobs.pregenerate_tasks --date 2026-03-01 --active-days 14
+
+The job is resumable and idempotent per (user, date): users whose tasks have
+been written are checkpointed in SQLite, users who already have tasks due that
+day are skipped, and task documents use deterministic ids written with
+createIfNotExists. An interrupted run can simply be started again.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from models.schemas import UserHealthData
+from services.llm_client import get_llm_client
+from services.task_generator import get_task_generator
+from services.task_store import DailyTaskStore, day_start, utc_today
+from utils.sqlite import connect, data_path
+
+ACTIVE_USERS_QUERY = """{
+  "profiles": *[_type in ["userProfile", "onboardingData"] && _updatedAt >= $since].clerkId,
+  "reports": *[_type == "medicalReport" && _updatedAt >= $since].userId,
+  "chats": *[_type == "chatConversation" && _updatedAt >= $since].userId,
+  "tasks": *[_type == "dailyTask" && completedAt >= $since].clerkId
+}"""
+
+HEALTH_PROFILES_QUERY = """*[_type in ["userProfile", "onboardingData"] && clerkId in $ids]{
+  _type, clerkId, firstName, preferredName, age, weight, chronicDiseases, healthContext
+}"""
+
+_LIST_SEPARATORS = re.compile(r"[,;\n]")
+
+
+class BatchCheckpoint:
+    """(date, user) pairs whose tasks are written, so a rerun resumes where the last one stopped."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS task_batch_progress (
+            day TEXT NOT NULL,
+            clerk_id TEXT NOT NULL,
+            tasks INTEGER NOT NULL,
+            finished_at REAL NOT NULL,
+            PRIMARY KEY (day, clerk_id)
+        );
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("TASK_BATCH_CHECKPOINT_PATH") or data_path("task_batch.db")
+        self._conn = connect(self.path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def finished(self, day: date) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT clerk_id FROM task_batch_progress WHERE day = ?", (day.isoformat(),)
+            ).fetchall()
+        return {row["clerk_id"] for row in rows}
+
+    def mark_finished(self, day: date, task_counts: Dict[str, int]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO task_batch_progress (day, clerk_id, tasks, finished_at) VALUES (?, ?, ?, ?)",
+                [(day.isoformat(), clerk_id, count, now) for clerk_id, count in task_counts.items()],
+            )
+
+    def prune(self, keep_days: int = 14) -> None:
+        cutoff = (utc_today() - timedelta(days=keep_days)).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM task_batch_progress WHERE day < ?", (cutoff,))
+
+
+def _split(values: Any) -> List[str]:
+    if isinstance(values, str):
+        values = _LIST_SEPARATORS.split(values)
+    return [str(value).strip() for value in values or [] if str(value).strip()]
+
+
+def build_health_data(docs: Iterable[Dict[str, Any]]) -> UserHealthData:
+    """Merge a user's userProfile and onboardingData documents into UserHealthData."""
+    fields: Dict[str, Any] = {"conditions": [], "medications": [], "allergies": []}
+    for doc in docs:
+        if doc.get("_type") == "userProfile":
+            fields["firstName"] = doc.get("firstName") or fields.get("firstName")
+            fields["age"] = doc.get("age")
+            fields["weight"] = doc.get("weight")
+            fields["conditions"] += _split(doc.get("chronicDiseases"))
+        else:
+            fields["firstName"] = fields.get("firstName") or doc.get("preferredName") or doc.get("firstName")
+            context = doc.get("healthContext") or {}
+            for name in ("conditions", "medications", "allergies"):
+                fields[name] += _split(context.get(name))
+
+    for name in ("conditions", "medications", "allergies"):
+        # Keep the first spelling of each entry, in order
+        seen: Dict[str, str] = {}
+        for value in fields[name]:
+            seen.setdefault(value.lower(), value)
+        fields[name] = list(seen.values()) or None
+    return UserHealthData(**{name: value for name, value in fields.items() if value is not None})
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def active_users(store: DailyTaskStore, since: datetime) -> List[str]:
+    """Users who touched their profile, reports, chats or tasks since the given time."""
+    result = await store.query(ACTIVE_USERS_QUERY, {"since": since.isoformat() + "Z"}) or {}
+    return sorted({clerk_id for ids in result.values() for clerk_id in ids or [] if clerk_id})
+
+
+async def health_profiles(store: DailyTaskStore, clerk_ids: List[str]) -> Dict[str, UserHealthData]:
+    docs = await store.query(HEALTH_PROFILES_QUERY, {"ids": clerk_ids}) or []
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        by_user.setdefault(doc["clerkId"], []).append(doc)
+    return {clerk_id: build_health_data(by_user.get(clerk_id, [])) for clerk_id in clerk_ids}
+
+
+async def pregenerate_tasks(
+    day: date,
+    active_days: int = 7,
+    concurrency: Optional[int] = None,
+    batch_size: int = 50,
+    store: Optional[DailyTaskStore] = None,
+    checkpoint: Optional[BatchCheckpoint] = None,
+) -> Dict[str, int]:
+    """Generate and write day's tasks for users active in the last active_days days.
+
+    Users are handled in chunks of batch_size: their profiles are read in one
+    query, tasks are generated with at most concurrency generations in flight
+    (default: the LLM scheduler's "backfill" cap, which they run under),
+    and the chunk's documents are written in one Sanity transaction before the
+    chunk is checkpointed. A failed chunk is left unfinished for the next run.
+    """
+    store = store or DailyTaskStore()
+    checkpoint = checkpoint or BatchCheckpoint()
+    generator = get_task_generator()
+    totals = {"users": 0, "generated": 0, "documents": 0, "skipped": 0, "failed": 0}
+    if not store.is_available():
+        print("⚠️ Sanity credentials not configured, nothing to do")
+        return totals
+
+    since = datetime.combine(day, datetime.min.time()) - timedelta(days=active_days)
+    users = await active_users(store, since)
+    finished = checkpoint.finished(day)
+    pending = [clerk_id for clerk_id in users if clerk_id not in finished]
+    totals["users"] = len(users)
+    totals["skipped"] = len(users) - len(pending)
+    print(f"🗓️ Pre-generating tasks for {day.isoformat()}: {len(users)} active users, {len(pending)} to do")
+
+    # More generations than the backfill class may run would only wait in its queue.
+    slots = asyncio.Semaphore(concurrency or get_llm_client().scheduler.class_limit("backfill"))
+
+    async def generate(clerk_id: str, health: UserHealthData) -> List[Dict[str, Any]]:
+        async with slots:
+            return await generator.generate(health, clerk_id, day=day, wait=True)
+
+    for chunk in _chunks(pending, batch_size):
+        try:
+            have_tasks = set(await store.users_with_tasks(chunk, day))
+            profiles = await health_profiles(store, [clerk_id for clerk_id in chunk if clerk_id not in have_tasks])
+        except Exception as e:
+            totals["failed"] += len(chunk)
+            print(f"❌ Could not read users for chunk starting {chunk[0]}: {type(e).__name__}: {str(e)}")
+            continue
+
+        results = await asyncio.gather(
+            *(generate(clerk_id, health) for clerk_id, health in profiles.items()), return_exceptions=True
+        )
+        tasks_by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for clerk_id, tasks in zip(profiles, results):
+            if isinstance(tasks, BaseException):
+                totals["failed"] += 1
+                print(f"❌ Task generation failed for {clerk_id}: {type(tasks).__name__}: {str(tasks)}")
+            elif tasks:
+                tasks_by_user[clerk_id] = [{**task, "dueDate": day_start(day)} for task in tasks]
+
+        try:
+            totals["documents"] += await store.create_generated_tasks(tasks_by_user, day)
+        except Exception as e:
+            totals["failed"] += len(tasks_by_user)
+            print(f"❌ Sanity transaction failed for chunk starting {chunk[0]}: {type(e).__name__}: {str(e)}")
+            continue
+
+        checkpoint.mark_finished(
+            day, {**{clerk_id: 0 for clerk_id in have_tasks}, **{c: len(t) for c, t in tasks_by_user.items()}}
+        )
+        totals["generated"] += len(tasks_by_user)
+        totals["skipped"] += len(have_tasks)
+        print(f"✓ Wrote tasks for {len(tasks_by_user)} users ({len(have_tasks)} already had tasks)")
+
+    checkpoint.prune()
+    return totals
+
+
+async def _main(args: argparse.Namespace) -> int:
+    day = date.fromisoformat(args.date) if args.date else utc_today() + timedelta(days=1)
+    store = DailyTaskStore()
+    try:
+        totals = await pregenerate_tasks(
+            day,
+            active_days=args.active_days,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            store=store,
+        )
+    finally:
+        await store.aclose()
+        await get_llm_client().aclose()
+    print(f"📊 Done: {totals}")
+    return 1 if totals["failed"] else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate next-day dailyTask documents for active users.")
+    parser.add_argument("--date", help="Day to generate tasks for (YYYY-MM-DD, default tomorrow)")
+    parser.add_argument(
+        "--active-days", type=int, default=int(os.getenv("TASK_BATCH_ACTIVE_DAYS", "7")),
+        help="Include users active within this many days",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=int(os.getenv("TASK_BATCH_CONCURRENCY", "0")) or None,
+        help="Task generations in flight at once (default: the backfill class cap)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=int(os.getenv("TASK_BATCH_SIZE", "50")),
+        help="Users per Sanity transaction",
+    )
+    sys.exit(asyncio.run(_main(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -11,6 +13,12 @@ from routers.voice import router as voice_router
 from routers.summary import router as summary_router
 from routers.hospitals import router as hospitals_router
 from routers.tasks import router as tasks_router
+from routers.summary import summary_prefetcher, summary_service
+from services.sanity_listener import SanityListener, mutation_document
+from services.llm_client import get_llm_client
+from services.sanity_service import get_sanity_service
+from services.task_store import get_task_store
+from utils.metrics import metrics
 
 app = FastAPI(title="NueraCare Backend", version="1.0.0")
 
@@ -33,3 +41,64 @@ app.include_router(tasks_router, prefix="/api")
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Counters, latency observations and gauges (cache stats, outbox depth, ...)."""
+    return metrics.snapshot()
+
+
+sanity_listener = SanityListener()
+
+
+def _invalidate_summary_cache(payload: dict) -> None:
+    doc = mutation_document(payload)
+    if doc.get("_type") == "medicalReport" and doc.get("reportId"):
+        summary_service.cache.invalidate(doc["reportId"])
+
+
+@app.on_event("startup")
+async def start_sanity_listener():
+    """Push-based cache invalidation; opt in with SANITY_LISTENER_ENABLED=true."""
+    if os.getenv("SANITY_LISTENER_ENABLED", "false").lower() != "true":
+        return
+    if not sanity_listener.is_configured():
+        print("⚠️ Sanity listener enabled but Sanity is not configured")
+        return
+    sanity_service = get_sanity_service()
+    task_store = get_task_store()
+    sanity_listener.add_handler(sanity_service.apply_mutation)
+    sanity_listener.add_handler(_invalidate_summary_cache)
+    sanity_listener.add_handler(task_store.apply_mutation)
+    sanity_listener.add_status_handler(sanity_service.set_push_invalidation)
+    sanity_listener.add_status_handler(task_store.set_push_invalidation)
+    sanity_listener.start()
+
+
+@app.on_event("shutdown")
+async def stop_sanity_listener():
+    await sanity_listener.stop()
+
+
+@app.on_event("shutdown")
+def stop_sanity_outbox():
+    outbox = getattr(get_sanity_service().backend, "outbox", None)
+    if outbox is not None:
+        outbox.stop()
+
+
+@app.on_event("shutdown")
+async def stop_summary_prefetcher():
+    await summary_prefetcher.stop()
+    summary_service.cache.stop()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await get_llm_client().aclose()
+
+
+@app.on_event("shutdown")
+async def close_task_store():
+    await get_task_store().aclose()
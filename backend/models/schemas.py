@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -48,9 +48,49 @@ class ChatResponse(BaseModel):
     disclaimers: Optional[List[str]] = None
 
 
+class ChatMessage(BaseModel):
+    role: str
+    text: str
+    timestamp: Optional[str] = None
+
+
+class SaveChatRequest(BaseModel):
+    report_id: str
+    user_id: str
+    messages: List[ChatMessage]
+    summary: str = ""
+
+
 class VoiceChatRequest(ChatRequest):
     pass
 
 
 class ErrorResponse(BaseModel):
     detail: str
+
+
+TaskPriority = Literal["low", "medium", "high"]
+TaskCategory = Literal["medication", "exercise", "appointment", "health-check", "nutrition", "general"]
+
+
+class UserHealthData(BaseModel):
+    firstName: Optional[str] = None
+    conditions: Optional[List[str]] = None
+    medications: Optional[List[str]] = None
+    allergies: Optional[List[str]] = None
+    bloodPressure: Optional[str] = None
+    bloodSugar: Optional[float] = None
+    weight: Optional[float] = None
+    age: Optional[int] = None
+    activityLevel: Optional[str] = None
+
+
+class GeneratedTaskResponse(BaseModel):
+    title: str = Field(..., min_length=1, max_length=120)
+    description: Optional[str] = Field(default=None, max_length=500)
+    priority: TaskPriority
+    category: TaskCategory
+    dueDate: Optional[str] = None
+    generatedByGroq: bool = True
+    isCompleted: bool = False
+    clerkId: str
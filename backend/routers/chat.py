@@ -1,17 +1,116 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from models.schemas import ChatRequest, ChatResponse
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from models.schemas import ChatRequest, ChatResponse, SaveChatRequest
+from services.conversation_memory import Conversation, ConversationMemory
 from services.groq_service import GroqService
 from services.parser_service import parse_report_text
-from services.sanity_service import SanityService
+from services.sanity_service import get_sanity_service
 from utils.safety import default_disclaimer, safe_refusal
 from utils.response_logger import log_response
 
 router = APIRouter(tags=["chat"])
-report_service = SanityService()
+report_service = get_sanity_service()
 groq_service = GroqService()
+conversation_memory = (
+    ConversationMemory(history_loader=report_service.get_chat_history)
+    if os.getenv("CHAT_MEMORY", "true").lower() != "false"
+    else None
+)
+
+
+async def _conversation(payload: ChatRequest) -> Optional[Conversation]:
+    if conversation_memory is None:
+        return None
+    return await conversation_memory.get(payload.report_id, payload.user_id)
+
+
+async def _prepare_chat(payload: ChatRequest) -> Union[ChatResponse, Tuple[str, List[Dict[str, Any]]]]:
+    """Validate a chat request and load its report.
+
+    Returns a ready ChatResponse when no model call is needed, otherwise the
+    report text and parsed values to answer from. Raises HTTPException on bad input.
+    """
+    # Validate inputs
+    if not payload.report_id or not payload.report_id.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Report ID is required."
+        )
+    
+    if not payload.user_id or not payload.user_id.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="User ID is required."
+        )
+    
+    if not payload.message or not payload.message.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Message cannot be empty."
+        )
+    
+    # Validate mode
+    valid_modes = ["normal", "explain_simple"]
+    if payload.mode and payload.mode not in valid_modes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid mode. Must be one of: {', '.join(valid_modes)}"
+        )
+    
+    print(f"✓ DEBUG: Validation passed, fetching report...")
+    record = await asyncio.to_thread(report_service.get_report, payload.report_id, payload.user_id)
+    print(f"✓ DEBUG: Report fetched - found={record is not None}")
+    
+    if not record:
+        raise HTTPException(
+            status_code=404,
+            detail="Report not found. Please check report ID and user ID are correct."
+        )
+
+    extracted_text = record.get("extracted_text") or ""
+    if not extracted_text.strip():
+        return ChatResponse(
+            report_id=payload.report_id,
+            user_id=payload.user_id,
+            response="Some parts of this report are hard to read. I'll explain what I can see clearly. A doctor can review the full report.",
+            used_model=None,
+            disclaimers=[default_disclaimer()],
+        )
+
+    parsed_values = [item.model_dump() for item in parse_report_text(extracted_text)]
+
+    if not parsed_values:
+        return ChatResponse(
+            report_id=payload.report_id,
+            user_id=payload.user_id,
+            response=safe_refusal(),
+            used_model=None,
+            disclaimers=[default_disclaimer()],
+        )
+
+    return extracted_text, parsed_values
+
+
+def _log_chat(payload: ChatRequest, response_text: str, used_model: Optional[str]) -> None:
+    log_response(
+        {
+            "report_id": payload.report_id,
+            "user_id": payload.user_id,
+            "mode": payload.mode,
+            "voice_mode": bool(payload.voice_mode),
+            "used_model": used_model,
+            "message": payload.message,
+            "response": response_text,
+        }
+    )
 
 
 @router.post("/chat-with-report", response_model=ChatResponse)
@@ -24,88 +123,30 @@ async def chat_with_report(payload: ChatRequest):
     print(f"  - message={payload.message[:50]}...")
     
     try:
-        # Validate inputs
-        if not payload.report_id or not payload.report_id.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="Report ID is required."
-            )
-        
-        if not payload.user_id or not payload.user_id.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="User ID is required."
-            )
-        
-        if not payload.message or not payload.message.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="Message cannot be empty."
-            )
-        
-        # Validate mode
-        valid_modes = ["normal", "explain_simple"]
-        if payload.mode and payload.mode not in valid_modes:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid mode. Must be one of: {', '.join(valid_modes)}"
-            )
-        
-        print(f"✓ DEBUG: Validation passed, fetching report...")
-        record = report_service.get_report(payload.report_id, payload.user_id)
-        print(f"✓ DEBUG: Report fetched - found={record is not None}")
-        
-        if not record:
-            raise HTTPException(
-                status_code=404,
-                detail="Report not found. Please check report ID and user ID are correct."
-            )
-
-        extracted_text = record.get("extracted_text") or ""
-        if not extracted_text.strip():
-            return ChatResponse(
-                report_id=payload.report_id,
-                user_id=payload.user_id,
-                response="Some parts of this report are hard to read. I'll explain what I can see clearly. A doctor can review the full report.",
-                used_model=None,
-                disclaimers=[default_disclaimer()],
-            )
-
-        parsed_values = [item.model_dump() for item in parse_report_text(extracted_text)]
-
-        if not parsed_values:
-            return ChatResponse(
-                report_id=payload.report_id,
-                user_id=payload.user_id,
-                response=safe_refusal(),
-                used_model=None,
-                disclaimers=[default_disclaimer()],
-            )
+        prepared = await _prepare_chat(payload)
+        if isinstance(prepared, ChatResponse):
+            return prepared
+        extracted_text, parsed_values = prepared
 
         explain_simple = payload.mode == "explain_simple"
+        conversation = await _conversation(payload)
 
-        result = groq_service.generate_response(
+        result = await groq_service.generate_response(
             message=payload.message,
             extracted_text=extracted_text,
             parsed_values=parsed_values,
             voice_mode=bool(payload.voice_mode),
             explain_simple=explain_simple,
+            history=conversation,
+            user_id=payload.user_id,
         )
 
         disclaimers = [default_disclaimer()]
         response_text = result["response"] or safe_refusal()
+        if conversation is not None:
+            conversation.add_turn(payload.message, response_text)
         
-        log_response(
-            {
-                "report_id": payload.report_id,
-                "user_id": payload.user_id,
-                "mode": payload.mode,
-                "voice_mode": bool(payload.voice_mode),
-                "used_model": result.get("model"),
-                "message": payload.message,
-                "response": response_text,
-            }
-        )
+        _log_chat(payload, response_text, result.get("model"))
 
         return ChatResponse(
             report_id=payload.report_id,
@@ -126,15 +167,84 @@ async def chat_with_report(payload: ChatRequest):
             detail=f"Failed to generate response: {str(e)}"
         )
 
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat-with-report/stream")
+async def chat_with_report_stream(payload: ChatRequest):
+    """Stream a chat answer as server-sent events.
+
+    Emits `token` events ({"text": ...}) as the model produces cleaned text, then a
+    single `done` event carrying the same fields as /chat-with-report. If the
+    answer breaks off part-way, the stream ends with an `error` event
+    ({"detail": ..., "partial": true}) instead, so the app can offer a retry.
+    """
+    print(f"🔍 DEBUG: Received streaming chat request for report_id={payload.report_id}")
+
+    # Validation and report lookup happen before streaming so errors keep their status codes.
+    prepared = await _prepare_chat(payload)
+
+    async def events():
+        if isinstance(prepared, ChatResponse):
+            yield _sse("token", {"text": prepared.response})
+            yield _sse("done", prepared.model_dump())
+            return
+
+        extracted_text, parsed_values = prepared
+        result: Dict[str, Optional[str]] = {"response": None, "model": None}
+        try:
+            conversation = await _conversation(payload)
+            async for item in groq_service.stream_response(
+                message=payload.message,
+                extracted_text=extracted_text,
+                parsed_values=parsed_values,
+                voice_mode=bool(payload.voice_mode),
+                explain_simple=payload.mode == "explain_simple",
+                history=conversation,
+                user_id=payload.user_id,
+            ):
+                if "delta" in item:
+                    yield _sse("token", {"text": item["delta"]})
+                else:
+                    result = item
+        except Exception as e:
+            print(f"❌ ERROR in chat_with_report_stream: {type(e).__name__}: {str(e)}")
+            yield _sse("error", {"detail": "Failed to generate response"})
+            return
+
+        if result.get("completed") is False:
+            yield _sse("error", {"detail": "The answer was interrupted. Please try again.", "partial": True})
+            return
+
+        response_text = result["response"] or safe_refusal()
+        if conversation is not None:
+            conversation.add_turn(payload.message, response_text)
+        _log_chat(payload, response_text, result.get("model"))
+        yield _sse(
+            "done",
+            ChatResponse(
+                report_id=payload.report_id,
+                user_id=payload.user_id,
+                response=response_text,
+                used_model=result.get("model"),
+                disclaimers=[default_disclaimer()],
+            ).model_dump(),
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/save-chat")
-async def save_chat(
-    report_id: str,
-    user_id: str,
-    messages: list,
-    summary: str = "",
-):
-    """Save chat conversation to Sanity."""
-    if not report_id or not user_id or not messages:
+async def save_chat(payload: SaveChatRequest):
+    """Save chat conversation. Only messages newer than the stored ones are appended."""
+    report_id = payload.report_id.strip()
+    user_id = payload.user_id.strip()
+    if not report_id or not user_id or not payload.messages:
         raise HTTPException(
             status_code=400,
             detail="report_id, user_id, and messages are required."
@@ -142,10 +252,10 @@ async def save_chat(
     
     try:
         success = report_service.save_chat(
-            report_id=report_id.strip(),
-            user_id=user_id.strip(),
-            messages=messages,
-            summary=summary,
+            report_id=report_id,
+            user_id=user_id,
+            messages=[message.model_dump() for message in payload.messages],
+            summary=payload.summary,
         )
         
         if success:
@@ -153,8 +263,10 @@ async def save_chat(
         else:
             raise HTTPException(
                 status_code=500,
-                detail="Failed to save chat to Sanity"
+                detail="Failed to save chat"
             )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -163,8 +275,17 @@ async def save_chat(
 
 
 @router.get("/chat-history/{report_id}/{user_id}")
-async def get_chat_history(report_id: str, user_id: str):
-    """Fetch chat history for a report."""
+async def get_chat_history(
+    report_id: str,
+    user_id: str,
+    offset: Optional[int] = Query(None, ge=0, description="Index of the first message to return"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Maximum number of messages to return"),
+):
+    """Fetch chat history for a report, oldest message first.
+
+    Without paging parameters the whole conversation is returned, as existing
+    clients expect; pass offset and/or limit to read it a page at a time.
+    """
     if not report_id or not user_id:
         raise HTTPException(
             status_code=400,
@@ -175,14 +296,23 @@ async def get_chat_history(report_id: str, user_id: str):
         chat = report_service.get_chat_history(
             report_id=report_id.strip(),
             user_id=user_id.strip(),
+            offset=offset or 0,
+            limit=limit,
         )
         
         if chat:
-            return {"status": "found", "chat": chat}
+            total = chat.get("totalMessages", 0)
+            return {
+                "status": "found",
+                "chat": chat,
+                "offset": offset or 0,
+                "limit": limit,
+                "has_more": (offset or 0) + len(chat.get("messages") or []) < total,
+            }
         else:
             return {"status": "not_found", "chat": None}
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to fetch chat history: {str(e)}"
-        )
\ No newline at end of file
+        )
@@ -3,14 +3,16 @@ Hospitals API Router
 Endpoints for searching and retrieving hospital information
 """
 
-from fastapi import APIRouter, Query, HTTPException, Request
+from fastapi import APIRouter, Depends, Query, HTTPException
 from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel
+import asyncio
 import logging
 import time
 import hashlib
 
 from services.google_places_service import GooglePlacesService
+from utils.rate_limit import RateLimiter, rate_limit
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +24,7 @@ RATE_LIMIT_WINDOW_SECONDS = 60
 RATE_LIMIT_MAX_REQUESTS = 60
 
 _cache: Dict[str, Tuple[float, Any]] = {}
-_rate_limits: Dict[str, Tuple[int, float]] = {}
+_limit_by_ip = Depends(rate_limit(RateLimiter("hospitals", RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW_SECONDS)))
 
 # Global service instance (initialized on first use)
 _google_places_service: Optional[GooglePlacesService] = None
@@ -60,17 +62,6 @@ def _set_cache(key: str, value: Any) -> None:
     _cache[key] = (time.time(), value)
 
 
-def _check_rate_limit(client_ip: str) -> None:
-    now = time.time()
-    count, reset_at = _rate_limits.get(client_ip, (0, now + RATE_LIMIT_WINDOW_SECONDS))
-    if now > reset_at:
-        count, reset_at = 0, now + RATE_LIMIT_WINDOW_SECONDS
-    count += 1
-    _rate_limits[client_ip] = (count, reset_at)
-    if count > RATE_LIMIT_MAX_REQUESTS:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again shortly.")
-
-
 def _filter_hospitals(hospitals: List[Dict[str, Any]], min_rating: float) -> List[Dict[str, Any]]:
     filtered = [h for h in hospitals if "hospital" in [t.lower() for t in h.get("types", [])]]
     if min_rating > 0:
@@ -101,9 +92,8 @@ class NearbyHospitalsResponse(BaseModel):
     radius: int
 
 
-@router.get("/hospitals/nearby", response_model=NearbyHospitalsResponse)
+@router.get("/hospitals/nearby", response_model=NearbyHospitalsResponse, dependencies=[_limit_by_ip])
 async def search_nearby_hospitals(
-    request: Request,
     latitude: float = Query(..., description="User latitude"),
     longitude: float = Query(..., description="User longitude"),
     radius: int = Query(5000, description="Search radius in meters (default 5km)"),
@@ -127,7 +117,6 @@ async def search_nearby_hospitals(
     """
     
     try:
-        _check_rate_limit(request.client.host if request.client else "unknown")
         google_places = get_google_places_service()
     except ValueError as e:
         logger.error(f"Google Places API not configured: {e}")
@@ -175,7 +164,8 @@ async def search_nearby_hospitals(
             hospitals = cached
         else:
             # Search hospitals
-            hospitals = google_places.search_hospitals_nearby(
+            hospitals = await asyncio.to_thread(
+                google_places.search_hospitals_nearby,
                 latitude=latitude,
                 longitude=longitude,
                 radius=radius,
@@ -204,9 +194,8 @@ async def search_nearby_hospitals(
         )
 
 
-@router.get("/hospitals/search", response_model=NearbyHospitalsResponse)
+@router.get("/hospitals/search", response_model=NearbyHospitalsResponse, dependencies=[_limit_by_ip])
 async def search_hospitals(
-    request: Request,
     query: str = Query(..., description="Hospital name or speciality"),
     latitude: Optional[float] = Query(None, description="User latitude"),
     longitude: Optional[float] = Query(None, description="User longitude"),
@@ -219,7 +208,6 @@ async def search_hospitals(
     """
     
     try:
-        _check_rate_limit(request.client.host if request.client else "unknown")
         google_places = get_google_places_service()
     except ValueError:
         raise HTTPException(status_code=500, detail="Hospital search service unavailable")
@@ -245,7 +233,8 @@ async def search_hospitals(
         if cached is not None:
             filtered = cached
         else:
-            hospitals = google_places.search_hospitals_nearby(
+            hospitals = await asyncio.to_thread(
+                google_places.search_hospitals_nearby,
                 latitude=latitude,
                 longitude=longitude,
                 radius=radius,
@@ -272,9 +261,8 @@ async def search_hospitals(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/hospitals/top", response_model=List[HospitalResponse])
+@router.get("/hospitals/top", response_model=List[HospitalResponse], dependencies=[_limit_by_ip])
 async def get_top_hospitals(
-    request: Request,
     latitude: float = Query(17.3850, description="User latitude"),
     longitude: float = Query(78.4867, description="User longitude"),
     radius: int = Query(10000, description="Search radius"),
@@ -286,7 +274,6 @@ async def get_top_hospitals(
     """
     
     try:
-        _check_rate_limit(request.client.host if request.client else "unknown")
         google_places = get_google_places_service()
     except ValueError:
         raise HTTPException(status_code=500, detail="Hospital search service unavailable")
@@ -306,7 +293,8 @@ async def get_top_hospitals(
         if cached is not None:
             return cached
 
-        hospitals = google_places.search_hospitals_nearby(
+        hospitals = await asyncio.to_thread(
+            google_places.search_hospitals_nearby,
             latitude=latitude,
             longitude=longitude,
             radius=radius,
@@ -321,9 +309,8 @@ async def get_top_hospitals(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/hospitals/emergency", response_model=List[HospitalResponse])
+@router.get("/hospitals/emergency", response_model=List[HospitalResponse], dependencies=[_limit_by_ip])
 async def get_emergency_hospitals(
-    request: Request,
     latitude: float = Query(17.3850, description="User latitude"),
     longitude: float = Query(78.4867, description="User longitude"),
     radius: int = Query(5000, description="Search radius"),
@@ -335,7 +322,6 @@ async def get_emergency_hospitals(
     """
     
     try:
-        _check_rate_limit(request.client.host if request.client else "unknown")
         google_places = get_google_places_service()
     except ValueError:
         raise HTTPException(status_code=500, detail="Hospital search service unavailable")
@@ -355,7 +341,8 @@ async def get_emergency_hospitals(
         if cached is not None:
             return cached
 
-        hospitals = google_places.search_hospitals_nearby(
+        hospitals = await asyncio.to_thread(
+            google_places.search_hospitals_nearby,
             latitude=latitude,
             longitude=longitude,
             radius=radius,
@@ -400,14 +387,12 @@ async def hospitals_health_check() -> dict:
         }
 
 
-@router.get("/hospitals/details")
+@router.get("/hospitals/details", dependencies=[_limit_by_ip])
 async def hospital_details(
-    request: Request,
     place_id: str = Query(..., description="Google Place ID"),
 ) -> dict:
     """Get phone number and details for a hospital."""
     try:
-        _check_rate_limit(request.client.host if request.client else "unknown")
         google_places = get_google_places_service()
     except ValueError:
         raise HTTPException(status_code=500, detail="Hospital search service unavailable")
@@ -9,10 +9,12 @@ from fastapi import APIRouter, File, Form, HTTPException, UploadFile
 from models.schemas import ParseReportRequest, ParseReportResponse, UploadReportResponse
 from services.ocr_service import extract_text_from_file
 from services.parser_service import parse_report_text
-from services.sanity_service import SanityService
+from services.report_index import report_indexes
+from services.sanity_service import get_sanity_service
+from routers.summary import summary_prefetcher
 
 router = APIRouter(tags=["reports"])
-service = SanityService()
+service = get_sanity_service()
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "uploads")
 
@@ -74,6 +76,8 @@ async def upload_report(
             parsed_values = []
         else:
             parsed_values = parse_report_text(extracted_text)
+            # Index once at ingestion so chat and summary prompts can retrieve relevant excerpts
+            report_indexes.get(extracted_text)
 
         record = service.store_report(
             user_id=user_id.strip(),
@@ -83,6 +87,16 @@ async def upload_report(
             label=label.strip() if label else None,
         )
 
+        if parsed_values:
+            # Start the summary now so the first dashboard view is a cache hit
+            summary_prefetcher.enqueue(
+                record["report_id"],
+                user_id.strip(),
+                extracted_text,
+                [item.model_dump() for item in parsed_values],
+                document_id=record["document_id"],
+            )
+
         return UploadReportResponse(
             report_id=record["report_id"],
             user_id=user_id.strip(),
@@ -1,12 +1,15 @@
 """
 Summary Router - Endpoints for generating and retrieving report summaries
 """
-from fastapi import APIRouter, HTTPException
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel
 from typing import Optional
 
-from services.sanity_service import SanityService
+from services.sanity_service import get_sanity_service
 from services.summary_service import SummaryService
+from services.summary_prefetch import SummaryPrefetcher
 from services.parser_service import parse_report_text
 
 
@@ -27,16 +30,17 @@ class SummaryResponse(BaseModel):
 
 
 router = APIRouter(tags=["summary"])
-sanity_service = SanityService()
+sanity_service = get_sanity_service()
 summary_service = SummaryService()
+summary_prefetcher = SummaryPrefetcher(summary_service, sanity_service)
 
 
 @router.post("/generate-summary", response_model=SummaryResponse)
-async def generate_summary(request: SummaryRequest):
+async def generate_summary(request: SummaryRequest, response: Response):
     """
     Generate or retrieve cached summary for a medical report.
     
-    - Checks Sanity DB for existing summary first
+    - Reads report text and any existing summary in one Sanity query
     - Uses in-memory cache for recent summaries
     - Applies rate limiting (10 calls/minute per user)
     - Caches generated summaries for 24 hours
@@ -49,43 +53,23 @@ async def generate_summary(request: SummaryRequest):
         if not request.user_id or not request.user_id.strip():
             raise HTTPException(status_code=400, detail="User ID is required")
         
-        # Get report from Sanity
-        report = sanity_service.get_report(request.report_id, request.user_id)
+        # One projected read: report text plus any stored summary
+        report = await asyncio.to_thread(sanity_service.get_report_for_summary, request.report_id, request.user_id)
         
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
-        # Check if summary exists in Sanity DB (unless force regenerate)
-        if not request.force_regenerate:
-            # Fetch full report with summary field
-            import urllib.parse
-            query = f'*[_type == "medicalReport" && reportId == "{request.report_id}" && userId == "{request.user_id}"][0]{{summary, summaryGeneratedAt}}'
-            
-            if sanity_service._can_use_sanity():
-                try:
-                    encoded_query = urllib.parse.quote(query)
-                    url = f"{sanity_service._query_url()}?query={encoded_query}"
-                    headers = {"Authorization": f"Bearer {sanity_service.token}"}
-                    
-                    import httpx
-                    with httpx.Client(timeout=10.0) as client:
-                        response = client.get(url, headers=headers)
-                        response.raise_for_status()
-                        result = response.json().get("result")
-                        
-                        if result and result.get("summary"):
-                            print(f"✓ Found existing summary in Sanity DB")
-                            return SummaryResponse(
-                                report_id=request.report_id,
-                                summary=result["summary"],
-                                cached=True,
-                                generated_at=result.get("summaryGeneratedAt"),
-                                source="sanity_db"
-                            )
-                except Exception as e:
-                    print(f"⚠️ Failed to check Sanity for summary: {e}")
-        
-        # Get extracted text
+        # Return the stored summary unless regeneration was requested
+        if not request.force_regenerate and report.get("summary"):
+            print(f"✓ Found existing summary in Sanity DB")
+            return SummaryResponse(
+                report_id=request.report_id,
+                summary=report["summary"],
+                cached=True,
+                generated_at=report.get("summary_generated_at"),
+                source="sanity_db"
+            )
+        
         extracted_text = report.get("extracted_text", "")
         
         if not extracted_text.strip():
@@ -108,7 +92,9 @@ async def generate_summary(request: SummaryRequest):
         
         # Check for errors
         if result.get("error"):
-            if "Rate limit" in result.get("error", ""):
+            # Rate limit or token budget exhausted: tell the client when to retry
+            if result.get("wait_time") is not None:
+                response.headers["Retry-After"] = str(max(1, result.get("wait_time") or 0))
                 return SummaryResponse(
                     report_id=request.report_id,
                     summary=None,
@@ -126,7 +112,8 @@ async def generate_summary(request: SummaryRequest):
             sanity_service.update_report_summary(
                 request.report_id,
                 request.user_id,
-                summary_text
+                summary_text,
+                document_id=report.get("document_id")
             )
         
         return SummaryResponse(
@@ -156,31 +143,19 @@ async def get_report_summary(report_id: str, user_id: str):
         if not report_id or not user_id:
             raise HTTPException(status_code=400, detail="Report ID and User ID are required")
         
-        # Query Sanity for summary
-        import urllib.parse
-        query = f'*[_type == "medicalReport" && reportId == "{report_id}" && userId == "{user_id}"][0]{{summary, summaryGeneratedAt}}'
+        if not sanity_service.storage_available():
+            return {"summary": None, "message": "Storage not configured"}
         
-        if not sanity_service._can_use_sanity():
-            return {"summary": None, "message": "Sanity not configured"}
+        result = sanity_service.get_report_summary(report_id, user_id)
         
-        encoded_query = urllib.parse.quote(query)
-        url = f"{sanity_service._query_url()}?query={encoded_query}"
-        headers = {"Authorization": f"Bearer {sanity_service.token}"}
+        if not result:
+            raise HTTPException(status_code=404, detail="Report not found")
         
-        import httpx
-        with httpx.Client(timeout=10.0) as client:
-            response = client.get(url, headers=headers)
-            response.raise_for_status()
-            result = response.json().get("result")
-            
-            if not result:
-                raise HTTPException(status_code=404, detail="Report not found")
-            
-            return {
-                "report_id": report_id,
-                "summary": result.get("summary"),
-                "generated_at": result.get("summaryGeneratedAt")
-            }
+        return {
+            "report_id": report_id,
+            "summary": result.get("summary"),
+            "generated_at": result.get("summaryGeneratedAt")
+        }
             
     except HTTPException:
         raise
@@ -5,39 +5,20 @@ Handles daily task generation, retrieval, and updates
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
-import os
+from typing import Any, Dict, List, Optional
+
+from models.schemas import GeneratedTaskResponse, TaskCategory, TaskPriority, UserHealthData
+from services.task_generator import get_task_generator
+from services.task_store import get_task_store
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
 # ===== MODELS =====
 
-class UserHealthData(BaseModel):
-    firstName: Optional[str] = None
-    conditions: Optional[List[str]] = None
-    medications: Optional[List[str]] = None
-    allergies: Optional[List[str]] = None
-    bloodPressure: Optional[str] = None
-    bloodSugar: Optional[float] = None
-    weight: Optional[float] = None
-    age: Optional[int] = None
-    activityLevel: Optional[str] = None
-
 class GenerateTasksRequest(BaseModel):
     clerkId: str
     userHealthData: UserHealthData
 
-class GeneratedTaskResponse(BaseModel):
-    title: str
-    description: Optional[str] = None
-    priority: str  # low, medium, high
-    category: str  # medication, exercise, appointment, health-check, nutrition, general
-    dueDate: Optional[str] = None
-    generatedByGroq: bool = True
-    isCompleted: bool = False
-    clerkId: str
-
 class GenerateTasksResponse(BaseModel):
     tasks: List[GeneratedTaskResponse]
     message: str
@@ -64,150 +45,61 @@ class FetchTasksResponse(BaseModel):
     total: int
     message: str
 
-# ===== SANITY CLIENT =====
-
-def get_sanity_client():
-    """Get Sanity client for API calls"""
-    try:
-        import sys
-        # Try to import sanity module
-        sanity_module = __import__('sanity', fromlist=['Client'])
-        Client = getattr(sanity_module, 'Client', None)
-        
-        if not Client:
-            # Fallback - use requests to make direct API calls
-            return None
-        
-        project_id = os.getenv("SANITY_PROJECT_ID", "q5maqr3y")
-        dataset = os.getenv("SANITY_DATASET", "production")
-        api_token = os.getenv("SANITY_API_TOKEN")
-        
-        client = Client(
-            projectId=project_id,
-            dataset=dataset,
-            apiVersion="2024-01-01",
-            token=api_token,
-            useCdn=False
-        )
-        return client
-    except Exception as e:
-        print(f"Error initializing Sanity client: {e}")
-        return None
+class CreateTaskItem(BaseModel):
+    title: str = Field(..., min_length=1, max_length=200)
+    description: Optional[str] = None
+    priority: TaskPriority = "medium"
+    category: TaskCategory = "general"
+    dueDate: Optional[str] = None
+    generatedByGroq: bool = False
 
-# ===== GROQ INTEGRATION =====
+class CreateTasksRequest(BaseModel):
+    clerkId: str = Field(..., min_length=1)
+    tasks: List[CreateTaskItem] = Field(..., min_length=1, max_length=50)
 
-def generate_tasks_with_groq(user_health_data: UserHealthData) -> List[dict]:
-    """
-    Generate personalized daily tasks using Groq AI
-    
-    This function creates a prompt based on user health data and uses Groq
-    to generate relevant health tasks.
-    """
-    try:
-        from groq import Groq  # type: ignore
-        import os
-        
-        # Initialize Groq client
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        
-        # Build user profile context
-        profile_text = "User Health Profile:\n"
-        if user_health_data.firstName:
-            profile_text += f"- Name: {user_health_data.firstName}\n"
-        if user_health_data.age:
-            profile_text += f"- Age: {user_health_data.age}\n"
-        if user_health_data.weight:
-            profile_text += f"- Weight: {user_health_data.weight} kg\n"
-        if user_health_data.bloodPressure:
-            profile_text += f"- Blood Pressure: {user_health_data.bloodPressure}\n"
-        if user_health_data.bloodSugar:
-            profile_text += f"- Blood Sugar: {user_health_data.bloodSugar} mg/dL\n"
-        if user_health_data.activityLevel:
-            profile_text += f"- Activity Level: {user_health_data.activityLevel}\n"
-        if user_health_data.conditions:
-            profile_text += f"- Health Conditions: {', '.join(user_health_data.conditions)}\n"
-        if user_health_data.medications:
-            profile_text += f"- Current Medications: {', '.join(user_health_data.medications)}\n"
-        if user_health_data.allergies:
-            profile_text += f"- Allergies: {', '.join(user_health_data.allergies)}\n"
-        
-        # Create prompt for Groq
-        prompt = f"""{profile_text}
+class CompleteTaskRequest(BaseModel):
+    clerkId: str = Field(..., min_length=1)
+    isCompleted: bool = True
 
-Based on this health profile, generate exactly 3 personalized daily health tasks for today.
+class TaskUpdate(BaseModel):
+    id: str = Field(..., min_length=1)
+    title: Optional[str] = Field(default=None, min_length=1, max_length=200)
+    description: Optional[str] = None
+    priority: Optional[TaskPriority] = None
+    category: Optional[TaskCategory] = None
+    dueDate: Optional[str] = None
+    isCompleted: Optional[bool] = None
 
-Return the tasks in this exact JSON format (no markdown, just raw JSON):
-{{
-  "tasks": [
-    {{
-      "title": "Task title",
-      "description": "Brief description",
-      "priority": "high|medium|low",
-      "category": "medication|exercise|appointment|health-check|nutrition|general"
-    }},
-    ...
-  ]
-}}
+class BulkUpdateTasksRequest(BaseModel):
+    clerkId: str = Field(..., min_length=1)
+    updates: List[TaskUpdate] = Field(..., min_length=1, max_length=100)
 
-Make sure tasks are:
-1. Personalized to the user's health conditions
-2. Realistic and achievable in one day
-3. Focused on medication compliance, exercise, nutrition, and health monitoring
-4. Clear and actionable
-5. Include at least one medication reminder if medications are listed
+class UpdateTasksResponse(BaseModel):
+    updated: List[str]
+    message: str
 
-Generate exactly 3 tasks. No more, no less."""
+def _task_response(task: Dict[str, Any]) -> DailyTaskResponse:
+    return DailyTaskResponse(
+        **{
+            "id": task.get("_id"),  # Map Sanity's _id to our id field
+            "title": task.get("title"),
+            "description": task.get("description"),
+            "priority": task.get("priority", "medium"),
+            "category": task.get("category", "general"),
+            "isCompleted": task.get("isCompleted", False),
+            "dueDate": task.get("dueDate"),
+            "completedAt": task.get("completedAt"),
+            "generatedByGroq": task.get("generatedByGroq", False),
+            "createdAt": task.get("createdAt"),
+            "updatedAt": task.get("updatedAt")
+        }
+    )
 
-        # Call Groq API
-        print(f"🤖 Calling Groq API with model: mixtral-8x7b-32768")
-        print(f"📝 Prompt length: {len(prompt)} characters")
-        
-        message = client.messages.create(
-            model="mixtral-8x7b-32768",
-            max_tokens=1024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        
-        print(f"✅ Groq API responded successfully")
-        
-        # Parse response
-        response_text = message.content[0].text
-        print(f"📄 Response text length: {len(response_text)} characters")
-        
-        # Extract JSON from response (handle markdown code blocks)
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0]
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0]
-        
-        import json
-        parsed = json.loads(response_text.strip())
-        print(f"✅ Successfully parsed JSON with {len(parsed.get('tasks', []))} tasks")
-        
-        # Add dueDate to tasks (today at specific times)
-        today = datetime.now()
-        tasks_with_dates = []
-        
-        for idx, task in enumerate(parsed.get("tasks", [])):
-            # Stagger tasks throughout the day
-            task["dueDate"] = today.isoformat()
-            tasks_with_dates.append(task)
-            print(f"  📌 Task {idx+1}: {task.get('title')} (priority: {task.get('priority')}, category: {task.get('category')})")
-        
-        print(f"📊 Generated {len(tasks_with_dates)} tasks successfully")
-        return tasks_with_dates
-        
-    except Exception as e:
-        print(f"❌ Error generating tasks with Groq: {e}")
-        import traceback
-        traceback.print_exc()
-        # Return empty list on error - frontend will use defaults
-        return []
+def _require_task_store():
+    store = get_task_store()
+    if not store.is_available():
+        raise HTTPException(status_code=500, detail="Sanity credentials not configured")
+    return store
 
 # ===== ENDPOINTS =====
 
@@ -218,109 +110,27 @@ async def get_today_tasks(clerk_id: str) -> FetchTasksResponse:
     
     This endpoint:
     1. Takes a clerk_id (user ID)
-    2. Queries Sanity for today's incomplete tasks
+    2. Returns today's incomplete tasks from a per-user, per-day cache, or
+       queries Sanity on a miss (tasks written through this router or seen
+       by the Sanity listener invalidate the cache)
     3. Returns tasks sorted by priority
     """
-    try:
-        if not clerk_id:
-            raise HTTPException(status_code=400, detail="clerk_id is required")
-        
-        # Get credentials
-        project_id = os.getenv("SANITY_PROJECT_ID", "q5maqr3y")
-        dataset = os.getenv("SANITY_DATASET", "production")
-        api_token = os.getenv("SANITY_API_TOKEN")
-        
-        if not api_token:
-            print("⚠️ SANITY_API_TOKEN not set, returning empty tasks")
-            return FetchTasksResponse(
-                tasks=[],
-                total=0,
-                message="Sanity credentials not configured"
-            )
-        
-        # Get today's date range
-        from datetime import datetime, timedelta
-        today = datetime.now()
-        today_start = today.replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + "Z"
-        tomorrow_start = (today + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + "Z"
-        
-        print(f"🔍 Fetching tasks for clerk_id: {clerk_id}")
-        print(f"📅 Date range: {today_start} to {tomorrow_start}")
-        
-        # Build GROQ query - Sanity includes _id by default
-        groq_query = f"""*[_type == "dailyTask" && clerkId == "{clerk_id}" && 
-                        (dueDate == null || (dueDate >= "{today_start}" && dueDate < "{tomorrow_start}")) && 
-                        isCompleted == false] | order(priority desc, dueDate asc)"""
-        
-        print(f"📋 GROQ Query: {groq_query}")
-        
-        # Make HTTP request to Sanity API
-        import requests  # type: ignore
-        import urllib.parse
-        
-        encoded_query = urllib.parse.quote(groq_query)
-        sanity_url = f"https://{project_id}.api.sanity.io/v2024-01-01/data/query/{dataset}?query={encoded_query}"
-        
-        headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Accept": "application/json"
-        }
-        
-        response = requests.get(sanity_url, headers=headers, timeout=10)
-        
-        if response.status_code != 200:
-            print(f"⚠️ Sanity API error: {response.status_code}")
-            print(f"Response: {response.text}")
-            return FetchTasksResponse(
-                tasks=[],
-                total=0,
-                message="Failed to fetch from Sanity"
-            )
-        
-        data = response.json()
-        tasks = data.get("result", [])
-        
-        print(f"✅ Sanity returned {len(tasks)} tasks for {clerk_id}")
-        print(f"📦 Raw Sanity response: {tasks}")
-        
-        if tasks:
-            print(f"📌 Task details:")
-            for task in tasks:
-                print(f"  - _id={task.get('_id')}, title={task.get('title')}: dueDate={task.get('dueDate')}, isCompleted={task.get('isCompleted')}, priority={task.get('priority')}")
-        
-        # Format response
-        formatted_tasks = [
-            DailyTaskResponse(
-                **{
-                    "id": task.get("_id"),  # Map Sanity's _id to our id field
-                    "title": task.get("title"),
-                    "description": task.get("description"),
-                    "priority": task.get("priority", "medium"),
-                    "category": task.get("category", "general"),
-                    "isCompleted": task.get("isCompleted", False),
-                    "dueDate": task.get("dueDate"),
-                    "completedAt": task.get("completedAt"),
-                    "generatedByGroq": task.get("generatedByGroq", False),
-                    "createdAt": task.get("createdAt"),
-                    "updatedAt": task.get("updatedAt")
-                }
-            )
-            for task in tasks
-        ]
-        
-        print(f"✅ Fetched {len(formatted_tasks)} tasks from Sanity for user {clerk_id}")
-        print(f"📋 Formatted tasks with IDs: {[{'_id': t.id, 'title': t.title} for t in formatted_tasks]}")
-        
-        response_data = FetchTasksResponse(
-            tasks=formatted_tasks,
-            total=len(formatted_tasks),
-            message=f"Retrieved {len(formatted_tasks)} tasks for today"
+    if not clerk_id:
+        raise HTTPException(status_code=400, detail="clerk_id is required")
+
+    store = get_task_store()
+    if not store.is_available():
+        print("⚠️ SANITY_API_TOKEN not set, returning empty tasks")
+        return FetchTasksResponse(
+            tasks=[],
+            total=0,
+            message="Sanity credentials not configured"
         )
-        print(f"🔄 Returning JSON response: {response_data.json()}")
-        return response_data
-            
+
+    try:
+        tasks = await store.today(clerk_id)
     except Exception as e:
-        print(f"Error fetching tasks: {e}")
+        print(f"Error fetching tasks: {type(e).__name__}: {str(e)}")
         # Return empty list instead of error - frontend will handle fallback
         return FetchTasksResponse(
             tasks=[],
@@ -328,6 +138,58 @@ async def get_today_tasks(clerk_id: str) -> FetchTasksResponse:
             message=f"Error: {str(e)}"
         )
 
+    formatted_tasks = [_task_response(task) for task in tasks]
+    return FetchTasksResponse(
+        tasks=formatted_tasks,
+        total=len(formatted_tasks),
+        message=f"Retrieved {len(formatted_tasks)} tasks for today"
+    )
+
+@router.post("", response_model=FetchTasksResponse)
+async def create_tasks(request: CreateTasksRequest) -> FetchTasksResponse:
+    """Create tasks for a user in one Sanity transaction."""
+    store = _require_task_store()
+    try:
+        docs = await store.create_tasks(request.clerkId, [task.model_dump() for task in request.tasks])
+    except Exception as e:
+        print(f"❌ Failed to create tasks for {request.clerkId}: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to create tasks")
+
+    formatted_tasks = [_task_response(doc) for doc in docs]
+    return FetchTasksResponse(
+        tasks=formatted_tasks,
+        total=len(formatted_tasks),
+        message=f"Created {len(formatted_tasks)} tasks"
+    )
+
+@router.post("/{task_id}/complete", response_model=UpdateTasksResponse)
+async def complete_task(task_id: str, request: CompleteTaskRequest) -> UpdateTasksResponse:
+    """Mark one of the user's tasks as completed (or not completed again)."""
+    store = _require_task_store()
+    try:
+        updated = await store.complete_task(request.clerkId, task_id, request.isCompleted)
+    except Exception as e:
+        print(f"❌ Failed to update task {task_id}: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to update task")
+
+    if not updated:
+        raise HTTPException(status_code=404, detail="Task not found")
+    state = "completed" if request.isCompleted else "not completed"
+    return UpdateTasksResponse(updated=[task_id], message=f"Task marked {state}")
+
+@router.patch("/bulk", response_model=UpdateTasksResponse)
+async def bulk_update_tasks(request: BulkUpdateTasksRequest) -> UpdateTasksResponse:
+    """Update several of the user's tasks in one Sanity transaction; ids the user does not own are skipped."""
+    store = _require_task_store()
+    updates = [update.model_dump(exclude_unset=True) for update in request.updates]
+    try:
+        updated = await store.update_tasks(request.clerkId, updates)
+    except Exception as e:
+        print(f"❌ Failed to update tasks for {request.clerkId}: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to update tasks")
+
+    return UpdateTasksResponse(updated=updated, message=f"Updated {len(updated)} of {len(updates)} tasks")
+
 @router.post("/generate-groq", response_model=GenerateTasksResponse)
 async def generate_groq_tasks(
     request: GenerateTasksRequest,
@@ -338,7 +200,8 @@ async def generate_groq_tasks(
     
     This endpoint:
     1. Takes user health data
-    2. Calls Groq AI to generate personalized tasks
+    2. Builds personalized tasks from the local task rules, or returns Groq AI
+       tasks for profiles the rules do not cover (generated in the background)
     3. Returns structured task list ready to be saved to Sanity
     
     The frontend should then call the Sanity API to save these tasks.
@@ -354,10 +217,10 @@ async def generate_groq_tasks(
         print(f"📋 Health Data: {request.userHealthData}")
         print(f"{'='*60}\n")
         
-        # Generate tasks with Groq
-        generated_tasks = generate_tasks_with_groq(request.userHealthData)
+        # Rule-based tasks, or Groq tasks for novel profiles (cached per health profile and day)
+        generated_tasks = await get_task_generator().generate(request.userHealthData, request.clerkId)
         
-        # If Groq fails, provide default tasks
+        # If generation fails, provide default tasks
         if not generated_tasks:
             print(f"⚠️ Groq generation failed, using default tasks")
             generated_tasks = get_default_tasks()
@@ -365,10 +228,10 @@ async def generate_groq_tasks(
         # Add clerkId to each task
         tasks_with_clerk_id = [
             {
+                "generatedByGroq": True,
                 **task,
                 "clerkId": request.clerkId,
-                "isCompleted": False,
-                "generatedByGroq": True
+                "isCompleted": False
             }
             for task in generated_tasks
         ]
@@ -377,9 +240,10 @@ async def generate_groq_tasks(
         print(f"✅ GENERATION COMPLETE - {len(tasks_with_clerk_id)} TASKS")
         print(f"{'='*60}\n")
         
+        source = "Groq AI" if any(task["generatedByGroq"] for task in tasks_with_clerk_id) else "health rules"
         return GenerateTasksResponse(
             tasks=tasks_with_clerk_id,
-            message=f"Generated {len(tasks_with_clerk_id)} personalized tasks using Groq AI"
+            message=f"Generated {len(tasks_with_clerk_id)} personalized tasks using {source}"
         )
         
     except HTTPException as e:
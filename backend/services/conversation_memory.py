@@ -0,0 +1,172 @@
+"""
+Conversation Memory
+Server-side state for multi-turn chat about a report. Each (report, user)
+conversation keeps its last few turns verbatim and folds older turns into a
+compact extractive summary, so the history sent to the model stays the same
+size however long the conversation gets.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import metrics
+from utils.token_budget import count_tokens, truncate_to_tokens
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# Openers and pronouns that only make sense with the earlier turns in view.
+_FOLLOW_UP_START = re.compile(r"^(and|but|so|also|then|what about|how about|why|what else|tell me more)\b")
+_FOLLOW_UP_WORDS = re.compile(r"\b(it|its|that|those|they|them|these|he|she|this one|the same|more|else)\b")
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question leans on earlier turns ("why is that?", "what about the second one?")."""
+    text = question.strip().lower()
+    return bool(_FOLLOW_UP_START.search(text) or _FOLLOW_UP_WORDS.search(text))
+
+
+def compact_turn(question: str, answer: str, max_words: int = 25) -> str:
+    """One-line extractive digest of a turn: the question and the first sentence of the answer."""
+    def clip(text: str) -> str:
+        words = text.split()
+        return " ".join(words[:max_words]) + (" ..." if len(words) > max_words else "")
+
+    first_sentence = _SENTENCE_END.split(answer.strip(), maxsplit=1)[0] if answer.strip() else ""
+    return f"- Patient asked: {clip(question)} | Answer: {clip(first_sentence)}"
+
+
+class Conversation:
+    """Recent turns verbatim plus a bounded digest of everything older."""
+
+    def __init__(self, recent_turns: int, summary_tokens: int) -> None:
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.turns: List[Tuple[str, str]] = []
+        self.summary_lines: List[str] = []
+        self._lock = threading.Lock()
+
+    def add_turn(self, question: str, answer: str) -> None:
+        with self._lock:
+            self.turns.append((question, answer))
+            while len(self.turns) > self.recent_turns:
+                old_question, old_answer = self.turns.pop(0)
+                self.summary_lines.append(compact_turn(old_question, old_answer))
+            # Oldest digest lines go first once the summary outgrows its budget.
+            while len(self.summary_lines) > 1 and count_tokens("\n".join(self.summary_lines)) > self.summary_tokens:
+                self.summary_lines.pop(0)
+
+    def is_empty(self) -> bool:
+        return not self.turns and not self.summary_lines
+
+    def context(self, max_tokens: int) -> Dict[str, Any]:
+        """History that fits max_tokens: {"summary": str, "messages": [{"role", "content"}]}.
+
+        Recent turns are kept verbatim newest first; turns that do not fit are
+        added to the summary in compact form instead.
+        """
+        with self._lock:
+            turns = list(self.turns)
+            summary_lines = list(self.summary_lines)
+
+        kept: List[Tuple[str, str]] = []
+        used = count_tokens("\n".join(summary_lines))
+        for index in range(len(turns) - 1, -1, -1):
+            question, answer = turns[index]
+            cost = count_tokens(question) + count_tokens(answer)
+            if used + cost > max_tokens:
+                summary_lines += [compact_turn(q, a) for q, a in turns[: index + 1]]
+                break
+            kept.insert(0, (question, answer))
+            used += cost
+
+        summary = "\n".join(summary_lines)
+        summary_budget = max_tokens - sum(count_tokens(q) + count_tokens(a) for q, a in kept)
+        messages: List[Dict[str, str]] = []
+        for question, answer in kept:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return {"summary": truncate_to_tokens(summary, summary_budget), "messages": messages}
+
+
+class ConversationMemory:
+    """Bounded in-memory store of conversations, hydrated from saved chat history on first use."""
+
+    HYDRATE_MESSAGES = 40
+
+    def __init__(
+        self,
+        history_loader=None,
+        max_conversations: int = 1000,
+        recent_turns: Optional[int] = None,
+        summary_tokens: int = 200,
+    ) -> None:
+        self.history_loader = history_loader
+        self.max_conversations = max_conversations
+        self.recent_turns = recent_turns or int(os.getenv("CHAT_MEMORY_TURNS", "2"))
+        self.summary_tokens = summary_tokens
+        self._conversations: "OrderedDict[Tuple[str, str], Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("chat_memory", self.stats)
+
+    def _new_conversation(self) -> Conversation:
+        return Conversation(self.recent_turns, self.summary_tokens)
+
+    def _load_saved_turns(self, report_id: str, user_id: str) -> List[Tuple[str, str]]:
+        """Pair up the tail of the saved chat history into (question, answer) turns."""
+        if self.history_loader is None:
+            return []
+        try:
+            head = self.history_loader(report_id, user_id, 0, 1)
+            if not head:
+                return []
+            total = head.get("totalMessages") or 0
+            chat = self.history_loader(report_id, user_id, max(0, total - self.HYDRATE_MESSAGES), self.HYDRATE_MESSAGES)
+        except Exception as e:
+            print(f"⚠️ Could not load chat history for memory: {type(e).__name__}: {str(e)}")
+            return []
+
+        turns: List[Tuple[str, str]] = []
+        pending_question: Optional[str] = None
+        for message in (chat or {}).get("messages") or []:
+            role, text = message.get("role"), (message.get("text") or "").strip()
+            if role == "user":
+                pending_question = text
+            elif role == "assistant" and pending_question is not None:
+                turns.append((pending_question, text))
+                pending_question = None
+        return turns
+
+    async def get(self, report_id: str, user_id: str) -> Conversation:
+        key = (report_id, user_id)
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is not None:
+                self._conversations.move_to_end(key)
+                return conversation
+
+        # Storage reads are blocking; keep them off the event loop.
+        turns = await asyncio.to_thread(self._load_saved_turns, report_id, user_id)
+        hydrated = self._new_conversation()
+        for question, answer in turns:
+            hydrated.add_turn(question, answer)
+
+        with self._lock:
+            conversation = self._conversations.setdefault(key, hydrated)
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        return conversation
+
+    def forget(self, report_id: str, user_id: str) -> None:
+        with self._lock:
+            self._conversations.pop((report_id, user_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"conversations": len(self._conversations)}
@@ -9,6 +9,8 @@ import requests
 from typing import Optional, Dict, List, Any
 from datetime import datetime
 
+from utils.single_flight import SingleFlight
+
 GOOGLE_PLACES_BASE_URL = "https://maps.googleapis.com/maps/api/place"
 
 
@@ -48,6 +50,7 @@ class GooglePlacesService:
         if not self.api_key:
             raise ValueError("GOOGLE_PLACES_API_KEY not set in environment variables")
         self.base_url = GOOGLE_PLACES_BASE_URL
+        self._searches = SingleFlight("hospital_search")
 
     def nearby_search(
         self,
@@ -193,7 +196,8 @@ class GooglePlacesService:
         max_results: int = 20,
     ) -> List[Dict[str, Any]]:
         """
-        Complete workflow: search nearby hospitals and parse results
+        Complete workflow: search nearby hospitals and parse results.
+        Concurrent searches for the same area share one set of API calls.
         
         Args:
             latitude: User latitude
@@ -204,6 +208,12 @@ class GooglePlacesService:
         Returns:
             List of standardized hospital objects
         """
+        key = f"{round(latitude, 5)}|{round(longitude, 5)}|{radius}|{max_results}"
+        return self._searches.do(key, self._search_hospitals_nearby, latitude, longitude, radius, max_results)
+
+    def _search_hospitals_nearby(
+        self, latitude: float, longitude: float, radius: int, max_results: int
+    ) -> List[Dict[str, Any]]:
         hospitals = []
         page_token = None
         
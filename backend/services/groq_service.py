@@ -1,103 +1,313 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-import httpx
+from services.conversation_memory import Conversation, is_follow_up
+from services.llm_client import get_llm_client
+from services.model_router import ModelRouter
+from services.prompt_builder import format_value, report_contexts, system_prompt
+from services.report_index import report_indexes, values_named_in
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache
+from services.token_quota import estimate_tokens, get_token_quota, prompt_tokens, usage_tokens
+from utils.safety import build_fallback_response
+from utils.token_budget import PromptBudget, count_tokens
 
-from utils.safety import build_system_prompt, build_fallback_response
+
+MAX_RESPONSE_CHARS = 1500
+
+CHAT_ANSWER_TOKENS = 600
+
+# Bump whenever the system/user prompt templates change so cached answers are not reused.
+PROMPT_VERSION = "3"
+
+
+class ResponseCleaner:
+    """Incremental cleanup of model output for display.
+
+    Markdown table rows (lines starting with | or ---) are dropped, runs of blank
+    lines collapse into one paragraph break, leading/trailing whitespace is trimmed
+    and the text is capped at MAX_RESPONSE_CHARS. Text can be fed in arbitrary
+    chunks; each feed() returns what is safe to show so far.
+    """
+
+    def __init__(self, max_chars: int = MAX_RESPONSE_CHARS) -> None:
+        self.max_chars = max_chars
+        self.length = 0
+        self.truncated = False
+        self._started = False  # any text emitted yet
+        self._paragraph_break = False  # blank or table line since the last text line
+        self._line_mode: Optional[str] = None  # None (undecided), "text" or "skip"
+        self._line_prefix = ""  # undecided start of the current line
+        self._trailing_space = ""  # held back until more text follows on the line
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for char in chunk:
+            if self.truncated:
+                break
+            if char == "\n":
+                self._end_line(out)
+            elif self._line_mode == "skip":
+                continue
+            elif self._line_mode == "text":
+                if char.isspace():
+                    self._trailing_space += char
+                else:
+                    self._emit(out, self._trailing_space + char)
+                    self._trailing_space = ""
+            else:
+                self._line_prefix += char
+                self._classify_line(out, final=False)
+        return "".join(out)
+
+    def finish(self) -> str:
+        out: List[str] = []
+        if not self.truncated:
+            self._end_line(out)
+        return "".join(out)
+
+    def _classify_line(self, out: List[str], final: bool) -> None:
+        text = self._line_prefix.strip() if final else self._line_prefix.lstrip()
+        if not text:
+            return
+        if text.startswith("|") or text.startswith("---"):
+            self._line_mode = "skip"
+        elif "---".startswith(text) and not final:
+            return  # "-" or "--": wait to see whether this is a table rule
+        else:
+            self._line_mode = "text"
+            if self._started:
+                self._emit(out, "\n\n" if self._paragraph_break else "\n")
+            self._paragraph_break = False
+            body = text.rstrip()
+            self._trailing_space = text[len(body):]
+            self._emit(out, body)
+
+    def _end_line(self, out: List[str]) -> None:
+        if self._line_mode is None:
+            self._classify_line(out, final=True)
+        if self._line_mode != "text":
+            self._paragraph_break = True
+        self._line_mode = None
+        self._line_prefix = ""
+        self._trailing_space = ""
+
+    def _emit(self, out: List[str], text: str) -> None:
+        if self.truncated or not text:
+            return
+        room = self.max_chars - self.length
+        if len(text) > room:
+            out.append(text[:room] + "...")
+            self.length = self.max_chars
+            self.truncated = True
+            return
+        out.append(text)
+        self.length += len(text)
+        self._started = True
+
+
+def clean_response(content: str) -> str:
+    """Batch form of ResponseCleaner."""
+    cleaner = ResponseCleaner()
+    return cleaner.feed(content) + cleaner.finish()
 
 
 class GroqService:
     def __init__(self) -> None:
         self.api_key = os.getenv("GROQ_API_KEY")
-        self.model = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+        self.llm = get_llm_client()
+        self.router = ModelRouter(self.llm)
+        self.quota = get_token_quota()
+        # Prompt budgets are planned for the large tier; both tiers share the same input limit.
+        self.model = self.router.large_model
+        self.context_tokens = int(os.getenv("CHAT_CONTEXT_TOKENS", "400"))
+        self.history_tokens = int(os.getenv("CHAT_HISTORY_TOKENS", "600"))
+        self.response_cache: Optional[ResponseCache] = (
+            ResponseCache() if os.getenv("RESPONSE_CACHE", "true").lower() != "false" else None
+        )
+        self.semantic_cache: Optional[SemanticCache] = (
+            SemanticCache() if os.getenv("SEMANTIC_CACHE", "true").lower() != "false" else None
+        )
 
     def _can_call(self) -> bool:
         return bool(self.api_key)
     
-    def _build_user_prompt(self, extracted_text: str, parsed_values: List[Dict[str, Any]], user_message: str) -> str:
-        """Build a well-structured user prompt for Groq AI with medical context."""
-        
-        # Format parsed values in a clear, readable way
-        formatted_values = "\n".join(
-            f"  • {item.get('test_name', 'Unknown Test')}: "
-            f"{item.get('value', 'N/A')} {item.get('unit', '')}"
-            f" (Range: {item.get('reference_range', 'Not specified')})"
-            f" - {item.get('classification', '')}"
-            for item in parsed_values[:10]  # Limit to first 10 for token efficiency
-        )
+    def _build_user_prompt(
+        self,
+        extracted_text: str,
+        parsed_values: List[Dict[str, Any]],
+        user_message: str,
+        budget: PromptBudget,
+        history: Optional[Conversation] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """Build the variable part of the prompt: question-specific excerpts, history digest and the question.
+
+        Returns the prompt and the recent conversation turns to send before it.
+        """
         
-        prompt_parts = [
-            "=== MEDICAL REPORT DATA ===",
-            "",
-            "Raw Report Text (extracted from uploaded document):",
-            f"{extracted_text[:1500]}...",  # Limit extracted text to prevent token overflow
-            "",
-            "Parsed Test Results:",
-            formatted_values if formatted_values else "  (No values parsed from report)",
+        # Results the question names, even if they did not fit in the report context block
+        named_values = values_named_in(user_message, parsed_values)[:10]
+        values_parts: List[str] = []
+        if named_values:
+            values_parts = ["", "Results mentioned in the question:", *(format_value(item) for item in named_values)]
+
+        header = ["=== RELEVANT REPORT EXCERPTS ==="]
+        question_parts = [
             "",
             "=== PATIENT'S QUESTION ===",
             f"{user_message}",
-            "",
-            "=== INSTRUCTIONS ===",
-            "- Base your answer ONLY on the medical report data provided above",
-            "- If the report doesn't contain information to answer the question, say so gently",
-            "- Never invent or assume medical information not in the report",
-            "- Remember: EXPLAIN, don't DIAGNOSE",
-            "- Always end with encouragement to discuss with their healthcare provider",
         ]
-        
-        return "\n".join(prompt_parts)
+        budget.reserve("prompt", "\n".join(header + values_parts + question_parts))
 
-    def generate_response(
+        history_messages: List[Dict[str, str]] = []
+        summary_parts: List[str] = []
+        if history is not None and not history.is_empty():
+            history_tokens = budget.allocate(
+                {"report": 0.6, "history": 0.4}, caps={"history": self.history_tokens}
+            )["history"]
+            context = history.context(history_tokens)
+            history_messages = context["messages"]
+            if context["summary"]:
+                summary_parts = ["", "=== EARLIER IN THIS CONVERSATION ===", context["summary"]]
+            budget.reserve("history", "\n".join(summary_parts), *(m["content"] for m in history_messages))
+
+        # The header chunk is already in the report context block
+        report_tokens = budget.allocate({"report": 1.0}, caps={"report": self.context_tokens})["report"]
+        excerpts = report_indexes.get(extracted_text).select_chunks(user_message, report_tokens, include_header=False)
+        report_text = "\n...\n".join(excerpts) or "  (Nothing further in the report matches this question)"
+        budget.reserve("report", report_text)
+
+        user_prompt = "\n".join(header + [report_text] + values_parts + summary_parts + question_parts)
+        return user_prompt, history_messages
+
+    def _build_payload(
         self,
         message: str,
         extracted_text: str,
         parsed_values: List[Dict[str, Any]],
         voice_mode: bool,
         explain_simple: bool,
-    ) -> Dict[str, Optional[str]]:
-        if not self._can_call():
-            return {
-                "response": build_fallback_response(parsed_values),
-                "model": None,
-            }
-
-        system_prompt = build_system_prompt(voice_mode, explain_simple)
+        history: Optional[Conversation] = None,
+    ) -> Dict[str, Any]:
+        # Stable prefix: interned system prompt and the memoised report context block,
+        # identical for every question about this report in this mode.
+        system_text, system_tokens = system_prompt(voice_mode, explain_simple)
+        report_block, report_block_tokens = report_contexts.get(extracted_text, parsed_values)
+        budget = PromptBudget("chat", self.model, answer_tokens=CHAT_ANSWER_TOKENS)
+        budget.charge("system", system_tokens)
+        budget.charge("report_context", report_block_tokens)
         
-        # Build structured user prompt with clear sections
-        user_prompt = self._build_user_prompt(
+        # Variable suffix: history turns, then the question-specific user prompt
+        user_prompt, history_messages = self._build_user_prompt(
             extracted_text=extracted_text,
             parsed_values=parsed_values,
-            user_message=message
+            user_message=message,
+            budget=budget,
+            history=history,
         )
+        budget.record()
 
-        payload = {
+        return {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": f"{system_text}\n\n{report_block}"},
+                *history_messages,
                 {"role": "user", "content": user_prompt},
             ],
             "temperature": 0.2,
-            "max_tokens": 600,
+            "max_tokens": budget.answer_tokens,
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+    async def _over_quota(self, user_id: Optional[str], payload: Dict[str, Any]) -> bool:
+        """Whether this request would exceed a token budget; the caller then answers without the model."""
+        exhausted = await self.quota.check_async(user_id, estimate_tokens(payload))
+        if exhausted is None:
+            return False
+        print(f"⚠️ Token budget {exhausted['budget']} exhausted, answering without the model")
+        return True
+
+    @staticmethod
+    def _cacheable(message: str, history: Optional[Conversation]) -> bool:
+        """Follow-up questions depend on the conversation, so their answers are neither reused nor cached."""
+        return history is None or history.is_empty() or not is_follow_up(message)
+
+    def _cache_keys(
+        self, message: str, extracted_text: str, voice_mode: bool, explain_simple: bool
+    ) -> Tuple[str, str]:
+        """Exact-match key for this question, and the scope its paraphrases share."""
+        mode = "explain_simple" if explain_simple else "normal"
+        models = self.router.signature
+        exact = ResponseCache.make_key(extracted_text, message, mode, voice_mode, models, PROMPT_VERSION)
+        scope = ResponseCache.make_key(extracted_text, "", mode, voice_mode, models, PROMPT_VERSION)
+        return exact, scope
+
+    def _cached_answer(
+        self, message: str, extracted_text: str, voice_mode: bool, explain_simple: bool
+    ) -> Optional[Dict[str, Optional[str]]]:
+        exact, scope = self._cache_keys(message, extracted_text, voice_mode, explain_simple)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(exact)
+            if cached is not None:
+                print(f"✓ Response cache hit")
+                return cached
+        if self.semantic_cache is not None:
+            similar = self.semantic_cache.lookup(scope, message)
+            if similar is not None:
+                print(f"✓ Semantic cache hit (similarity={similar['similarity']})")
+                return {"response": similar["response"], "model": similar["model"]}
+        return None
+
+    def _remember_answer(
+        self,
+        message: str,
+        extracted_text: str,
+        voice_mode: bool,
+        explain_simple: bool,
+        response: str,
+        model: str,
+    ) -> None:
+        exact, scope = self._cache_keys(message, extracted_text, voice_mode, explain_simple)
+        if self.response_cache is not None:
+            self.response_cache.set(exact, response, model)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(scope, message, response, model)
+
+    async def generate_response(
+        self,
+        message: str,
+        extracted_text: str,
+        parsed_values: List[Dict[str, Any]],
+        voice_mode: bool,
+        explain_simple: bool,
+        history: Optional[Conversation] = None,
+        user_id: Optional[str] = None,
+    ) -> Dict[str, Optional[str]]:
+        if not self._can_call():
+            return {
+                "response": build_fallback_response(parsed_values),
+                "model": None,
+            }
+
+        cacheable = self._cacheable(message, history)
+        cached = self._cached_answer(message, extracted_text, voice_mode, explain_simple) if cacheable else None
+        if cached is not None:
+            return cached
+
+        payload = self._build_payload(
+            message, extracted_text, parsed_values, voice_mode, explain_simple, history
+        )
+        if await self._over_quota(user_id, payload):
+            return {
+                "response": build_fallback_response(parsed_values),
+                "model": None,
+            }
 
         try:
-            with httpx.Client(timeout=15.0) as client:
-                response = client.post(
-                    "https://api.groq.com/openai/v1/chat/completions",
-                    json=payload,
-                    headers=headers,
-                )
-                response.raise_for_status()
-                data = response.json()
-                print(f"✓ Groq API response received")
+            data, model, abandoned_tokens = await self.router.complete(payload, message, voice_mode)
+            print(f"✓ Groq API response received from {model}")
+            await self.quota.record_async(user_id, usage_tokens(data) + abandoned_tokens, "chat")
         except Exception as e:
             print(f"❌ Groq API failed: {type(e).__name__}: {str(e)}")
             return {
@@ -120,45 +330,89 @@ class GroqService:
                 "model": None,
             }
 
-        # Clean up the response: remove excessive newlines and format nicely
-        # Replace multiple newlines with double newlines (for paragraph breaks)
-        lines = content.split('\n')
-        cleaned_lines = []
-        prev_empty = False
-        skip_table = False
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Skip markdown table lines (those with | or ---)
-            if line.startswith('|') or line.startswith('---') or line == '':
-                skip_table = True
-                if not prev_empty:
-                    cleaned_lines.append('')  # Add paragraph break
-                prev_empty = True
-                continue
-            
-            # If we encounter normal text again after table, resume
-            if skip_table and line and not line.startswith('|'):
-                skip_table = False
-            
-            if not line:
-                if not prev_empty:
-                    cleaned_lines.append('')  # Single empty line for paragraph break
-                prev_empty = True
-            else:
-                cleaned_lines.append(line)
-                prev_empty = False
-        
-        # Rejoin and limit to reasonable length
-        cleaned_response = '\n'.join(cleaned_lines).strip()
-        
-        # Remove excessive blank lines
-        while '\n\n\n' in cleaned_response:
-            cleaned_response = cleaned_response.replace('\n\n\n', '\n\n')
-        
-        if len(cleaned_response) > 1500:
-            cleaned_response = cleaned_response[:1500] + '...'
+        cleaned_response = clean_response(content)
+        if cacheable:
+            self._remember_answer(message, extracted_text, voice_mode, explain_simple, cleaned_response, model)
 
         print(f"✓ Response cleaned and formatted")
-        return {"response": cleaned_response, "model": self.model}
+        return {"response": cleaned_response, "model": model}
+
+    async def stream_response(
+        self,
+        message: str,
+        extracted_text: str,
+        parsed_values: List[Dict[str, Any]],
+        voice_mode: bool,
+        explain_simple: bool,
+        history: Optional[Conversation] = None,
+        user_id: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Optional[str]]]:
+        """Stream a cleaned response as {"delta": ...} items, ending with {"response": ..., "model": ...}.
+
+        If the model stream breaks off after sending text, the final item carries
+        the partial text with "completed": False.
+        """
+        if not self._can_call():
+            fallback = build_fallback_response(parsed_values)
+            yield {"delta": fallback}
+            yield {"response": fallback, "model": None}
+            return
+
+        cacheable = self._cacheable(message, history)
+        cached = self._cached_answer(message, extracted_text, voice_mode, explain_simple) if cacheable else None
+        if cached is not None:
+            yield {"delta": cached["response"]}
+            yield cached
+            return
+
+        payload = self._build_payload(
+            message, extracted_text, parsed_values, voice_mode, explain_simple, history
+        )
+        if await self._over_quota(user_id, payload):
+            fallback = build_fallback_response(parsed_values)
+            yield {"delta": fallback}
+            yield {"response": fallback, "model": None}
+            return
+
+        cleaner = ResponseCleaner()
+        parts: List[str] = []
+        model: Optional[str] = None
+        completed = False
+        stream = self.router.stream(payload, message, voice_mode)
+        try:
+            async for model, token in stream:
+                text = cleaner.feed(token)
+                if text:
+                    parts.append(text)
+                    yield {"delta": text}
+                if cleaner.truncated:
+                    break
+            text = cleaner.finish()
+            if text:
+                parts.append(text)
+                yield {"delta": text}
+            completed = True
+        except Exception as e:
+            print(f"❌ Groq stream failed: {type(e).__name__}: {str(e)}")
+        finally:
+            await stream.aclose()
+
+        response = "".join(parts)
+        # Streamed completions carry no usage block; charge a local estimate instead.
+        if response:
+            await self.quota.record_async(user_id, prompt_tokens(payload) + count_tokens(response), "chat")
+        if not response:
+            fallback = build_fallback_response(parsed_values)
+            yield {"delta": fallback}
+            yield {"response": fallback, "model": None}
+            return
+        if not completed:
+            yield {"response": response, "model": model, "completed": False}
+            return
+
+        # Only answers that streamed to the end are cached; a cut-off one would be
+        # served to every later similar question. (A cancelled stream never gets here.)
+        if cacheable:
+            self._remember_answer(message, extracted_text, voice_mode, explain_simple, response, model)
+        print(f"✓ Groq stream completed ({len(response)} chars from {model})")
+        yield {"response": response, "model": model}
@@ -0,0 +1,207 @@
+"""
+Shared Groq LLM Client
+One pooled async HTTP client for every Groq chat completion, with a global
+concurrency limit and pacing driven by Groq's rate-limit response headers.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from services.llm_scheduler import LLMScheduler
+from utils.metrics import metrics
+
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_reset_duration(value: Optional[str]) -> float:
+    """Parse Groq reset durations such as "7.66s", "2m59.56s" or "250ms" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(amount) * scale[unit] for amount, unit in _DURATION_PART.findall(value))
+
+
+class LLMClient:
+    """Async Groq client shared by all services.
+
+    Concurrency is capped by a priority scheduler; callers beyond the cap queue
+    by priority class (voice, chat, summary, tasks, backfill). When Groq reports
+    an exhausted request or token budget (or answers 429), new requests wait
+    until the advertised reset time instead of piling up errors.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout_seconds: Optional[float] = None,
+        max_rate_limit_wait_seconds: float = 10.0,
+    ) -> None:
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.max_concurrency = max_concurrency or int(os.getenv("GROQ_MAX_CONCURRENCY", "16"))
+        self.timeout_seconds = timeout_seconds or float(os.getenv("GROQ_TIMEOUT_SECONDS", "15"))
+        self.max_rate_limit_wait_seconds = max_rate_limit_wait_seconds
+        self._client: Optional[httpx.AsyncClient] = None
+        self.scheduler = LLMScheduler(self.max_concurrency)
+        self._blocked_until = 0.0
+        self.rate_limit: Dict[str, Any] = {}
+
+        metrics.register_gauge("llm_in_flight", lambda: self.in_flight)
+        metrics.register_gauge("llm_queued", lambda: self.queued)
+
+    @property
+    def in_flight(self) -> int:
+        return self.scheduler.total_in_flight
+
+    @property
+    def queued(self) -> int:
+        return self.scheduler.total_queued
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._client
+
+    def _record_rate_limits(self, response: httpx.Response) -> None:
+        headers = response.headers
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        self.rate_limit = {
+            "remaining_requests": remaining_requests,
+            "remaining_tokens": remaining_tokens,
+            "reset_requests": headers.get("x-ratelimit-reset-requests"),
+            "reset_tokens": headers.get("x-ratelimit-reset-tokens"),
+        }
+
+        wait = 0.0
+        if response.status_code == 429:
+            wait = parse_reset_duration(headers.get("retry-after")) or 1.0
+        if remaining_requests is not None and remaining_requests.strip() == "0":
+            wait = max(wait, parse_reset_duration(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tokens is not None and remaining_tokens.strip() == "0":
+            wait = max(wait, parse_reset_duration(headers.get("x-ratelimit-reset-tokens")))
+        if wait:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + wait)
+
+    async def _pace(self) -> None:
+        delay = self._blocked_until - time.monotonic()
+        if delay <= 0:
+            return
+        if delay > self.max_rate_limit_wait_seconds:
+            raise RuntimeError(f"Groq rate limit exhausted for another {delay:.1f}s")
+        metrics.increment("llm_rate_limit_waits")
+        await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def _slot(self, priority: str) -> AsyncIterator[None]:
+        queued_at = time.monotonic()
+        await self.scheduler.acquire(priority)
+        metrics.observe("llm_queue_wait_seconds", time.monotonic() - queued_at)
+        try:
+            yield
+        finally:
+            self.scheduler.release(priority)
+
+    async def chat_completion(
+        self, payload: Dict[str, Any], timeout: Optional[float] = None, priority: str = "chat"
+    ) -> Dict[str, Any]:
+        """POST a chat completion and return the decoded JSON.
+
+        Raises on failure, including QueueDeadlineExceeded when no slot frees up
+        within the priority class's queue deadline.
+        """
+        async with self._slot(priority):
+            for attempt in range(3):
+                await self._pace()
+                started = time.monotonic()
+                response = await self._http().post(
+                    GROQ_CHAT_URL,
+                    json=payload,
+                    timeout=timeout or self.timeout_seconds,
+                )
+                self._record_rate_limits(response)
+                if response.status_code == 429 and attempt < 2:
+                    metrics.increment("llm_rate_limited")
+                    continue
+                response.raise_for_status()
+                metrics.observe("llm_request_seconds", time.monotonic() - started)
+                return response.json()
+            raise RuntimeError("Groq rate limit retries exhausted")
+
+    async def stream_chat_completion(
+        self, payload: Dict[str, Any], timeout: Optional[float] = None, priority: str = "chat"
+    ) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding content deltas as Groq sends them. Raises on failure."""
+        async with self._slot(priority):
+            for attempt in range(3):
+                await self._pace()
+                started = time.monotonic()
+                async with self._http().stream(
+                    "POST",
+                    GROQ_CHAT_URL,
+                    json={**payload, "stream": True},
+                    timeout=timeout or self.timeout_seconds,
+                ) as response:
+                    self._record_rate_limits(response)
+                    if response.status_code == 429 and attempt < 2:
+                        metrics.increment("llm_rate_limited")
+                        continue
+                    response.raise_for_status()
+
+                    first_token = True
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or [{}]
+                        delta = choices[0].get("delta", {}).get("content")
+                        if delta:
+                            if first_token:
+                                metrics.observe("llm_first_token_seconds", time.monotonic() - started)
+                                first_token = False
+                            yield delta
+                    metrics.observe("llm_request_seconds", time.monotonic() - started)
+                    return
+            raise RuntimeError("Groq rate limit retries exhausted")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """Process-wide LLM client so every service shares one pool and one concurrency budget."""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    return _llm_client
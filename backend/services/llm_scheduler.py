@@ -0,0 +1,138 @@
+"""
+LLM Request Scheduler
+Orders Groq calls by priority class so interactive requests are never stuck
+behind background work: voice > chat > summary > tasks > backfill. Each class
+can be capped below the global concurrency limit, and queued requests give up
+after a per-class queue-time deadline so callers can fall back to cached or
+rule-based answers instead of waiting.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from utils.metrics import metrics
+
+PRIORITY_CLASSES = ("voice", "chat", "summary", "tasks", "backfill")
+
+# Background classes are capped so some slots always stay free for interactive traffic.
+DEFAULT_CLASS_CAPS = {"summary": 6, "tasks": 4, "backfill": 2}
+
+# Longest a request of each class may wait for a slot (None waits indefinitely).
+DEFAULT_QUEUE_DEADLINES: Dict[str, Optional[float]] = {
+    "voice": 3.0,
+    "chat": 8.0,
+    "summary": 30.0,
+    "tasks": 30.0,
+    "backfill": None,
+}
+
+
+class QueueDeadlineExceeded(RuntimeError):
+    """A request waited longer than its class's queue deadline."""
+
+
+def parse_class_caps(value: Optional[str]) -> Dict[str, int]:
+    """Parse "summary=4,tasks=2" into {"summary": 4, "tasks": 2}, ignoring unknown classes."""
+    caps: Dict[str, int] = {}
+    for part in (value or "").split(","):
+        name, _, cap = part.partition("=")
+        name = name.strip()
+        if name in PRIORITY_CLASSES and cap.strip().isdigit():
+            caps[name] = int(cap)
+    return caps
+
+
+class LLMScheduler:
+    """Priority admission control for a fixed number of concurrent LLM calls.
+
+    A freed slot goes to the highest-priority waiting class that is under its
+    cap; lower classes only start when no higher class is waiting for a slot
+    it could use, so background work soaks up spare capacity only.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        caps: Optional[Dict[str, int]] = None,
+        deadlines: Optional[Dict[str, Optional[float]]] = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.caps = {**DEFAULT_CLASS_CAPS, **parse_class_caps(os.getenv("GROQ_CLASS_CAPS")), **(caps or {})}
+        self.deadlines = {**DEFAULT_QUEUE_DEADLINES, **(deadlines or {})}
+        self.in_flight: Dict[str, int] = {name: 0 for name in PRIORITY_CLASSES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in PRIORITY_CLASSES}
+
+        metrics.register_gauge("llm_scheduler", self.snapshot)
+
+    @property
+    def total_in_flight(self) -> int:
+        return sum(self.in_flight.values())
+
+    @property
+    def total_queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def class_limit(self, priority: str) -> int:
+        """Most requests of a class that can be in flight at once."""
+        return min(self.caps.get(priority, self.max_concurrency), self.max_concurrency)
+
+    def _can_start(self, priority: str) -> bool:
+        return self.total_in_flight < self.max_concurrency and self.in_flight[priority] < self.class_limit(priority)
+
+    def _dispatch(self) -> None:
+        for priority in PRIORITY_CLASSES:
+            waiters = self._waiters[priority]
+            while waiters and self._can_start(priority):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+                self.in_flight[priority] += 1
+                waiter.set_result(None)
+
+    async def acquire(self, priority: str) -> None:
+        """Wait for a slot. Raises QueueDeadlineExceeded if the class deadline passes first."""
+        if priority not in self.in_flight:
+            raise ValueError(f"Unknown LLM priority class: {priority}")
+        queued_at = time.monotonic()
+        ahead = any(self._waiters[name] for name in PRIORITY_CLASSES[: PRIORITY_CLASSES.index(priority) + 1])
+        if not ahead and self._can_start(priority):
+            self.in_flight[priority] += 1
+            metrics.observe(f"llm_queue_wait_seconds_{priority}", 0.0)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.deadlines.get(priority))
+        except asyncio.TimeoutError:
+            metrics.increment(f"llm_queue_deadline_{priority}")
+            raise QueueDeadlineExceeded(
+                f"{priority} request waited {time.monotonic() - queued_at:.1f}s for an LLM slot"
+            ) from None
+        except asyncio.CancelledError:
+            # Granted just as the caller was cancelled: hand the slot on.
+            if waiter.done() and not waiter.cancelled():
+                self.release(priority)
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters[priority].remove(waiter)
+                except ValueError:
+                    pass
+        metrics.observe(f"llm_queue_wait_seconds_{priority}", time.monotonic() - queued_at)
+
+    def release(self, priority: str) -> None:
+        self.in_flight[priority] -= 1
+        self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {"in_flight": self.in_flight[name], "queued": len(self._waiters[name])}
+            for name in PRIORITY_CLASSES
+        }
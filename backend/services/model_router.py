@@ -0,0 +1,222 @@
+"""
+Model Router
+Sends each chat request to a fast or a large Groq model, hedges slow requests
+to the other tier, and keeps per-model latency statistics.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from services.llm_client import LLMClient, get_llm_client
+from services.llm_scheduler import QueueDeadlineExceeded
+from services.token_quota import estimate_tokens
+from utils.metrics import metrics
+
+# Questions asking for an explanation rather than a quick fact go to the large model.
+_EXPLANATION = re.compile(r"\b(explain|why|how|mean|means|meaning|summar|overview|understand|worried|worry|concern)")
+
+
+class ModelStats:
+    """Rolling latency window and outcome counters for one model."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(seconds)
+
+    def record_cancelled(self, seconds: float) -> None:
+        """Record a call abandoned after seconds (a hedge loser) as a censored sample.
+
+        Its true latency is at least seconds, so it counts as no faster than the
+        current p95. Dropping it would leave only the calls that won, and a p95
+        drifting down would hedge more and more requests.
+        """
+        p95 = self.percentile(0.95)
+        with self._lock:
+            self.requests += 1
+            self.cancelled += 1
+            self.latencies.append(max(seconds, p95) if p95 is not None else seconds)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "hedges_won": self.hedges_won,
+            "samples": len(self.latencies),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class ModelRouter:
+    """Two-tier routing with hedged requests.
+
+    Voice-mode and short factual questions use the fast model; longer or
+    explanatory questions use the large one. If the chosen model has not
+    answered within its observed p95 latency, the same request is sent to the
+    other tier and whichever answers first wins.
+    """
+
+    MIN_SAMPLES = 20
+    MIN_HEDGE_SECONDS = 0.5
+
+    def __init__(self, llm: Optional[LLMClient] = None) -> None:
+        self.llm = llm or get_llm_client()
+        self.fast_model = os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant")
+        self.large_model = os.getenv("GROQ_LARGE_MODEL") or os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+        self.hedging = os.getenv("GROQ_HEDGING", "true").lower() != "false"
+        self.default_hedge_seconds = float(os.getenv("GROQ_HEDGE_AFTER_SECONDS", "4"))
+        self.stats: Dict[str, ModelStats] = {}
+
+        metrics.register_gauge("llm_models", self.snapshot)
+
+    @property
+    def signature(self) -> str:
+        """Identifies the model pair answers may come from (used in cache keys)."""
+        return f"{self.fast_model}|{self.large_model}"
+
+    def _stats(self, model: str) -> ModelStats:
+        if model not in self.stats:
+            self.stats[model] = ModelStats()
+        return self.stats[model]
+
+    def choose(self, message: str, voice_mode: bool) -> Tuple[str, str]:
+        """Return (primary, secondary) models for a question."""
+        short = len(message.split()) <= 12
+        if voice_mode or (short and not _EXPLANATION.search(message.lower())):
+            return self.fast_model, self.large_model
+        return self.large_model, self.fast_model
+
+    def hedge_delay(self, model: str) -> float:
+        """Seconds to wait for model before hedging: its p95 once enough samples exist."""
+        stats = self._stats(model)
+        p95 = stats.percentile(0.95) if len(stats.latencies) >= self.MIN_SAMPLES else None
+        delay = p95 if p95 is not None else self.default_hedge_seconds
+        return max(self.MIN_HEDGE_SECONDS, min(delay, self.llm.timeout_seconds))
+
+    @staticmethod
+    def priority(voice_mode: bool) -> str:
+        return "voice" if voice_mode else "chat"
+
+    async def _timed(self, payload: Dict[str, Any], model: str, priority: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            data = await self.llm.chat_completion({**payload, "model": model}, priority=priority)
+        except asyncio.CancelledError:
+            self._stats(model).record_cancelled(time.monotonic() - started)
+            raise
+        except QueueDeadlineExceeded:
+            raise
+        except Exception:
+            self._stats(model).record_error()
+            raise
+        self._stats(model).record(time.monotonic() - started)
+        return data
+
+    async def complete(
+        self, payload: Dict[str, Any], message: str, voice_mode: bool
+    ) -> Tuple[Dict[str, Any], str, int]:
+        """Run a chat completion with routing and hedging.
+
+        Returns (response JSON, model that answered, abandoned tokens). Groq keeps
+        generating for a hedge loser after it is cancelled, so its estimated cost
+        is returned for the caller to charge along with the winner's usage.
+        """
+        primary, secondary = self.choose(message, voice_mode)
+        priority = self.priority(voice_mode)
+        tasks: Dict[asyncio.Task, str] = {asyncio.create_task(self._timed(payload, primary, priority)): primary}
+        hedged = not self.hedging or secondary == primary
+        deadline = self.hedge_delay(primary)
+        last_error: Optional[BaseException] = None
+
+        try:
+            while tasks:
+                timeout = deadline if not hedged else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slower than its p95: race the other tier.
+                    metrics.increment("llm_hedged_requests")
+                    tasks[asyncio.create_task(self._timed(payload, secondary, priority))] = secondary
+                    hedged = True
+                    continue
+
+                for task in done:
+                    model = tasks.pop(task)
+                    if task.exception() is None:
+                        if model != primary:
+                            self._stats(model).hedges_won += 1
+                        abandoned = len(tasks) * estimate_tokens(payload)
+                        if abandoned:
+                            metrics.increment("llm_hedge_abandoned_tokens", abandoned)
+                        return task.result(), model, abandoned
+                    last_error = task.exception()
+                    if isinstance(last_error, QueueDeadlineExceeded):
+                        # The scheduler is saturated; another tier would queue just as long.
+                        raise last_error
+
+                if not hedged:
+                    # Primary failed outright: go to the other tier immediately.
+                    metrics.increment("llm_failovers")
+                    tasks[asyncio.create_task(self._timed(payload, secondary, priority))] = secondary
+                    hedged = True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        raise last_error or RuntimeError("No model answered")
+
+    async def stream(self, payload: Dict[str, Any], message: str, voice_mode: bool) -> AsyncIterator[Tuple[str, str]]:
+        """Stream from the routed model, yielding (model, delta).
+
+        Streams are not hedged (the first token already arrives quickly), but if
+        the primary fails before sending anything the other tier is tried.
+        """
+        primary, secondary = self.choose(message, voice_mode)
+        priority = self.priority(voice_mode)
+        for attempt, model in enumerate((primary, secondary)):
+            started = time.monotonic()
+            sent_any = False
+            try:
+                async for delta in self.llm.stream_chat_completion({**payload, "model": model}, priority=priority):
+                    sent_any = True
+                    yield model, delta
+                self._stats(model).record(time.monotonic() - started)
+                return
+            except QueueDeadlineExceeded:
+                raise
+            except Exception:
+                self._stats(model).record_error()
+                if sent_any or attempt == 1 or secondary == primary:
+                    raise
+                metrics.increment("llm_failovers")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {model: stats.snapshot() for model, stats in list(self.stats.items())}
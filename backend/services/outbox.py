@@ -0,0 +1,289 @@
+"""
+Sanity Write Outbox
+Durable local queue of pending Sanity mutations. Writes are recorded in SQLite
+first and flushed by a background thread with batching and exponential backoff,
+so an upstream outage delays writes instead of losing them.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from utils.metrics import metrics
+from utils.sqlite import connect, data_path
+
+SendFn = Callable[[List[Dict[str, Any]]], None]
+SentFn = Callable[[List[str]], None]
+
+
+class SanityOutbox:
+    """Outbox of mutation groups.
+
+    Each entry is a list of mutations that must be applied together, plus the
+    cache tags to invalidate once they land. Mutations should use deterministic
+    document ids (createIfNotExists / createOrReplace) so a retry after an
+    ambiguous failure does not create duplicates.
+
+    Entries are sent in order per document and per cache tag (so per user and
+    per conversation), not globally: an entry waiting out a backoff only holds
+    back later entries that touch the same documents or tags.
+    """
+
+    CLAIM_SECONDS = 60.0
+    # How far past the head of the queue a flusher looks for entries it may send.
+    SCAN_LIMIT = 1000
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sanity_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mutations TEXT NOT NULL,
+            tags TEXT NOT NULL DEFAULT '[]',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_error TEXT,
+            dead INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON sanity_outbox (dead, next_attempt_at);
+    """
+
+    def __init__(
+        self,
+        send: SendFn,
+        on_sent: Optional[SentFn] = None,
+        path: Optional[str] = None,
+        batch_size: int = 50,
+        base_delay_seconds: float = 1.0,
+        max_delay_seconds: float = 300.0,
+        max_attempts: int = 12,
+    ) -> None:
+        self.send = send
+        self.on_sent = on_sent
+        self.path = path or os.getenv("SANITY_OUTBOX_PATH") or data_path("outbox.db")
+        self.batch_size = batch_size
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = connect(self.path)
+        self._conn.executescript(self.SCHEMA)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        metrics.register_gauge("sanity_outbox_depth", self.depth)
+        metrics.register_gauge("sanity_outbox_dead", self.dead_count)
+
+    def enqueue(self, mutations: List[Dict[str, Any]], tags: Iterable[str] = ()) -> None:
+        """Durably record a mutation group and wake the flusher."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sanity_outbox (mutations, tags, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(mutations), json.dumps(list(tags)), now, now),
+            )
+        metrics.increment("sanity_outbox_enqueued")
+        self.start()
+        self._wake.set()
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sanity_outbox WHERE dead = 0").fetchone()[0]
+
+    def dead_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sanity_outbox WHERE dead = 1").fetchone()[0]
+
+    @staticmethod
+    def ordering_keys(mutations: List[Dict[str, Any]], tags: Iterable[str]) -> Set[str]:
+        """Documents and cache tags an entry touches; entries sharing one are sent in order."""
+        keys = {f"tag:{tag}" for tag in tags}
+        for mutation in mutations:
+            for body in mutation.values():
+                if not isinstance(body, dict):
+                    continue
+                if body.get("_id") or body.get("id"):
+                    keys.add(f"doc:{body.get('_id') or body.get('id')}")
+                elif body.get("query"):
+                    keys.add(f"query:{body['query']}")
+        return keys
+
+    def _claim_due_entries(self) -> List[Dict[str, Any]]:
+        """Claim due entries that no earlier pending entry must precede.
+
+        A later patch must never overtake the create it depends on, so an entry
+        is skipped while an earlier entry sharing one of its ordering keys is
+        still pending (backing off or claimed by another flusher). The claim
+        pushes next_attempt_at past the lease inside an IMMEDIATE transaction,
+        so flushers in other worker processes skip these entries.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                head = self._conn.execute(
+                    """
+                    SELECT id, mutations, tags, attempts, next_attempt_at FROM sanity_outbox
+                    WHERE dead = 0 ORDER BY id LIMIT ?
+                    """,
+                    (self.SCAN_LIMIT,),
+                ).fetchall()
+                rows = []
+                blocked: Set[str] = set()
+                for row in head:
+                    if len(rows) >= self.batch_size:
+                        break
+                    keys = self.ordering_keys(json.loads(row["mutations"]), json.loads(row["tags"]))
+                    if row["next_attempt_at"] > now:
+                        blocked |= keys
+                    elif not keys & blocked:
+                        rows.append(row)
+                    else:
+                        # Everything after a skipped entry on the same keys must wait for it too.
+                        blocked |= keys
+                self._conn.executemany(
+                    "UPDATE sanity_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.CLAIM_SECONDS, row["id"]) for row in rows],
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return [
+            {
+                "id": row["id"],
+                "mutations": json.loads(row["mutations"]),
+                "tags": json.loads(row["tags"]),
+                "attempts": row["attempts"],
+            }
+            for row in rows
+        ]
+
+    def _mark_sent(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM sanity_outbox WHERE id = ?", [(e["id"],) for e in entries])
+        metrics.increment("sanity_outbox_sent", len(entries))
+        tags = [tag for entry in entries for tag in entry["tags"]]
+        if self.on_sent and tags:
+            self.on_sent(tags)
+
+    def _mark_failed(self, entries: List[Dict[str, Any]], error: Exception) -> None:
+        now = time.time()
+        # Sanity rejecting a single mutation as invalid will not change on retry.
+        permanent = len(entries) == 1 and self._is_client_error(error)
+        updates = []
+        for entry in entries:
+            attempts = entry["attempts"] + 1
+            delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+            dead = 1 if permanent or attempts >= self.max_attempts else 0
+            updates.append((attempts, now + delay, f"{type(error).__name__}: {error}"[:500], dead, entry["id"]))
+            if dead:
+                print(f"❌ Outbox entry {entry['id']} gave up after {attempts} attempts: {error}")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE sanity_outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, dead = ? WHERE id = ?",
+                updates,
+            )
+        metrics.increment("sanity_outbox_failures", len(entries))
+
+    @staticmethod
+    def _is_client_error(error: Exception) -> bool:
+        """Whether Sanity rejected the mutations themselves, so retrying cannot help.
+
+        This includes 409: a conflicting document or revision will not resolve
+        itself, and retrying it for an hour only delays the entries behind it.
+        Such entries are dead-lettered (see sanity_outbox_dead) for inspection.
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return 400 <= status < 500 and status not in (408, 429)
+        return False
+
+    def flush_once(self) -> int:
+        """Send all due entries as one transaction. Returns the number of entries sent.
+
+        If Sanity rejects the batch as invalid, entries are retried one by one so a
+        single bad mutation is set aside instead of holding back the rest of the queue.
+        """
+        entries = self._claim_due_entries()
+        if not entries:
+            return 0
+
+        try:
+            self.send([m for entry in entries for m in entry["mutations"]])
+            self._mark_sent(entries)
+            return len(entries)
+        except Exception as e:
+            if len(entries) == 1 or not self._is_client_error(e):
+                print(f"⚠️ Outbox flush failed ({len(entries)} entries): {type(e).__name__}: {str(e)}")
+                self._mark_failed(entries, e)
+                return 0
+
+        sent = 0
+        for index, entry in enumerate(entries):
+            try:
+                self.send(entry["mutations"])
+                self._mark_sent([entry])
+                sent += 1
+            except Exception as e:
+                self._mark_failed([entry], e)
+                if not self._is_client_error(e):
+                    # Upstream trouble: keep the rest queued behind this entry.
+                    self._release(entries[index + 1:])
+                    break
+        return sent
+
+    def _release(self, entries: List[Dict[str, Any]]) -> None:
+        """Return claimed entries to the queue without counting an attempt."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE sanity_outbox SET next_attempt_at = ? WHERE id = ?",
+                [(time.time(), entry["id"]) for entry in entries],
+            )
+
+    def _next_due_in(self) -> float:
+        """Seconds until the next entry comes out of backoff or its claim lease.
+
+        Entries that are already due but held back behind such an entry are not
+        counted, or the flusher would spin until the blocking entry is due.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM sanity_outbox WHERE dead = 0 AND next_attempt_at > ?", (now,)
+            ).fetchone()
+        if row[0] is None:
+            return 30.0
+        return max(0.0, min(30.0, row[0] - now))
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                while self.flush_once():
+                    pass
+            except Exception as e:
+                print(f"⚠️ Outbox worker error: {type(e).__name__}: {str(e)}")
+            self._wake.wait(timeout=self._next_due_in())
+            self._wake.clear()
+
+    def start(self) -> None:
+        """Start the background flusher (idempotent)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="sanity-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the flusher. Unsent entries stay on disk and go out after the next start."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
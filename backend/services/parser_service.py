@@ -5,6 +5,8 @@ from typing import List
 
 from models.schemas import ParsedValue
 
+# Bump when parsing or classification output changes; cached prompt context is keyed on it.
+PARSER_VERSION = "1"
 
 LINE_PATTERN = re.compile(
     r"^(?P<name>[A-Za-z0-9 /\-()]+)\s+(?P<value>[0-9]+(?:\.[0-9]+)?)\s*(?P<unit>[A-Za-z%/]+)?\s*(?P<range>\d+(?:\.\d+)?\s*[-–]\s*\d+(?:\.\d+)?)?",
@@ -0,0 +1,122 @@
+"""
+Prompt Builder
+Precomputed and memoised prompt fragments for report chat.
+
+Chat prompts are laid out as a stable prefix (system prompt, instructions and a
+per-report context block) followed by the variable part (conversation history,
+question-specific excerpts and the question). Every question about the same
+report in the same mode therefore starts with byte-identical text, which is what
+provider-side prompt prefix caching keys on, and none of the prefix is rebuilt
+per request.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from services.parser_service import PARSER_VERSION
+from services.report_index import is_out_of_range, report_indexes
+from utils.safety import build_system_prompt
+from utils.token_budget import count_tokens, truncate_to_tokens
+
+CHAT_INSTRUCTIONS = "\n".join(
+    [
+        "=== INSTRUCTIONS ===",
+        "- Base your answer ONLY on the medical report data provided in this conversation",
+        "- If the report doesn't contain information to answer the question, say so gently",
+        "- Never invent or assume medical information not in the report",
+        "- Remember: EXPLAIN, don't DIAGNOSE",
+        "- Always end with encouragement to discuss with their healthcare provider",
+    ]
+)
+
+# The four system prompt variants, built once at import.
+SYSTEM_PROMPTS: Dict[Tuple[bool, bool], str] = {
+    (voice_mode, explain_simple): f"{build_system_prompt(voice_mode, explain_simple)}\n\n{CHAT_INSTRUCTIONS}"
+    for voice_mode in (False, True)
+    for explain_simple in (False, True)
+}
+SYSTEM_PROMPT_TOKENS: Dict[Tuple[bool, bool], int] = {
+    key: count_tokens(prompt) for key, prompt in SYSTEM_PROMPTS.items()
+}
+
+
+def system_prompt(voice_mode: bool, explain_simple: bool) -> Tuple[str, int]:
+    """Interned system prompt (with chat instructions) and its token count."""
+    key = (bool(voice_mode), bool(explain_simple))
+    return SYSTEM_PROMPTS[key], SYSTEM_PROMPT_TOKENS[key]
+
+
+def format_value(item: Dict[str, Any]) -> str:
+    return (
+        f"  • {item.get('test_name', 'Unknown Test')}: "
+        f"{item.get('value', 'N/A')} {item.get('unit') or ''}"
+        f" (Range: {item.get('reference_range') or 'Not specified'})"
+        f" - {item.get('classification', '')}"
+    )
+
+
+def render_report_context(extracted_text: str, parsed_values: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Report header plus parsed results (out-of-range first) within max_tokens."""
+    chunks = report_indexes.get(extracted_text).chunks
+    header = truncate_to_tokens(chunks[0], max_tokens // 4) if chunks else ""
+
+    ordered = [item for item in parsed_values if is_out_of_range(item)]
+    ordered += [item for item in parsed_values if not is_out_of_range(item)]
+
+    lines = [
+        "=== MEDICAL REPORT DATA ===",
+        "",
+        "Report Header:",
+        header or "  (No readable header)",
+        "",
+        "Parsed Test Results:",
+    ]
+    used = count_tokens("\n".join(lines))
+    listed = 0
+    for item in ordered:
+        line = format_value(item)
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+        listed += 1
+    if not parsed_values:
+        lines.append("  (No values parsed from report)")
+    elif listed < len(parsed_values):
+        lines.append(f"  (+{len(parsed_values) - listed} more results not shown)")
+    return "\n".join(lines)
+
+
+class ReportContextCache:
+    """Rendered report context blocks keyed by report content hash and parser version."""
+
+    def __init__(self, max_entries: int = 512, max_tokens: int = 0) -> None:
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens or int(os.getenv("CHAT_REPORT_BLOCK_TOKENS", "350"))
+        self._blocks: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, extracted_text: str, parsed_values: List[Dict[str, Any]]) -> Tuple[str, int]:
+        """Rendered block and its token count."""
+        key = hashlib.sha256(f"{PARSER_VERSION}|{extracted_text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._blocks.get(key)
+            if cached is not None:
+                self._blocks.move_to_end(key)
+                return cached
+
+        block = render_report_context(extracted_text, parsed_values, self.max_tokens)
+        rendered = (block, count_tokens(block))
+        with self._lock:
+            self._blocks[key] = rendered
+            while len(self._blocks) > self.max_entries:
+                self._blocks.popitem(last=False)
+        return rendered
+
+
+report_contexts = ReportContextCache()
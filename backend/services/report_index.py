@@ -0,0 +1,178 @@
+"""
+Report Retrieval Index
+Splits extracted report text into chunks and ranks them with BM25, so prompts
+carry the parts of a long report that matter for the question instead of
+whatever fits in the first couple of thousand characters.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.token_budget import count_tokens
+
+CHUNK_CHARS = 400
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an the my me i is are was were be do does did can what which how of in on for to this that it and or with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """Group report lines into chunks of roughly chunk_chars, never splitting a line unless it is longer."""
+    pieces: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        while len(line) > chunk_chars:
+            cut = line.rfind(" ", 0, chunk_chars)
+            cut = cut if cut > 0 else chunk_chars
+            pieces.append(line[:cut])
+            line = line[cut:].strip()
+        if line:
+            pieces.append(line)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) + 1 > chunk_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def is_out_of_range(item: Dict[str, Any]) -> bool:
+    classification = (item.get("classification") or "").lower()
+    return "above" in classification or "below" in classification
+
+
+class ReportIndex:
+    """BM25 index over the chunks of one report."""
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, text: str, chunk_chars: int = CHUNK_CHARS) -> None:
+        self.chunks = chunk_text(text, chunk_chars)
+        self._term_counts = [Counter(tokenize(chunk)) for chunk in self.chunks]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        self._doc_freq: Counter = Counter()
+        for counts in self._term_counts:
+            self._doc_freq.update(counts.keys())
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return (chunk index, score) pairs with a positive score, best first."""
+        terms = set(tokenize(query))
+        if not terms or not self.chunks:
+            return []
+        total = len(self.chunks)
+        scores: List[Tuple[int, float]] = []
+        for index, counts in enumerate(self._term_counts):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._avg_length or 1))
+            for term in terms:
+                freq = counts.get(term)
+                if not freq:
+                    continue
+                df = self._doc_freq[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                score += idf * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((index, score))
+        scores.sort(key=lambda pair: pair[1], reverse=True)
+        return scores[:limit] if limit else scores
+
+    def select_chunks(self, query: str, token_budget: int, include_header: bool = True) -> List[str]:
+        """Pick the chunks most relevant to query within token_budget, in document order.
+
+        The first chunk (usually the report header) is kept when it fits, unless
+        include_header is False because the caller shows it separately. When
+        nothing matches the query, chunks are taken in document order.
+        """
+        ranked = [index for index, _ in self.search(query)]
+        if not ranked:
+            ranked = list(range(len(self.chunks)))
+        elif 0 not in ranked and include_header:
+            ranked.insert(1, 0)
+        if not include_header:
+            ranked = [index for index in ranked if index != 0]
+
+        chosen: List[int] = []
+        used = 0
+        for index in ranked:
+            cost = count_tokens(self.chunks[index])
+            if used + cost > token_budget:
+                continue
+            chosen.append(index)
+            used += cost
+        return [self.chunks[index] for index in sorted(chosen)]
+
+
+def values_named_in(query: str, parsed_values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Parsed values whose test name shares a word with query."""
+    terms = set(tokenize(query))
+    return [item for item in parsed_values if terms & set(tokenize(item.get("test_name") or ""))]
+
+
+def select_values(
+    query: str, parsed_values: List[Dict[str, Any]], limit: int
+) -> List[Dict[str, Any]]:
+    """Pick up to limit parsed values: ones named in the query, then out-of-range ones, then the rest.
+
+    When the query names any test, in-range values it does not mention are left out.
+    """
+    terms = set(tokenize(query))
+
+    def rank(item: Dict[str, Any]) -> int:
+        if terms & set(tokenize(item.get("test_name") or "")):
+            return 0
+        if is_out_of_range(item):
+            return 1
+        return 2
+
+    ranks = [rank(item) for item in parsed_values]
+    named = 0 in ranks
+    ordered = sorted(range(len(parsed_values)), key=lambda i: (ranks[i], i))
+    return [parsed_values[i] for i in ordered[:limit] if not (named and ranks[i] == 2)]
+
+
+class ReportIndexRegistry:
+    """Indexes keyed by report content hash, built once and kept in a bounded LRU."""
+
+    def __init__(self, max_reports: int = 256) -> None:
+        self.max_reports = max_reports
+        self._indexes: "OrderedDict[str, ReportIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> ReportIndex:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+        index = ReportIndex(text)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_reports:
+                self._indexes.popitem(last=False)
+        return index
+
+
+report_indexes = ReportIndexRegistry()
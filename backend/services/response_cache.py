@@ -0,0 +1,144 @@
+"""
+Chat Response Cache
+Exact-match cache of model answers keyed by report content, normalised question,
+answer mode and model/prompt version. A bounded in-memory LRU sits in front of a
+SQLite tier that survives restarts and is shared by every worker on the node.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from utils.metrics import metrics
+from utils.query_cache import QueryCache
+from utils.sqlite import connect, data_path
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_question(question: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    text = _WHITESPACE.sub(" ", question.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of chat answers.
+
+    Only real model answers should be stored; fallback text is cheap to rebuild
+    and would otherwise hide a recovered model for the whole TTL.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            model TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_response_cache_expiry ON response_cache (expires_at);
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24")) * 3600
+        self.memory = QueryCache(max_entries=max_entries or int(os.getenv("RESPONSE_CACHE_SIZE", "2000")))
+        self.path = path or os.getenv("RESPONSE_CACHE_PATH") or data_path("response_cache.db")
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+        try:
+            self._conn = connect(self.path)
+            self._conn.executescript(self.SCHEMA)
+        except Exception as e:
+            print(f"⚠️ Response cache persistent tier unavailable: {type(e).__name__}: {str(e)}")
+            self._conn = None
+
+        metrics.register_gauge("response_cache", self.stats)
+
+    @staticmethod
+    def make_key(
+        extracted_text: str,
+        question: str,
+        mode: str,
+        voice_mode: bool,
+        model: str,
+        prompt_version: str,
+    ) -> str:
+        raw = json.dumps(
+            [content_hash(extracted_text), normalize_question(question), mode, bool(voice_mode), model, prompt_version]
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return {"response", "model"} for a cached answer, or None."""
+        entry = self.memory.lookup(key)
+        if entry is not None and QueryCache.is_fresh(entry):
+            self.memory_hits += 1
+            return dict(entry["value"])
+
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT response, model, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                        (key, time.time()),
+                    ).fetchone()
+            except Exception as e:
+                print(f"⚠️ Response cache read failed: {type(e).__name__}: {str(e)}")
+                row = None
+            if row is not None:
+                value = {"response": row["response"], "model": row["model"]}
+                self.memory.store(key, value, ttl_seconds=row["expires_at"] - time.time())
+                self.disk_hits += 1
+                return dict(value)
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, response: str, model: Optional[str]) -> None:
+        value = {"response": response, "model": model}
+        self.memory.store(key, value, ttl_seconds=self.ttl_seconds)
+        if self._conn is None:
+            return
+
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, response, model, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, model, now, now + self.ttl_seconds),
+                )
+                self._writes += 1
+                if self._writes % 500 == 0:
+                    self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        except Exception as e:
+            print(f"⚠️ Response cache write failed: {type(e).__name__}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": self.memory.stats()["entries"],
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
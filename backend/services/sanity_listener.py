@@ -0,0 +1,184 @@
+"""
+Sanity Change Listener
+Subscribes to Sanity's listen (SSE) API and pushes document mutations to local
+cache handlers, so in-process caches stay correct even when the Expo app writes
+to Sanity directly.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+LISTEN_TYPES = ("medicalReport", "chatConversation", "dailyTask")
+
+MutationHandler = Callable[[Dict[str, Any]], None]
+StatusHandler = Callable[[bool], None]
+
+
+async def parse_sse_events(lines: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+    """Turn a stream of SSE lines into {"event", "data", "id"} dicts.
+
+    Comment lines (keep-alives) are skipped; multi-line data fields are joined
+    with newlines as the SSE spec requires.
+    """
+    event: Dict[str, Any] = {"event": "message", "data": [], "id": None}
+    async for raw_line in lines:
+        line = raw_line.rstrip("\r")
+        if not line:
+            if event["data"]:
+                yield {"event": event["event"], "data": "\n".join(event["data"]), "id": event["id"]}
+            event = {"event": "message", "data": [], "id": None}
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event["event"] = value
+        elif field == "data":
+            event["data"].append(value)
+        elif field == "id":
+            event["id"] = value
+
+
+class SanityListener:
+    """Background subscriber to Sanity document mutations.
+
+    Handlers receive the decoded mutation payload (documentId, transition,
+    result, previous). Status handlers are told when the stream connects and
+    drops, so caches can lengthen or shorten their TTLs accordingly.
+    """
+
+    def __init__(
+        self,
+        project_id: Optional[str] = None,
+        dataset: Optional[str] = None,
+        token: Optional[str] = None,
+        base_url: Optional[str] = None,
+        types: Iterable[str] = LISTEN_TYPES,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.project_id = project_id or os.getenv("SANITY_PROJECT_ID")
+        self.dataset = dataset or os.getenv("SANITY_DATASET")
+        self.token = token or os.getenv("SANITY_API_TOKEN")
+        # SANITY_LISTEN_URL points the listener at a local SSE stand-in for testing.
+        self.base_url = base_url or os.getenv("SANITY_LISTEN_URL")
+        self.types = tuple(types)
+        self.transport = transport
+        self.max_backoff_seconds = 60.0
+        self.connected = False
+        self.events_received = 0
+        self._handlers: List[MutationHandler] = []
+        self._status_handlers: List[StatusHandler] = []
+        self._last_event_id: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_configured(self) -> bool:
+        return bool(self.base_url or (self.project_id and self.dataset and self.token))
+
+    def add_handler(self, handler: MutationHandler) -> None:
+        self._handlers.append(handler)
+
+    def add_status_handler(self, handler: StatusHandler) -> None:
+        self._status_handlers.append(handler)
+
+    def _listen_url(self) -> str:
+        if self.base_url:
+            return self.base_url
+        return f"https://{self.project_id}.api.sanity.io/v2023-10-18/data/listen/{self.dataset}"
+
+    def _query(self) -> str:
+        type_list = ", ".join(f'"{t}"' for t in self.types)
+        return f"*[_type in [{type_list}]]"
+
+    def start(self) -> None:
+        """Start the subscriber as a task on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._set_connected(False)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                await self._consume()
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Sanity listener disconnected: {type(e).__name__}: {str(e)}")
+            self._set_connected(False)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    async def _consume(self) -> None:
+        params = {
+            "query": self._query(),
+            "includeResult": "true",
+            "includePreviousRevision": "true",
+        }
+        headers = {"Accept": "text/event-stream"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self._last_event_id:
+            headers["Last-Event-ID"] = self._last_event_id
+
+        timeout = httpx.Timeout(10.0, read=None)
+        async with httpx.AsyncClient(timeout=timeout, transport=self.transport) as client:
+            async with client.stream("GET", self._listen_url(), params=params, headers=headers) as response:
+                response.raise_for_status()
+                async for event in parse_sse_events(response.aiter_lines()):
+                    if event["id"]:
+                        self._last_event_id = event["id"]
+                    self._handle_event(event)
+
+    def _handle_event(self, event: Dict[str, Any]) -> None:
+        name = event["event"]
+        if name == "welcome":
+            print(f"✓ Sanity listener connected")
+            self._set_connected(True)
+            return
+        if name in ("disconnect", "channelError"):
+            raise ConnectionError(f"Sanity listener received {name}: {event['data']}")
+        if name != "mutation":
+            return
+
+        try:
+            payload = json.loads(event["data"])
+        except ValueError:
+            return
+        self.events_received += 1
+        for handler in self._handlers:
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"⚠️ Listener handler failed: {type(e).__name__}: {str(e)}")
+
+    def _set_connected(self, connected: bool) -> None:
+        if connected == self.connected:
+            return
+        self.connected = connected
+        for handler in self._status_handlers:
+            try:
+                handler(connected)
+            except Exception as e:
+                print(f"⚠️ Listener status handler failed: {type(e).__name__}: {str(e)}")
+
+
+def mutation_document(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Best available view of the mutated document: the new revision, else the previous one."""
+    return payload.get("result") or payload.get("previous") or {}
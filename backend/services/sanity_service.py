@@ -1,28 +1,39 @@
 from __future__ import annotations
 
-import os
 import uuid
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
-import httpx
+from services.storage_backends import StorageBackend, create_storage_backend, report_document_id
+from utils.single_flight import SingleFlight
 
 
 class SanityService:
-    def __init__(self) -> None:
-        self.project_id = os.getenv("SANITY_PROJECT_ID")
-        self.dataset = os.getenv("SANITY_DATASET")
-        self.token = os.getenv("SANITY_API_TOKEN")
+    """Report and chat persistence.
+
+    Storage is delegated to a StorageBackend (Sanity by default, local SQLite when
+    Sanity is not configured or STORAGE_BACKEND=sqlite); recently used reports are
+    also kept in memory.
+    """
+
+    def __init__(self, backend: Optional[StorageBackend] = None) -> None:
+        self.backend = backend or create_storage_backend()
         self._store: Dict[str, Dict[str, str]] = {}
+        # Concurrent reads of the same report share one storage round trip.
+        self._fetches = SingleFlight("report_fetch")
 
-    def _can_use_sanity(self) -> bool:
-        return bool(self.project_id and self.dataset and self.token)
+    def storage_available(self) -> bool:
+        return self.backend.is_available()
 
-    def _mutation_url(self) -> str:
-        return f"https://{self.project_id}.api.sanity.io/v2023-10-18/data/mutate/{self.dataset}"
+    def set_push_invalidation(self, enabled: bool) -> None:
+        self.backend.set_push_invalidation(enabled)
 
-    def _query_url(self) -> str:
-        return f"https://{self.project_id}.api.sanity.io/v2023-10-18/data/query/{self.dataset}"
+    def apply_mutation(self, payload: Dict[str, Any]) -> None:
+        """Invalidate cached data touched by a Sanity mutation event."""
+        doc = payload.get("result") or payload.get("previous") or {}
+        if doc.get("_type") == "medicalReport" and doc.get("reportId"):
+            self._store.pop(doc["reportId"], None)
+        self.backend.apply_mutation(payload)
 
     def store_report(
         self,
@@ -34,10 +45,11 @@ class SanityService:
     ) -> Dict[str, str]:
         report_id = str(uuid.uuid4())
         upload_date = datetime.utcnow().isoformat() + "Z"
-        print(f"🔍 store_report called: user_id={user_id}, can_use_sanity={self._can_use_sanity()}")
+        print(f"🔍 store_report called: user_id={user_id}, backend={self.backend.name}")
 
         record = {
             "report_id": report_id,
+            "document_id": report_document_id(report_id),
             "user_id": user_id,
             "file_url": file_url or "",
             "extracted_text": extracted_text,
@@ -46,248 +58,119 @@ class SanityService:
             "label": label or "",
         }
 
-        if self._can_use_sanity():
-            existing_id: Optional[str] = None
-            try:
-                query = (
-                    "*[_type == 'medicalReport' && reportId == $reportId && userId == $userId][0]{_id}"
-                )
-                params = {"query": query, "$reportId": report_id, "$userId": user_id}
-                headers = {"Authorization": f"Bearer {self.token}"}
-                with httpx.Client(timeout=10.0) as client:
-                    response = client.get(self._query_url(), params=params, headers=headers)
-                    response.raise_for_status()
-                    existing_id = response.json().get("result", {}).get("_id")
-            except Exception:
-                existing_id = None
-
-            doc = {
-                "_type": "medicalReport",
-                "reportId": report_id,
-                "userId": user_id,
-                "fileUrl": file_url,
-                "extractedText": extracted_text,
-                "uploadDate": upload_date,
-                "reportType": report_type,
-                "label": label,
-            }
-            if existing_id:
-                doc["_id"] = existing_id
-                payload = {"mutations": [{"createOrReplace": doc}]}
-            else:
-                payload = {"mutations": [{"create": doc}]}
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json",
-            }
-            try:
-                print(f"📝 Saving report to Sanity: report_id={report_id}, user_id={user_id}")
-                with httpx.Client(timeout=10.0) as client:
-                    response = client.post(self._mutation_url(), json=payload, headers=headers)
-                    response.raise_for_status()
-                print(f"✓ Report saved to Sanity successfully")
-            except Exception as e:
-                print(f"❌ Failed to save to Sanity: {type(e).__name__}: {str(e)}")
+        if self.storage_available():
+            self.backend.insert_report(record)
 
         self._store[report_id] = record
         return record
 
     def get_report(self, report_id: str, user_id: str) -> Optional[Dict[str, str]]:
         print(f"🔍 get_report called: report_id={report_id}, user_id={user_id}")
-        
+
         record = self._store.get(report_id)
         if record and record.get("user_id") == user_id:
             print(f"✓ Found in memory store")
             return record
 
-        if not self._can_use_sanity():
-            print(f"⚠️ Sanity not configured, cannot query")
+        if not self.storage_available():
+            print(f"⚠️ Storage not configured, cannot query")
             return None
 
-        # Use simpler query syntax - just query by reportId first
-        query = f'*[_type == "medicalReport" && reportId == "{report_id}" && userId == "{user_id}"][0]'
-        
-        headers = {"Authorization": f"Bearer {self.token}"}
-        
-        print(f"📊 Querying Sanity: {query}")
-
-        try:
-            # Construct the full URL manually
-            import urllib.parse
-            encoded_query = urllib.parse.quote(query)
-            url = f"{self._query_url()}?query={encoded_query}"
-            
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(url, headers=headers)
-                response.raise_for_status()
-                result = response.json()
-                print(f"✓ Query successful, response: {result}")
-                data = result.get("result")
-        except Exception as e:
-            print(f"❌ Sanity query failed: {type(e).__name__}: {str(e)}")
+        mapped = self._fetches.do(f"report|{report_id}|{user_id}", self.backend.fetch_report, report_id, user_id)
+        if not mapped:
             return None
 
-        if not data:
-            print(f"⚠️ No document found in Sanity")
+        self._store[report_id] = mapped
+        print(f"✓ Mapped data from {self.backend.name} and cached")
+        return mapped
+
+    def get_report_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch the stored summary fields for a report. Raises on upstream errors."""
+        if not self.storage_available():
             return None
+        return self.backend.fetch_report_summary(report_id, user_id)
+
+    def get_report_for_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Everything the summary endpoint needs in one read.
+
+        Returns {report_id, document_id, extracted_text, summary, summary_generated_at},
+        or None if the report does not exist. Raises on upstream errors.
+        """
+        doc = None
+        if self.storage_available():
+            doc = self._fetches.do(
+                f"summary|{report_id}|{user_id}", self.backend.fetch_report_for_summary, report_id, user_id
+            )
+        if doc:
+            return {
+                "report_id": report_id,
+                "document_id": doc.get("_id"),
+                "extracted_text": doc.get("extractedText") or "",
+                "summary": doc.get("summary"),
+                "summary_generated_at": doc.get("summaryGeneratedAt"),
+            }
 
-        mapped = {
-            "report_id": data.get("reportId", ""),
-            "user_id": data.get("userId", ""),
-            "file_url": data.get("fileUrl", ""),
-            "extracted_text": data.get("extractedText", ""),
-            "upload_date": data.get("uploadDate", ""),
-            "report_type": data.get("reportType", ""),
-            "label": data.get("label", ""),
+        # A report uploaded moments ago may still be waiting in the write outbox.
+        record = self._store.get(report_id)
+        if not record or record.get("user_id") != user_id:
+            return None
+        return {
+            "report_id": report_id,
+            "document_id": None,
+            "extracted_text": record.get("extracted_text") or "",
+            "summary": None,
+            "summary_generated_at": None,
         }
-        self._store[report_id] = mapped
-        print(f"✓ Mapped data from Sanity and cached")
-        return mapped
 
     def get_user_reports(self, user_id: str) -> list:
-        """Fetch all reports for a user from Sanity."""
-        if not self._can_use_sanity():
-            return []
-
-        query = f'*[_type == "medicalReport" && userId == "{user_id}"] | order(uploadDate desc) {{_id, reportId, userId, label, reportType, uploadDate, extractedText, fileUrl, summary, summaryGeneratedAt}}'
-        
-        headers = {"Authorization": f"Bearer {self.token}"}
-        
-        print(f"📊 Querying user reports: userId={user_id}")
-
-        try:
-            import urllib.parse
-            encoded_query = urllib.parse.quote(query)
-            url = f"{self._query_url()}?query={encoded_query}"
-            
-            print(f"🔍 Encoded query: {encoded_query}")
-            
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(url, headers=headers)
-                response.raise_for_status()
-                result = response.json()
-                reports = result.get("result", [])
-                print(f"✓ Found {len(reports)} reports for user")
-                if reports:
-                    print(f"📄 Sample report data: {reports[0]}")
-                return reports
-        except Exception as e:
-            print(f"❌ Failed to fetch reports: {type(e).__name__}: {str(e)}")
+        """Fetch all reports for a user."""
+        if not self.storage_available():
             return []
+        return self.backend.list_user_reports(user_id)
 
     def save_chat(self, report_id: str, user_id: str, messages: list, summary: str = "") -> bool:
-        """Save chat conversation to Sanity."""
-        if not self._can_use_sanity():
+        """Persist a chat conversation incrementally.
+
+        There is one conversation per (report, user); messages newer than the last
+        stored one are appended, so resending the full history is cheap.
+        """
+        if not self.storage_available():
             return False
 
-        import urllib.parse
-        # Convert messages to Sanity format
-        sanity_messages = [
+        # Convert messages to the stored format
+        stored_messages = [
             {
                 "role": msg.get("role", ""),
                 "text": msg.get("text", ""),
-                "timestamp": msg.get("timestamp", datetime.utcnow().isoformat() + "Z"),
+                "timestamp": msg.get("timestamp") or datetime.utcnow().isoformat() + "Z",
             }
             for msg in messages
         ]
+        return self.backend.append_chat_messages(report_id, user_id, stored_messages, summary)
 
-        doc = {
-            "_type": "chatConversation",
-            "reportId": report_id,
-            "userId": user_id,
-            "messages": sanity_messages,
-            "summary": summary,
-            "createdAt": datetime.utcnow().isoformat() + "Z",
-            "updatedAt": datetime.utcnow().isoformat() + "Z",
-        }
-
-        payload = {"mutations": [{"create": doc}]}
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-        }
+    def get_chat_history(
+        self, report_id: str, user_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> Optional[Dict]:
+        """Fetch chat history for a report, oldest message first; limit=None returns every message from offset."""
+        if not self.storage_available():
+            return None
+        return self.backend.fetch_chat_history(report_id, user_id, offset=offset, limit=limit)
 
-        try:
-            print(f"💾 Saving chat to Sanity: report_id={report_id}")
-            with httpx.Client(timeout=10.0) as client:
-                response = client.post(self._mutation_url(), json=payload, headers=headers)
-                response.raise_for_status()
-            print(f"✓ Chat saved to Sanity successfully")
-            return True
-        except Exception as e:
-            print(f"❌ Failed to save chat: {type(e).__name__}: {str(e)}")
+    def update_report_summary(
+        self, report_id: str, user_id: str, summary: str, document_id: Optional[str] = None
+    ) -> bool:
+        """Update the AI-generated summary for a report, by document id when the caller has it."""
+        if not self.storage_available():
             return False
+        return self.backend.set_report_summary(report_id, user_id, summary, document_id=document_id)
 
-    def get_chat_history(self, report_id: str, user_id: str) -> Optional[Dict]:
-        """Fetch chat history for a report."""
-        if not self._can_use_sanity():
-            return None
 
-        query = f'*[_type == "chatConversation" && reportId == "{report_id}" && userId == "{user_id}"][0]'
-        
-        headers = {"Authorization": f"Bearer {self.token}"}
-
-        try:
-            import urllib.parse
-            encoded_query = urllib.parse.quote(query)
-            url = f"{self._query_url()}?query={encoded_query}"
-            
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(url, headers=headers)
-                response.raise_for_status()
-                result = response.json().get("result")
-                if result:
-                    print(f"✓ Found chat history for report")
-                return result
-        except Exception as e:
-            print(f"⚠️ Failed to fetch chat history: {type(e).__name__}")
-            return None
+_sanity_service: Optional[SanityService] = None
 
-    def update_report_summary(self, report_id: str, user_id: str, summary: str) -> bool:
-        """Update the AI-generated summary for a report."""
-        if not self._can_use_sanity():
-            return False
 
-        try:
-            import urllib.parse
-            # First, get the document _id
-            query = f'*[_type == "medicalReport" && reportId == "{report_id}" && userId == "{user_id}"][0]{{_id}}'
-            encoded_query = urllib.parse.quote(query)
-            url = f"{self._query_url()}?query={encoded_query}"
-            
-            headers = {"Authorization": f"Bearer {self.token}"}
-            
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(url, headers=headers)
-                response.raise_for_status()
-                result = response.json().get("result")
-                
-                if not result or not result.get("_id"):
-                    print(f"⚠️ Report not found for summary update")
-                    return False
-                
-                doc_id = result["_id"]
-                
-                # Update the document with summary
-                patch = {
-                    "mutations": [
-                        {
-                            "patch": {
-                                "id": doc_id,
-                                "set": {
-                                    "summary": summary,
-                                    "summaryGeneratedAt": datetime.utcnow().isoformat() + "Z"
-                                }
-                            }
-                        }
-                    ]
-                }
-                
-                response = client.post(self._mutation_url(), json=patch, headers=headers)
-                response.raise_for_status()
-                print(f"✓ Summary updated in Sanity for report {report_id}")
-                return True
-                
-        except Exception as e:
-            print(f"❌ Failed to update summary: {type(e).__name__}: {str(e)}")
-            return False
+def get_sanity_service() -> SanityService:
+    """Process-wide SanityService so every router shares one cache and connection pool."""
+    global _sanity_service
+    if _sanity_service is None:
+        _sanity_service = SanityService()
+    return _sanity_service
@@ -0,0 +1,224 @@
+"""
+Semantic Question Cache
+Catches paraphrased questions about the same report ("what does my report say" /
+"explain my results") that the exact-match ResponseCache misses. Questions are
+embedded with a hashing vectoriser over normalised words and word pairs, and
+compared by cosine similarity against the answers already given for that report.
+Similarity alone cannot tell "should I be worried" from "should I not be
+worried", so questions must also agree on negation, direction words and the
+tests they name before they are compared.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import metrics
+
+Vector = Dict[int, float]
+
+DIMENSIONS = 1 << 18
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+# Words that carry no meaning for matching. Negations and direction words
+# ("not", "high", "low") are deliberately kept: they change the answer.
+STOPWORDS = frozenset(
+    """
+    a an the my me i im is are was were be been am do does did can could would should will
+    please tell what whats which how about of in on for to this that these those it its
+    there here any some and or with from at by you your we our us just kind mean means
+    give show want know need let like
+    """.split()
+)
+
+# Canonical forms for words patients use interchangeably about a report.
+SYNONYMS = {
+    "result": "report",
+    "results": "report",
+    "test": "report",
+    "tests": "report",
+    "lab": "report",
+    "labs": "report",
+    "bloodwork": "report",
+    "findings": "report",
+    "say": "explain",
+    "says": "explain",
+    "explain": "explain",
+    "describe": "explain",
+    "summarize": "explain",
+    "summarise": "explain",
+    "summary": "explain",
+    "overview": "explain",
+    "understand": "explain",
+    "meaning": "explain",
+    "elevated": "high",
+    "raised": "high",
+    "higher": "high",
+    "increased": "high",
+    "decreased": "low",
+    "lower": "low",
+    "reduced": "low",
+    "ok": "normal",
+    "okay": "normal",
+    "fine": "normal",
+    "sugar": "glucose",
+    "hb": "hemoglobin",
+    "haemoglobin": "hemoglobin",
+}
+
+
+NEGATIONS = frozenset({"not", "no", "never", "without", "none", "nothing", "neither", "nor"})
+DIRECTIONS = frozenset({"high", "low", "normal", "abnormal"})
+
+# Test and analyte names (after SYNONYMS); two questions naming different ones
+# are about different results however similar the rest of the wording is.
+ANALYTES = frozenset(
+    """
+    glucose a1c hba1c insulin hemoglobin hematocrit hct rbc wbc platelet platelets neutrophil
+    lymphocyte mcv mch mchc esr crp cholesterol ldl hdl triglyceride triglycerides lipid
+    creatinine urea bun egfr uric albumin bilirubin alt ast alp ggt sodium potassium chloride
+    calcium magnesium phosphate iron ferritin b12 folate tsh t3 t4 thyroid cortisol testosterone
+    estrogen psa vitamin urine protein ketone ketones
+    """.split()
+)
+
+
+def _normalize_token(token: str) -> str:
+    token = SYNONYMS.get(token, token)
+    if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+        token = SYNONYMS.get(token[:-1], token[:-1])
+    return token
+
+
+def question_terms(question: str) -> List[str]:
+    text = question.lower().replace("\u2019", "'").replace("n't", " not").replace("'s", "")
+    return [_normalize_token(t) for t in _TOKEN.findall(text) if t not in STOPWORDS]
+
+
+def question_signature(question: str) -> Tuple[bool, frozenset, frozenset]:
+    """What a cached answer's question must share exactly: (negated, directions, analytes)."""
+    terms = question_terms(question)
+    negated = sum(term in NEGATIONS for term in terms) % 2 == 1
+    return negated, frozenset(DIRECTIONS.intersection(terms)), frozenset(ANALYTES.intersection(terms))
+
+
+def embed(question: str) -> Vector:
+    """L2-normalised sparse hashing vector of words (weight 1) and adjacent word pairs (weight 0.5).
+
+    Pairs are unordered so "glucose high" and "high glucose" embed the same.
+    """
+    terms = question_terms(question)
+    features: List[Tuple[str, float]] = [(term, 1.0) for term in terms]
+    features += [(" ".join(sorted(pair)), 0.5) for pair in zip(terms, terms[1:])]
+
+    vector: Vector = {}
+    for feature, weight in features:
+        index = zlib.crc32(feature.encode("utf-8")) % DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + weight
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if norm:
+        vector = {k: v / norm for k, v in vector.items()}
+    return vector
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class SemanticCache:
+    """Per-scope brute-force vector index of answered questions.
+
+    A scope is everything that must match exactly for an answer to be reusable
+    (report content, mode, voice mode, model, prompt version); only the question
+    is compared by similarity. Reports hold a few dozen questions at most, so a
+    linear scan over sparse vectors is cheaper than maintaining an ANN structure.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        max_scopes: int = 1000,
+        max_entries_per_scope: int = 100,
+    ) -> None:
+        self.threshold = threshold or float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.86"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24")) * 3600
+        self.max_scopes = max_scopes
+        self.max_entries_per_scope = max_entries_per_scope
+        self._scopes: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        metrics.register_gauge("semantic_cache", self.stats)
+
+    def lookup(self, scope: str, question: str) -> Optional[Dict[str, Any]]:
+        """Return {"response", "model", "similarity"} for the closest fresh answer above the threshold."""
+        vector = embed(question)
+        if not vector:
+            return None
+        signature = question_signature(question)
+
+        now = time.time()
+        best: Optional[Dict[str, Any]] = None
+        best_score = 0.0
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries:
+                self._scopes.move_to_end(scope)
+                entries[:] = [e for e in entries if e["expires_at"] > now]
+                for entry in entries:
+                    if entry["signature"] != signature:
+                        continue
+                    score = cosine(vector, entry["vector"])
+                    if score > best_score:
+                        best, best_score = entry, score
+
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        metrics.observe("semantic_cache_hit_similarity", best_score)
+        return {"response": best["response"], "model": best["model"], "similarity": round(best_score, 4)}
+
+    def add(self, scope: str, question: str, response: str, model: Optional[str]) -> None:
+        vector = embed(question)
+        if not vector:
+            return
+        entry = {
+            "vector": vector,
+            "signature": question_signature(question),
+            "question": question,
+            "response": response,
+            "model": model,
+            "expires_at": time.time() + self.ttl_seconds,
+        }
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            self._scopes.move_to_end(scope)
+            entries.append(entry)
+            if len(entries) > self.max_entries_per_scope:
+                del entries[0]
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(entries) for entries in self._scopes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,814 @@
+"""
+Storage Backends
+Persistence behind SanityService: the Sanity HTTP API, or a local SQLite database
+for single-node deployments, development and load tests.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from services.outbox import SanityOutbox
+from utils.metrics import metrics
+from utils.query_cache import QueryCache
+from utils.sqlite import connect, data_path
+
+# Cache policy per query kind. Report documents are written once and never edited
+# apart from the summary, so they can be cached for long. "cdn" routes a kind
+# through the API CDN when SANITY_USE_CDN is on; the CDN is a shared cache that
+# can serve stale results, so only non-personal kinds may set it, and every kind
+# here holds medical data. "push_ttl" applies while the Sanity listener is
+# connected and invalidates entries as documents change.
+QUERY_POLICIES: Dict[str, Dict[str, Any]] = {
+    "report": {"ttl": 300, "push_ttl": 3600, "cdn": False},
+    "summary": {"ttl": 120, "push_ttl": 3600, "cdn": False},
+    "user_reports": {"ttl": 30, "push_ttl": 900, "cdn": False},
+    "chat_history": {"ttl": 15, "push_ttl": 600, "cdn": False},
+    "lookup": {"ttl": 0, "push_ttl": 0, "cdn": False},
+}
+
+REPORT_FIELDS = (
+    "_id, reportId, userId, label, reportType, uploadDate, extractedText, fileUrl, "
+    "summary, summaryGeneratedAt"
+)
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def report_document_id(report_id: str) -> str:
+    """Deterministic document id for a report, so retried creates are idempotent."""
+    return f"report-{report_id}"
+
+
+def conversation_id(report_id: str, user_id: str) -> str:
+    """Deterministic document id for the single conversation of a (report, user) pair."""
+    digest = hashlib.sha1(f"{report_id}|{user_id}".encode("utf-8")).hexdigest()
+    return f"chat-{digest}"
+
+
+def message_key(conversation: str, message: Dict[str, Any]) -> str:
+    """Deterministic _key for a chat message, so a retried append cannot store it twice."""
+    raw = json.dumps([conversation, message.get("timestamp"), message.get("role"), message.get("text")])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def new_messages(
+    messages: List[Dict[str, Any]], last_message_at: Optional[str], stored_keys: Iterable[str] = ()
+) -> List[Dict[str, Any]]:
+    """Keyed messages (see message_key) that are not stored yet.
+
+    Clients may resend the whole conversation on every save; only the tail that
+    has not been persisted yet is appended. Messages stamped with the last
+    stored timestamp are told apart by key (stored_keys holds the keys stored
+    at that timestamp), so two messages sharing a timestamp are both kept.
+    """
+    seen = set(stored_keys)
+    pending = []
+    for msg in messages:
+        if (msg.get("timestamp") or "") >= (last_message_at or "") and msg["_key"] not in seen:
+            seen.add(msg["_key"])
+            pending.append(msg)
+    return pending
+
+
+def _tail_after(
+    last_message_at: Optional[str], stored_keys: Set[str], pending: List[Dict[str, Any]]
+) -> Tuple[Optional[str], Set[str]]:
+    """Newest stored timestamp and the keys stored at it, once pending has been appended."""
+    newest = max([msg.get("timestamp") or "" for msg in pending] + [last_message_at or ""]) or None
+    keys = {msg["_key"] for msg in pending if (msg.get("timestamp") or "") == (newest or "")}
+    if newest == last_message_at:
+        keys |= stored_keys
+    return newest, keys
+
+
+def map_report(doc: Dict[str, Any]) -> Dict[str, str]:
+    """Convert a stored medicalReport document into the service's record shape."""
+    return {
+        "report_id": doc.get("reportId") or "",
+        "user_id": doc.get("userId") or "",
+        "file_url": doc.get("fileUrl") or "",
+        "extracted_text": doc.get("extractedText") or "",
+        "upload_date": doc.get("uploadDate") or "",
+        "report_type": doc.get("reportType") or "",
+        "label": doc.get("label") or "",
+    }
+
+
+class StorageBackend:
+    """Interface implemented by every persistence backend.
+
+    Reads return None/[] when nothing is found; upstream failures on reads raise
+    only where noted, so callers can tell "missing" from "unavailable".
+    """
+
+    name = "base"
+
+    def is_available(self) -> bool:
+        raise NotImplementedError
+
+    def insert_report(self, record: Dict[str, str]) -> None:
+        raise NotImplementedError
+
+    def fetch_report(self, report_id: str, user_id: str) -> Optional[Dict[str, str]]:
+        raise NotImplementedError
+
+    def fetch_report_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return {summary, summaryGeneratedAt}. May raise on upstream errors."""
+        raise NotImplementedError
+
+    def fetch_report_for_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return {_id, extractedText, summary, summaryGeneratedAt} in one read. May raise on upstream errors."""
+        raise NotImplementedError
+
+    def list_user_reports(self, user_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def append_chat_messages(
+        self, report_id: str, user_id: str, messages: List[Dict[str, Any]], summary: str = ""
+    ) -> bool:
+        """Append messages to the (report, user) conversation, creating it if needed."""
+        raise NotImplementedError
+
+    def fetch_chat_history(
+        self, report_id: str, user_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Return the conversation with messages[offset:offset + limit] in chronological order.
+
+        limit=None returns every message from offset on.
+        """
+        raise NotImplementedError
+
+    def set_report_summary(
+        self, report_id: str, user_id: str, summary: str, document_id: Optional[str] = None
+    ) -> bool:
+        """Store a summary; document_id (from a previous read) lets backends patch by id."""
+        raise NotImplementedError
+
+    def apply_mutation(self, payload: Dict[str, Any]) -> None:
+        """React to an external change notification. No-op for backends without caches."""
+
+    def set_push_invalidation(self, enabled: bool) -> None:
+        """Toggle listener-backed cache TTLs. No-op for backends without caches."""
+
+
+class SanityStorage(StorageBackend):
+    """Sanity HTTP API backend with a read-through query cache."""
+
+    name = "sanity"
+
+    def __init__(self) -> None:
+        self.project_id = os.getenv("SANITY_PROJECT_ID")
+        self.dataset = os.getenv("SANITY_DATASET")
+        self.token = os.getenv("SANITY_API_TOKEN")
+        self.use_cdn = os.getenv("SANITY_USE_CDN", "false").lower() == "true"
+        self.cache_enabled = os.getenv("SANITY_QUERY_CACHE", "true").lower() != "false"
+        self.query_cache = QueryCache(max_entries=int(os.getenv("SANITY_QUERY_CACHE_SIZE", "1000")))
+        self._http: Optional[httpx.Client] = None
+        self.push_invalidation = False
+        # Bumped on every invalidation; a query that overlapped one does not cache its result.
+        self._invalidations = 0
+        # Newest message timestamp per conversation and the message keys stored at
+        # it, including appends still in the outbox.
+        self._chat_cursors: "OrderedDict[str, Tuple[str, Set[str]]]" = OrderedDict()
+        self.outbox: Optional[SanityOutbox] = None
+        if self.is_available():
+            metrics.register_gauge("sanity_query_cache", self.query_cache.stats)
+            if os.getenv("SANITY_OUTBOX", "true").lower() != "false":
+                self.outbox = SanityOutbox(send=self._mutate, on_sent=self._invalidate_tags)
+                self.outbox.start()
+
+    def is_available(self) -> bool:
+        return bool(self.project_id and self.dataset and self.token)
+
+    def _mutation_url(self) -> str:
+        return f"https://{self.project_id}.api.sanity.io/v2023-10-18/data/mutate/{self.dataset}"
+
+    def _query_url(self, use_cdn: bool = False) -> str:
+        host = "apicdn.sanity.io" if use_cdn else "api.sanity.io"
+        return f"https://{self.project_id}.{host}/v2023-10-18/data/query/{self.dataset}"
+
+    def _client(self) -> httpx.Client:
+        """Shared HTTP client so repeated queries reuse pooled connections."""
+        if self._http is None:
+            self._http = httpx.Client(timeout=10.0)
+        return self._http
+
+    def _mutate(self, mutations: List[Dict[str, Any]]) -> None:
+        headers = {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json",
+        }
+        response = self._client().post(self._mutation_url(), json={"mutations": mutations}, headers=headers)
+        response.raise_for_status()
+
+    def _invalidate_tags(self, tags: List[str]) -> None:
+        self._invalidations += 1
+        self.query_cache.invalidate_tags(*tags)
+
+    def _write(self, mutations: List[Dict[str, Any]], tags: List[str]) -> None:
+        """Apply mutations through the outbox when enabled, otherwise synchronously.
+
+        Tags are invalidated right away and again once the write has landed, so a
+        read in between cannot leave a stale result cached.
+        """
+        if self.outbox is not None:
+            self.outbox.enqueue(mutations, tags)
+        else:
+            self._mutate(mutations)
+        self._invalidate_tags(tags)
+
+    def _query(
+        self,
+        query: str,
+        params: Optional[Dict[str, Any]] = None,
+        kind: str = "lookup",
+        tags: Iterable[str] = (),
+    ) -> Any:
+        """Run a GROQ query through the read-through cache.
+
+        Fresh cache entries are returned without a request. Stale entries that
+        carry an ETag are revalidated with If-None-Match, so an unchanged result
+        costs a 304 instead of a full download. Raises on HTTP errors.
+        """
+        policy = QUERY_POLICIES.get(kind, QUERY_POLICIES["lookup"])
+        ttl = policy["push_ttl" if self.push_invalidation else "ttl"] if self.cache_enabled else 0
+        params = params or {}
+        key = QueryCache.make_key(query, params)
+
+        entry = self.query_cache.lookup(key) if ttl > 0 else None
+        if entry is not None and QueryCache.is_fresh(entry):
+            return entry["value"]
+
+        headers = {"Authorization": f"Bearer {self.token}"}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+
+        query_params = {"query": query}
+        for name, value in params.items():
+            query_params[f"${name}"] = json.dumps(value)
+
+        use_cdn = self.use_cdn and policy["cdn"]
+        invalidations = self._invalidations
+        response = self._client().get(self._query_url(use_cdn), params=query_params, headers=headers)
+        # An invalidation that arrived while the query was in flight may postdate
+        # the result; caching it would keep it stale for a whole (push) TTL.
+        overlapped = invalidations != self._invalidations
+
+        if response.status_code == 304 and entry is not None:
+            if not overlapped:
+                self.query_cache.refresh(key, ttl)
+            return entry["value"]
+
+        response.raise_for_status()
+        result = response.json().get("result")
+
+        # Never cache misses: a report created a moment ago must become visible immediately.
+        if ttl > 0 and result and not overlapped:
+            tags = set(tags)
+            for doc in result if isinstance(result, list) else [result]:
+                if isinstance(doc, dict) and doc.get("_id"):
+                    tags.add(f"doc:{doc['_id']}")
+            self.query_cache.store(key, result, ttl, etag=response.headers.get("etag"), tags=tags)
+        return result
+
+    def invalidate_report(self, report_id: str, user_id: Optional[str] = None) -> None:
+        """Drop cached query results that involve a report (and the owner's report list)."""
+        tags = [f"report:{report_id}"]
+        if user_id:
+            tags.append(f"user:{user_id}")
+        self._invalidate_tags(tags)
+
+    def set_push_invalidation(self, enabled: bool) -> None:
+        """Switch between short TTLs and long, listener-backed TTLs.
+
+        Entries cached under push invalidation may have missed events while the
+        listener was down, so they are dropped when it disconnects.
+        """
+        if self.push_invalidation and not enabled:
+            self._invalidations += 1
+            self.query_cache.clear()
+        self.push_invalidation = enabled
+
+    def apply_mutation(self, payload: Dict[str, Any]) -> None:
+        """Invalidate cached data touched by a Sanity mutation event."""
+        doc = payload.get("result") or payload.get("previous") or {}
+        document_id = payload.get("documentId") or doc.get("_id")
+        tags = []
+        if document_id:
+            tags.append(f"doc:{document_id}")
+
+        doc_type = doc.get("_type")
+        report_id = doc.get("reportId")
+        user_id = doc.get("userId")
+        if doc_type == "medicalReport" and report_id:
+            tags.append(f"report:{report_id}")
+            if user_id:
+                tags.append(f"user:{user_id}")
+        elif doc_type == "chatConversation" and report_id and user_id:
+            tags.append(f"chat:{report_id}:{user_id}")
+
+        if tags:
+            self._invalidate_tags(tags)
+
+    def insert_report(self, record: Dict[str, str]) -> None:
+        report_id = record["report_id"]
+        user_id = record["user_id"]
+        doc = {
+            "_id": report_document_id(report_id),
+            "_type": "medicalReport",
+            "reportId": report_id,
+            "userId": user_id,
+            "fileUrl": record.get("file_url") or None,
+            "extractedText": record["extracted_text"],
+            "uploadDate": record["upload_date"],
+            "reportType": record.get("report_type") or None,
+            "label": record.get("label") or None,
+        }
+        try:
+            print(f"📝 Saving report to Sanity: report_id={report_id}, user_id={user_id}")
+            self._write([{"createIfNotExists": doc}], tags=[f"user:{user_id}"])
+            print(f"✓ Report {'queued for' if self.outbox else 'saved to'} Sanity successfully")
+        except Exception as e:
+            print(f"❌ Failed to save to Sanity: {type(e).__name__}: {str(e)}")
+
+    def fetch_report(self, report_id: str, user_id: str) -> Optional[Dict[str, str]]:
+        query = '*[_type == "medicalReport" && reportId == $reportId && userId == $userId][0]'
+        try:
+            data = self._query(
+                query,
+                {"reportId": report_id, "userId": user_id},
+                kind="report",
+                tags=[f"report:{report_id}"],
+            )
+            print(f"✓ Query successful")
+        except Exception as e:
+            print(f"❌ Sanity query failed: {type(e).__name__}: {str(e)}")
+            return None
+
+        if not data:
+            print(f"⚠️ No document found in Sanity")
+            return None
+        return map_report(data)
+
+    def fetch_report_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        query = (
+            '*[_type == "medicalReport" && reportId == $reportId && userId == $userId][0]'
+            "{summary, summaryGeneratedAt}"
+        )
+        return self._query(
+            query,
+            {"reportId": report_id, "userId": user_id},
+            kind="summary",
+            tags=[f"report:{report_id}"],
+        )
+
+    def fetch_report_for_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        query = (
+            '*[_type == "medicalReport" && reportId == $reportId && userId == $userId][0]'
+            "{_id, extractedText, summary, summaryGeneratedAt}"
+        )
+        return self._query(
+            query,
+            {"reportId": report_id, "userId": user_id},
+            kind="summary",
+            tags=[f"report:{report_id}"],
+        )
+
+    def list_user_reports(self, user_id: str) -> List[Dict[str, Any]]:
+        query = f'*[_type == "medicalReport" && userId == $userId] | order(uploadDate desc) {{{REPORT_FIELDS}}}'
+
+        print(f"📊 Querying user reports: userId={user_id}")
+        try:
+            reports = self._query(
+                query,
+                {"userId": user_id},
+                kind="user_reports",
+                tags=[f"user:{user_id}"],
+            ) or []
+            print(f"✓ Found {len(reports)} reports for user")
+            return reports
+        except Exception as e:
+            print(f"❌ Failed to fetch reports: {type(e).__name__}: {str(e)}")
+            return []
+
+    def append_chat_messages(
+        self, report_id: str, user_id: str, messages: List[Dict[str, Any]], summary: str = ""
+    ) -> bool:
+        doc_id = conversation_id(report_id, user_id)
+        keyed = [{**msg, "_key": message_key(doc_id, msg)} for msg in messages]
+        try:
+            state = self._query(
+                '*[_id == $id][0]{lastMessageAt, "lastKeys": messages[timestamp == ^.lastMessageAt]._key}',
+                {"id": doc_id},
+                kind="lookup",
+            ) or {}
+            last_message_at = state.get("lastMessageAt") or ""
+            stored_keys = set(state.get("lastKeys") or [])
+            cursor_at, cursor_keys = self._chat_cursors.get(doc_id, ("", set()))
+            if cursor_at > last_message_at:
+                last_message_at, stored_keys = cursor_at, set(cursor_keys)
+            elif cursor_at and cursor_at == last_message_at:
+                stored_keys |= cursor_keys
+            pending = new_messages(keyed, last_message_at, stored_keys)
+            if not pending and not summary:
+                return True
+
+            now = _now()
+            patch: Dict[str, Any] = {
+                "id": doc_id,
+                "setIfMissing": {"messages": []},
+                "set": {"updatedAt": now},
+            }
+            mutations: List[Dict[str, Any]] = [
+                {
+                    "createIfNotExists": {
+                        "_id": doc_id,
+                        "_type": "chatConversation",
+                        "reportId": report_id,
+                        "userId": user_id,
+                        "messages": [],
+                        "createdAt": now,
+                    }
+                },
+            ]
+            if pending:
+                # If a timed-out attempt of this transaction actually landed, the
+                # retry removes those copies before inserting them again.
+                mutations.append(
+                    {"patch": {"id": doc_id, "unset": [f"messages[_key=={json.dumps(msg['_key'])}]" for msg in pending]}}
+                )
+                patch["insert"] = {"after": "messages[-1]", "items": pending}
+                patch["set"]["lastMessageAt"] = max(msg["timestamp"] for msg in pending)
+            if summary:
+                patch["set"]["summary"] = summary
+            mutations.append({"patch": patch})
+
+            print(f"💾 Appending {len(pending)} chat messages to Sanity: report_id={report_id}")
+            self._write(mutations, tags=[f"chat:{report_id}:{user_id}"])
+            if pending:
+                self._chat_cursors[doc_id] = _tail_after(last_message_at or None, stored_keys, pending)
+                self._chat_cursors.move_to_end(doc_id)
+                while len(self._chat_cursors) > 10000:
+                    self._chat_cursors.popitem(last=False)
+            print(f"✓ Chat saved to Sanity successfully")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to save chat: {type(e).__name__}: {str(e)}")
+            return False
+
+    def fetch_chat_history(
+        self, report_id: str, user_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        # Older deployments created one document per save; the most recently
+        # updated one is the most complete.
+        start = int(offset)
+        window = f"{start}...{start + int(limit)}" if limit is not None else f"{start}..-1"
+        query = (
+            '*[_type == "chatConversation" && reportId == $reportId && userId == $userId]'
+            " | order(updatedAt desc)[0]"
+            "{_id, reportId, userId, summary, createdAt, updatedAt,"
+            f' "totalMessages": count(messages), "messages": messages[{window}]}}'
+        )
+        try:
+            result = self._query(
+                query,
+                {"reportId": report_id, "userId": user_id},
+                kind="chat_history",
+                tags=[f"chat:{report_id}:{user_id}"],
+            )
+            if result:
+                print(f"✓ Found chat history for report")
+            return result
+        except Exception as e:
+            print(f"⚠️ Failed to fetch chat history: {type(e).__name__}")
+            return None
+
+    def set_report_summary(
+        self, report_id: str, user_id: str, summary: str, document_id: Optional[str] = None
+    ) -> bool:
+        fields = {"summary": summary, "summaryGeneratedAt": _now()}
+        tags = [f"report:{report_id}", f"user:{user_id}"]
+        if document_id:
+            patch = {"id": document_id, "set": fields}
+            tags.append(f"doc:{document_id}")
+        else:
+            # Patch by query rather than looking the document id up first; string
+            # literals are JSON-encoded, which is valid GROQ string syntax.
+            query = (
+                f'*[_type == "medicalReport" && reportId == {json.dumps(report_id)}'
+                f" && userId == {json.dumps(user_id)}]"
+            )
+            patch = {"query": query, "set": fields}
+        try:
+            self._write([{"patch": patch}], tags=tags)
+            print(f"✓ Summary update {'queued' if self.outbox else 'saved'} for report {report_id}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to update summary: {type(e).__name__}: {str(e)}")
+            return False
+
+
+class SQLiteStorage(StorageBackend):
+    """Local SQLite backend (WAL mode) with the same document shapes as Sanity."""
+
+    name = "sqlite"
+
+    # PRAGMA user_version of the current layout: 1 stored each conversation's
+    # messages as a JSON column, 2 keeps them in chat_messages.
+    SCHEMA_VERSION = 2
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS medical_reports (
+            _id TEXT PRIMARY KEY,
+            reportId TEXT NOT NULL,
+            userId TEXT NOT NULL,
+            fileUrl TEXT,
+            extractedText TEXT,
+            uploadDate TEXT,
+            reportType TEXT,
+            label TEXT,
+            summary TEXT,
+            summaryGeneratedAt TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_reports_user_upload ON medical_reports (userId, uploadDate);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_report_user ON medical_reports (reportId, userId);
+
+        CREATE TABLE IF NOT EXISTS chat_conversations (
+            _id TEXT PRIMARY KEY,
+            reportId TEXT NOT NULL,
+            userId TEXT NOT NULL,
+            summary TEXT,
+            lastMessageAt TEXT,
+            createdAt TEXT,
+            updatedAt TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_report_user ON chat_conversations (reportId, userId);
+
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            conversationId TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            key TEXT,
+            role TEXT,
+            text TEXT,
+            timestamp TEXT,
+            PRIMARY KEY (conversationId, seq)
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_key ON chat_messages (conversationId, key);
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("LOCAL_DB_PATH") or data_path("nueracare.db")
+        self._lock = threading.Lock()
+        self._conn = connect(self.path)
+        self._migrate()
+
+    def _columns(self, table: str) -> Set[str]:
+        return {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+
+    def _migrate(self) -> None:
+        """Create the schema, upgrading databases written by earlier layouts first."""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            self._conn.executescript(self.SCHEMA)
+            return
+
+        legacy_chats = "messages" in self._columns("chat_conversations")
+        if legacy_chats:
+            # One row per save with the whole message list; move it aside and rebuild below.
+            self._conn.executescript(
+                """
+                ALTER TABLE chat_conversations RENAME TO chat_conversations_v1;
+                DROP INDEX IF EXISTS idx_chats_report_user;
+                """
+            )
+        columns = self._columns("chat_messages")
+        if columns and "key" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE chat_messages ADD COLUMN key TEXT")
+                rows = self._conn.execute("SELECT rowid, conversationId, role, text, timestamp FROM chat_messages")
+                self._conn.executemany(
+                    "UPDATE chat_messages SET key = ? WHERE rowid = ?",
+                    [(message_key(row["conversationId"], dict(row)), row["rowid"]) for row in rows.fetchall()],
+                )
+        self._conn.executescript(self.SCHEMA)
+        if legacy_chats:
+            self._migrate_legacy_chats()
+        self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _migrate_legacy_chats(self) -> None:
+        rows = self._conn.execute(
+            "SELECT * FROM chat_conversations_v1 ORDER BY updatedAt"
+        ).fetchall()
+        # The most recently updated document of a (report, user) pair is the most complete.
+        latest = {(row["reportId"], row["userId"]): row for row in rows}
+        with self._conn:
+            for (report_id, user_id), row in latest.items():
+                doc_id = conversation_id(report_id, user_id)
+                messages = json.loads(row["messages"] or "[]")
+                timestamps = [msg.get("timestamp") for msg in messages if msg.get("timestamp")]
+                self._conn.execute(
+                    """
+                    INSERT OR IGNORE INTO chat_conversations
+                        (_id, reportId, userId, summary, lastMessageAt, createdAt, updatedAt)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (doc_id, report_id, user_id, row["summary"], max(timestamps, default=None),
+                     row["createdAt"], row["updatedAt"]),
+                )
+                self._conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO chat_messages (conversationId, seq, key, role, text, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (doc_id, seq, message_key(doc_id, msg), msg.get("role"), msg.get("text"), msg.get("timestamp"))
+                        for seq, msg in enumerate(messages)
+                    ],
+                )
+            self._conn.execute("DROP TABLE chat_conversations_v1")
+        print(f"✓ Migrated {len(latest)} chat conversations to the per-message layout")
+
+    def is_available(self) -> bool:
+        return True
+
+    def insert_report(self, record: Dict[str, str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO medical_reports
+                    (_id, reportId, userId, fileUrl, extractedText, uploadDate, reportType, label)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (reportId, userId) DO UPDATE SET
+                    fileUrl = excluded.fileUrl,
+                    extractedText = excluded.extractedText,
+                    uploadDate = excluded.uploadDate,
+                    reportType = excluded.reportType,
+                    label = excluded.label
+                """,
+                (
+                    report_document_id(record["report_id"]),
+                    record["report_id"],
+                    record["user_id"],
+                    record.get("file_url") or None,
+                    record["extracted_text"],
+                    record["upload_date"],
+                    record.get("report_type") or None,
+                    record.get("label") or None,
+                ),
+            )
+
+    def _fetch_report_row(self, report_id: str, user_id: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM medical_reports WHERE reportId = ? AND userId = ?",
+                (report_id, user_id),
+            ).fetchone()
+
+    def fetch_report(self, report_id: str, user_id: str) -> Optional[Dict[str, str]]:
+        row = self._fetch_report_row(report_id, user_id)
+        return map_report(dict(row)) if row else None
+
+    def fetch_report_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._fetch_report_row(report_id, user_id)
+        if not row:
+            return None
+        return {"summary": row["summary"], "summaryGeneratedAt": row["summaryGeneratedAt"]}
+
+    def fetch_report_for_summary(self, report_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT _id, extractedText, summary, summaryGeneratedAt FROM medical_reports
+                WHERE reportId = ? AND userId = ?
+                """,
+                (report_id, user_id),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list_user_reports(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {REPORT_FIELDS} FROM medical_reports WHERE userId = ? ORDER BY uploadDate DESC",
+                (user_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def append_chat_messages(
+        self, report_id: str, user_id: str, messages: List[Dict[str, Any]], summary: str = ""
+    ) -> bool:
+        doc_id = conversation_id(report_id, user_id)
+        keyed = [{**msg, "_key": message_key(doc_id, msg)} for msg in messages]
+        now = _now()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO chat_conversations (_id, reportId, userId, createdAt, updatedAt)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (_id) DO NOTHING
+                """,
+                (doc_id, report_id, user_id, now, now),
+            )
+            state = self._conn.execute(
+                """
+                SELECT c.lastMessageAt, COALESCE(MAX(m.seq), -1) AS lastSeq
+                FROM chat_conversations c LEFT JOIN chat_messages m ON m.conversationId = c._id
+                WHERE c._id = ?
+                """,
+                (doc_id,),
+            ).fetchone()
+            stored_keys = {
+                row["key"]
+                for row in self._conn.execute(
+                    "SELECT key FROM chat_messages WHERE conversationId = ? AND timestamp = ?",
+                    (doc_id, state["lastMessageAt"]),
+                )
+            }
+            pending = new_messages(keyed, state["lastMessageAt"], stored_keys)
+            self._conn.executemany(
+                """
+                INSERT INTO chat_messages (conversationId, seq, key, role, text, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (doc_id, state["lastSeq"] + 1 + i, msg["_key"], msg.get("role"), msg.get("text"), msg.get("timestamp"))
+                    for i, msg in enumerate(pending)
+                ],
+            )
+            last_message_at = max([msg["timestamp"] for msg in pending] + [state["lastMessageAt"] or ""])
+            self._conn.execute(
+                """
+                UPDATE chat_conversations
+                SET updatedAt = ?, lastMessageAt = ?, summary = COALESCE(NULLIF(?, ''), summary)
+                WHERE _id = ?
+                """,
+                (now, last_message_at or None, summary, doc_id),
+            )
+        return True
+
+    def fetch_chat_history(
+        self, report_id: str, user_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        doc_id = conversation_id(report_id, user_id)
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT _id, reportId, userId, summary, createdAt, updatedAt,
+                       (SELECT COUNT(*) FROM chat_messages WHERE conversationId = _id) AS totalMessages
+                FROM chat_conversations WHERE _id = ?
+                """,
+                (doc_id,),
+            ).fetchone()
+            if not row:
+                return None
+            messages = self._conn.execute(
+                """
+                SELECT role, text, timestamp FROM chat_messages
+                WHERE conversationId = ? ORDER BY seq LIMIT ? OFFSET ?
+                """,
+                (doc_id, -1 if limit is None else limit, offset),
+            ).fetchall()
+        chat = dict(row)
+        chat["_type"] = "chatConversation"
+        chat["messages"] = [dict(message) for message in messages]
+        return chat
+
+    def set_report_summary(
+        self, report_id: str, user_id: str, summary: str, document_id: Optional[str] = None
+    ) -> bool:
+        with self._lock, self._conn:
+            if document_id:
+                cursor = self._conn.execute(
+                    "UPDATE medical_reports SET summary = ?, summaryGeneratedAt = ? WHERE _id = ?",
+                    (summary, _now(), document_id),
+                )
+            else:
+                cursor = self._conn.execute(
+                    """
+                    UPDATE medical_reports SET summary = ?, summaryGeneratedAt = ?
+                    WHERE reportId = ? AND userId = ?
+                    """,
+                    (summary, _now(), report_id, user_id),
+                )
+        return cursor.rowcount > 0
+
+
+def create_storage_backend() -> StorageBackend:
+    """Pick the backend from STORAGE_BACKEND, defaulting to Sanity when it is configured."""
+    choice = os.getenv("STORAGE_BACKEND", "").lower()
+    if choice == "sqlite":
+        return SQLiteStorage()
+    sanity = SanityStorage()
+    if choice == "sanity" or sanity.is_available():
+        return sanity
+    print("⚠️ Sanity not configured, using local SQLite storage")
+    return SQLiteStorage()
@@ -0,0 +1,185 @@
+"""
+Summary Prefetcher
+Generates report summaries in the background as soon as a report is uploaded,
+so the first dashboard view finds the summary already cached instead of
+waiting on a Groq call.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from services.summary_service import SummaryService
+from utils.metrics import metrics
+from utils.rate_limit import RateLimiter
+
+GLOBAL_BUDGET_KEY = "prefetch"
+
+
+class SummaryPrefetcher:
+    """Low-priority background queue of summary generation jobs.
+
+    A single worker drains the queue. It stays within a global budget of
+    prefetch calls per minute (SUMMARY_PREFETCH_PER_MINUTE), runs in the LLM
+    scheduler's "backfill" class so interactive requests always go first, and
+    goes through SummaryService.generate_summary so the per-user rate limiter
+    still applies.
+    Jobs that are rate limited or over a token budget are retried once after the
+    wait time (when it is short);
+    jobs that arrive while the queue is full are dropped and the summary is
+    generated on demand as before.
+    """
+
+    MAX_ATTEMPTS = 2
+    MAX_RETRY_DELAY_SECONDS = 300
+
+    def __init__(
+        self,
+        summary_service: SummaryService,
+        sanity_service,
+        per_minute: Optional[int] = None,
+        max_queue: Optional[int] = None,
+    ) -> None:
+        self.summary_service = summary_service
+        self.sanity_service = sanity_service
+        self.enabled = os.getenv("SUMMARY_PREFETCH", "true").lower() != "false"
+        self.budget = RateLimiter(
+            "summary_prefetch",
+            max_calls=per_minute or int(os.getenv("SUMMARY_PREFETCH_PER_MINUTE", "20")),
+            window_seconds=60,
+        )
+        self.max_queue = max_queue or int(os.getenv("SUMMARY_PREFETCH_QUEUE", "100"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+        metrics.register_gauge("summary_prefetch_queue", lambda: len(self._pending))
+
+    def _jobs(self) -> asyncio.Queue:
+        # Created lazily so the queue binds to the running event loop.
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        return self._queue
+
+    def enqueue(
+        self,
+        report_id: str,
+        user_id: str,
+        extracted_text: str,
+        parsed_values: List[Dict[str, Any]],
+        document_id: Optional[str] = None,
+        attempt: int = 1,
+    ) -> bool:
+        """Queue a report for summary generation. Never blocks; returns False if not queued.
+
+        document_id is the report document's id from the upload. Patching by id
+        queues the summary behind the report's create in the Sanity outbox; a
+        patch by reportId would find nothing while the create is still queued.
+        """
+        if not self.enabled or not self.summary_service._can_call_api() or not extracted_text.strip():
+            return False
+        if attempt == 1 and report_id in self._pending:
+            return False
+
+        job = {
+            "report_id": report_id,
+            "user_id": user_id,
+            "extracted_text": extracted_text,
+            "parsed_values": parsed_values,
+            "document_id": document_id,
+            "attempt": attempt,
+        }
+        try:
+            self._jobs().put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.increment("summary_prefetch_dropped")
+            self._pending.discard(report_id)
+            return False
+
+        self._pending.add(report_id)
+        self.start()
+        return True
+
+    def start(self) -> None:
+        """Start the worker as a task on the running event loop."""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        queue = self._jobs()
+        while True:
+            job = await queue.get()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.increment("summary_prefetch_failed")
+                self._pending.discard(job["report_id"])
+                print(f"⚠️ Summary prefetch failed for {job['report_id']}: {type(e).__name__}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def _wait_for_turn(self) -> None:
+        """Block until the global prefetch budget has room."""
+        while not await self.budget.is_allowed_async(GLOBAL_BUDGET_KEY):
+            await asyncio.sleep(max(1, await self.budget.get_wait_time_async(GLOBAL_BUDGET_KEY)))
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        report_id, user_id = job["report_id"], job["user_id"]
+        if self.summary_service.cache.get(report_id):
+            self._pending.discard(report_id)
+            return
+
+        await self._wait_for_turn()
+        result = await self.summary_service.generate_summary(
+            report_id=report_id,
+            user_id=user_id,
+            extracted_text=job["extracted_text"],
+            parsed_values=job["parsed_values"],
+            priority="backfill",
+        )
+
+        if result.get("wait_time") is not None:
+            # The user's rate limit or a token budget is exhausted; try again once it frees up.
+            if job["attempt"] < self.MAX_ATTEMPTS and result["wait_time"] <= self.MAX_RETRY_DELAY_SECONDS:
+                asyncio.get_running_loop().call_later(
+                    result["wait_time"] + 1,
+                    lambda: self.enqueue(
+                        report_id,
+                        user_id,
+                        job["extracted_text"],
+                        job["parsed_values"],
+                        document_id=job["document_id"],
+                        attempt=job["attempt"] + 1,
+                    ),
+                )
+                return
+            metrics.increment("summary_prefetch_skipped")
+            self._pending.discard(report_id)
+            return
+
+        self._pending.discard(report_id)
+        summary = result.get("summary")
+        if result.get("error") or not summary:
+            metrics.increment("summary_prefetch_failed")
+            print(f"⚠️ Summary prefetch for {report_id} returned no summary: {result.get('error')}")
+            return
+
+        # generate_summary has already put it in the SummaryCache; persist it like the endpoint does.
+        if not result.get("cached"):
+            await asyncio.to_thread(
+                self.sanity_service.update_report_summary, report_id, user_id, summary, job["document_id"]
+            )
+        metrics.increment("summary_prefetch_generated")
+        print(f"✓ Prefetched summary for report {report_id}")
@@ -5,84 +5,224 @@ Generates AI summaries for medical reports with intelligent caching to save API
 from __future__ import annotations
 
 import os
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Optional, Any
-from collections import defaultdict
+from collections import OrderedDict
 
 import httpx
 
+from services.llm_client import get_llm_client
+from services.llm_scheduler import QueueDeadlineExceeded
+from services.report_index import is_out_of_range, report_indexes, select_values
+from services.token_quota import estimate_tokens, get_token_quota, usage_tokens
 from utils.safety import build_system_prompt
+from utils.metrics import metrics
+from utils.rate_limit import RateLimiter
+from utils.single_flight import SingleFlight
+from utils.sqlite import connect, data_path
+from utils.token_budget import PromptBudget
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You are a medical assistant that creates simple, friendly summaries of medical reports. "
+    "Use clear language and avoid technical jargon."
+)
+SUMMARY_ANSWER_TOKENS = 300
+# Retry-After suggested when a summary gives up waiting for an LLM slot
+QUEUE_RETRY_SECONDS = 5
 
 
 class SummaryCache:
-    """In-memory cache for summaries with TTL (Time To Live)."""
+    """Two-tier summary cache with TTL (Time To Live).
+
+    An in-process LRU bounded by entry count and total summary bytes sits in
+    front of a SQLite tier shared by every worker on the node, so a summary
+    generated by one worker is served by the others without another API call.
+    Memory entries live at most SUMMARY_CACHE_MEMORY_SECONDS, so a summary
+    regenerated or invalidated in another worker is picked up from the shared
+    tier soon after. A background thread sweeps expired entries from both tiers.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            report_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_summary_cache_expiry ON summary_cache (expires_at);
+    """
     
-    def __init__(self, ttl_hours: int = 24):
-        self.cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(
+        self,
+        ttl_hours: int = 24,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        path: Optional[str] = None,
+        sweep_seconds: Optional[float] = None,
+    ):
         self.ttl_hours = ttl_hours
+        self.max_entries = max_entries or int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))
+        self.max_bytes = max_bytes or int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+        self.sweep_seconds = sweep_seconds or float(os.getenv("SUMMARY_CACHE_SWEEP_SECONDS", "300"))
+        self.memory_seconds = float(os.getenv("SUMMARY_CACHE_MEMORY_SECONDS", "300"))
+        self.path = path or os.getenv("SUMMARY_CACHE_PATH") or data_path("summary_cache.db")
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self._conn = None
+        try:
+            self._conn = connect(self.path)
+            self._conn.executescript(self.SCHEMA)
+        except Exception as e:
+            print(f"⚠️ Summary cache persistent tier unavailable: {type(e).__name__}: {str(e)}")
+            self._conn = None
+        
+        metrics.register_gauge("summary_cache", self.stats)
     
     def get(self, report_id: str) -> Optional[str]:
         """Get cached summary if available and not expired."""
-        if report_id not in self.cache:
-            return None
-        
-        cached_data = self.cache[report_id]
-        cached_time = cached_data.get("timestamp")
-        
-        if not cached_time:
-            return None
+        now = time.time()
+        with self._lock:
+            entry = self.cache.get(report_id)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    self.cache.move_to_end(report_id)
+                    self.memory_hits += 1
+                    return entry["summary"]
+                self._remove(report_id)
+                self.expirations += 1
         
-        # Check if cache has expired
-        if datetime.now() - cached_time > timedelta(hours=self.ttl_hours):
-            del self.cache[report_id]
-            return None
+        row = None
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT summary, expires_at FROM summary_cache WHERE report_id = ? AND expires_at > ?",
+                        (report_id, now),
+                    ).fetchone()
+            except Exception as e:
+                print(f"⚠️ Summary cache read failed: {type(e).__name__}: {str(e)}")
         
-        return cached_data.get("summary")
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(report_id, row["summary"], row["expires_at"])
+        return row["summary"]
     
     def set(self, report_id: str, summary: str) -> None:
-        """Store summary in cache with current timestamp."""
-        self.cache[report_id] = {
-            "summary": summary,
-            "timestamp": datetime.now()
-        }
+        """Store summary in both tiers with the cache TTL."""
+        now = time.time()
+        expires_at = now + self.ttl_hours * 3600
+        with self._lock:
+            self._store(report_id, summary, expires_at)
+        self._start_sweeper()
+        if self._conn is None:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO summary_cache (report_id, summary, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (report_id, summary, now, expires_at),
+                )
+        except Exception as e:
+            print(f"⚠️ Summary cache write failed: {type(e).__name__}: {str(e)}")
+    
+    def invalidate(self, report_id: str) -> None:
+        """Drop the cached summary for a report from both tiers."""
+        with self._lock:
+            self._remove(report_id)
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.execute("DELETE FROM summary_cache WHERE report_id = ?", (report_id,))
+                except Exception as e:
+                    print(f"⚠️ Summary cache invalidate failed: {type(e).__name__}: {str(e)}")
     
     def clear(self) -> None:
         """Clear all cached summaries."""
-        self.cache.clear()
-
-
-class RateLimiter:
-    """Token bucket rate limiter for API calls."""
-    
-    def __init__(self, max_calls: int = 10, window_seconds: int = 60):
-        self.max_calls = max_calls
-        self.window_seconds = window_seconds
-        self.calls: defaultdict = defaultdict(list)
+        with self._lock:
+            self.cache.clear()
+            self.bytes = 0
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM summary_cache")
     
-    def is_allowed(self, user_id: str) -> bool:
-        """Check if user is allowed to make API call."""
+    def sweep(self) -> int:
+        """Remove expired entries from both tiers. Returns the number of memory entries removed."""
         now = time.time()
-        user_calls = self.calls[user_id]
-        
-        # Remove calls outside the window
-        user_calls[:] = [call_time for call_time in user_calls if now - call_time < self.window_seconds]
-        
-        # Check if under limit
-        if len(user_calls) < self.max_calls:
-            user_calls.append(now)
-            return True
-        
-        return False
+        with self._lock:
+            expired = [key for key, entry in self.cache.items() if entry["expires_at"] <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.execute("DELETE FROM summary_cache WHERE expires_at <= ?", (now,))
+                except Exception as e:
+                    print(f"⚠️ Summary cache sweep failed: {type(e).__name__}: {str(e)}")
+        return len(expired)
     
-    def get_wait_time(self, user_id: str) -> int:
-        """Get seconds to wait before next allowed call."""
-        if not self.calls[user_id]:
-            return 0
-        
-        oldest_call = min(self.calls[user_id])
-        wait_time = self.window_seconds - (time.time() - oldest_call)
-        return max(0, int(wait_time))
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the background sweeper."""
+        self._stopped.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=timeout)
+            self._sweeper = None
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self.cache),
+                "memory_bytes": self.bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+    
+    def _start_sweeper(self) -> None:
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._stopped.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="summary-cache-sweeper", daemon=True)
+            self._sweeper.start()
+    
+    def _sweep_loop(self) -> None:
+        while not self._stopped.wait(self.sweep_seconds):
+            self.sweep()
+    
+    def _store(self, report_id: str, summary: str, expires_at: float) -> None:
+        """Insert into the LRU and evict from the cold end until both bounds hold. Caller holds the lock."""
+        self._remove(report_id)
+        size = len(summary.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        expires_at = min(expires_at, time.time() + self.memory_seconds)
+        self.cache[report_id] = {"summary": summary, "expires_at": expires_at, "size": size}
+        self.bytes += size
+        while len(self.cache) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self.cache))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def _remove(self, report_id: str) -> None:
+        entry = self.cache.pop(report_id, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
 
 
 class SummaryService:
@@ -91,31 +231,41 @@ class SummaryService:
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
         self.model = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+        self.llm = get_llm_client()
+        self.quota = get_token_quota()
+        self.context_tokens = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "500"))
         self.cache = SummaryCache(ttl_hours=24)  # Cache for 24 hours
-        self.rate_limiter = RateLimiter(max_calls=10, window_seconds=60)  # 10 calls per minute
+        self.rate_limiter = RateLimiter("summary", max_calls=10, window_seconds=60)  # 10 calls per minute
+        self._generations = SingleFlight("summary_generation")
     
     def _can_call_api(self) -> bool:
         """Check if API key is available."""
         return bool(self.api_key)
     
-    def _build_summary_prompt(self, extracted_text: str, parsed_values: List[Dict[str, Any]]) -> str:
+    def _build_summary_prompt(
+        self, extracted_text: str, parsed_values: List[Dict[str, Any]], budget: PromptBudget
+    ) -> str:
         """Build prompt for generating report summary."""
         
+        # Out-of-range results steer which values and report excerpts make it into the prompt
+        flagged = " ".join(item.get("test_name", "") for item in parsed_values if is_out_of_range(item))
+        key_values = select_values(flagged, parsed_values, limit=15)
+
         # Format parsed values
         formatted_values = "\n".join(
             f"  • {item.get('test_name', 'Unknown')}: "
             f"{item.get('value', 'N/A')} {item.get('unit', '')} "
             f"(Range: {item.get('reference_range', 'N/A')}) - {item.get('classification', '')}"
-            for item in parsed_values[:15]
+            for item in key_values
         )
         
-        return f"""Analyze this medical report and provide a concise, easy-to-understand summary.
+        template = """Analyze this medical report and provide a concise, easy-to-understand summary.
 
 === REPORT DATA ===
-{extracted_text[:2000]}
+{report_excerpt}
 
 === PARSED TEST RESULTS ===
-{formatted_values if formatted_values else "(No parsed values)"}
+{formatted_values}
 
 === INSTRUCTIONS ===
 Generate a brief summary (3-5 sentences) that:
@@ -126,6 +276,15 @@ Generate a brief summary (3-5 sentences) that:
 5. Encourages consultation with healthcare provider
 
 Keep it friendly, informative, and reassuring."""
+        formatted_values = formatted_values if formatted_values else "(No parsed values)"
+        budget.reserve("prompt", template.format(report_excerpt="", formatted_values=formatted_values))
+
+        # Report excerpts get whatever the budget has left, up to SUMMARY_CONTEXT_TOKENS
+        report_tokens = budget.allocate({"report": 1.0}, caps={"report": self.context_tokens})["report"]
+        report_excerpt = "\n".join(report_indexes.get(extracted_text).select_chunks(flagged, report_tokens))
+        budget.reserve("report", report_excerpt)
+
+        return template.format(report_excerpt=report_excerpt, formatted_values=formatted_values)
     
     async def generate_summary(
         self,
@@ -133,7 +292,8 @@ Keep it friendly, informative, and reassuring."""
         user_id: str,
         extracted_text: str,
         parsed_values: List[Dict[str, Any]],
-        force_regenerate: bool = False
+        force_regenerate: bool = False,
+        priority: str = "summary"
     ) -> Dict[str, Any]:
         """
         Generate summary for a medical report with caching and rate limiting.
@@ -144,6 +304,7 @@ Keep it friendly, informative, and reassuring."""
             extracted_text: Raw text extracted from report
             parsed_values: Parsed medical values
             force_regenerate: If True, bypass cache and regenerate
+            priority: LLM scheduler class ("summary" on demand, "backfill" for prefetch)
         
         Returns:
             Dict with summary, cached status, and metadata
@@ -160,9 +321,25 @@ Keep it friendly, informative, and reassuring."""
                     "source": "cache"
                 }
         
+        # Concurrent requests for the same report share one generation (and one rate-limit
+        # slot); a request joining an in-flight generation waits at the leader's priority.
+        return await self._generations.do_async(
+            report_id, self._generate_summary, report_id, user_id, extracted_text, parsed_values, priority
+        )
+    
+    async def _generate_summary(
+        self,
+        report_id: str,
+        user_id: str,
+        extracted_text: str,
+        parsed_values: List[Dict[str, Any]],
+        priority: str = "summary",
+    ) -> Dict[str, Any]:
+        """Rate-limit check and API call behind generate_summary's cache."""
+        
         # Check rate limit
-        if not self.rate_limiter.is_allowed(user_id):
-            wait_time = self.rate_limiter.get_wait_time(user_id)
+        if not await self.rate_limiter.is_allowed_async(user_id):
+            wait_time = await self.rate_limiter.get_wait_time_async(user_id)
             return {
                 "summary": None,
                 "error": f"Rate limit exceeded. Please wait {wait_time} seconds.",
@@ -180,14 +357,17 @@ Keep it friendly, informative, and reassuring."""
         
         # Generate new summary
         try:
-            summary_prompt = self._build_summary_prompt(extracted_text, parsed_values)
+            budget = PromptBudget("summary", self.model, answer_tokens=SUMMARY_ANSWER_TOKENS)
+            budget.reserve("system", SUMMARY_SYSTEM_PROMPT)
+            summary_prompt = self._build_summary_prompt(extracted_text, parsed_values, budget)
+            budget.record()
             
             payload = {
                 "model": self.model,
                 "messages": [
                     {
                         "role": "system",
-                        "content": "You are a medical assistant that creates simple, friendly summaries of medical reports. Use clear language and avoid technical jargon."
+                        "content": SUMMARY_SYSTEM_PROMPT
                     },
                     {
                         "role": "user",
@@ -195,47 +375,58 @@ Keep it friendly, informative, and reassuring."""
                     }
                 ],
                 "temperature": 0.3,  # Lower temperature for more consistent summaries
-                "max_tokens": 300,  # Limit tokens for concise summaries
+                "max_tokens": budget.answer_tokens,  # Limit tokens for concise summaries
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    "https://api.groq.com/openai/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json=payload,
-                )
-                
-                if response.status_code != 200:
-                    return {
-                        "summary": None,
-                        "cached": False,
-                        "error": f"API error: {response.status_code}"
-                    }
-                
-                data = response.json()
-                summary = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                
-                if summary:
-                    # Cache the summary
-                    self.cache.set(report_id, summary)
-                    
-                    return {
-                        "summary": summary.strip(),
-                        "cached": False,
-                        "generated_at": datetime.now().isoformat(),
-                        "source": "api",
-                        "model": self.model,
-                        "tokens_used": data.get("usage", {}).get("total_tokens", 0)
-                    }
-                
+            # Check token budgets (a long report costs as much as many short chats)
+            exhausted = await self.quota.check_async(user_id, estimate_tokens(payload))
+            if exhausted is not None:
                 return {
                     "summary": None,
+                    "error": f"Token budget exceeded. Please wait {exhausted['wait_time']} seconds.",
                     "cached": False,
-                    "error": "Empty response from API"
+                    "wait_time": exhausted["wait_time"]
                 }
+            
+            try:
+                data = await self.llm.chat_completion(payload, timeout=30.0, priority=priority)
+            except QueueDeadlineExceeded:
+                # Interactive traffic has every LLM slot; ask the client to come back shortly.
+                return {
+                    "summary": None,
+                    "error": "Summary service is busy. Please try again shortly.",
+                    "cached": False,
+                    "wait_time": QUEUE_RETRY_SECONDS
+                }
+            except httpx.HTTPStatusError as e:
+                return {
+                    "summary": None,
+                    "cached": False,
+                    "error": f"API error: {e.response.status_code}"
+                }
+
+            tokens_used = usage_tokens(data)
+            await self.quota.record_async(user_id, tokens_used, "summary")
+            summary = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            
+            if summary:
+                # Cache the summary
+                self.cache.set(report_id, summary)
+                
+                return {
+                    "summary": summary.strip(),
+                    "cached": False,
+                    "generated_at": datetime.now().isoformat(),
+                    "source": "api",
+                    "model": self.model,
+                    "tokens_used": tokens_used
+                }
+            
+            return {
+                "summary": None,
+                "cached": False,
+                "error": "Empty response from API"
+            }
                 
         except Exception as e:
             return {
@@ -0,0 +1,371 @@
+"""
+Daily Task Generator
+Personalised daily health tasks. Profiles the local task rules understand get
+rule-based tasks with no Groq call; for the rest the rule-based tasks are
+returned at once while Groq generates tasks in the background (on the shared
+async LLM client, in JSON mode, validated against the task schema). Groq
+results are cached per (health-profile fingerprint, date), so later calls for
+the same profile that day get them instantly.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from pydantic import ValidationError
+
+from models.schemas import GeneratedTaskResponse, UserHealthData
+from services.llm_client import get_llm_client
+from services.task_rules import TaskRulesEngine
+from services.task_store import day_start, utc_today
+from services.token_quota import estimate_tokens, get_token_quota, usage_tokens
+from utils.metrics import metrics
+from utils.query_cache import QueryCache
+from utils.single_flight import SingleFlight
+from utils.sqlite import connect, data_path
+from utils.token_budget import PromptBudget, truncate_to_tokens
+
+TASKS_ANSWER_TOKENS = 512  # three tasks in JSON need ~250 tokens
+TASKS_PER_DAY = 3
+# Bump when the prompt changes so cached task lists from the old prompt are not reused
+TASKS_PROMPT_VERSION = "1"
+
+TASKS_SYSTEM_PROMPT = (
+    "You are a health assistant that plans simple, safe daily health tasks. "
+    "Always answer with a single JSON object."
+)
+
+TASKS_INSTRUCTIONS = """
+
+Based on this health profile, generate exactly 3 personalized daily health tasks for today.
+
+Return a JSON object in this format:
+{
+  "tasks": [
+    {
+      "title": "Task title",
+      "description": "Brief description",
+      "priority": "high|medium|low",
+      "category": "medication|exercise|appointment|health-check|nutrition|general"
+    }
+  ]
+}
+
+Make sure tasks are:
+1. Personalized to the user's health conditions
+2. Realistic and achievable in one day
+3. Focused on medication compliance, exercise, nutrition, and health monitoring
+4. Clear and actionable
+5. Include at least one medication reminder if medications are listed
+
+Generate exactly 3 tasks. No more, no less."""
+
+# Fields of a generated task that depend on the profile only (not on who asked)
+TASK_FIELDS = ("title", "description", "priority", "category")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, list):
+        return sorted({_normalize(item) for item in value if str(item).strip()})
+    return value
+
+
+def profile_fingerprint(health: UserHealthData) -> str:
+    """Stable hash of a health profile; case, whitespace and list order do not matter."""
+    fields = {name: _normalize(value) for name, value in health.model_dump().items() if value not in (None, "", [])}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def build_profile_text(health: UserHealthData) -> str:
+    profile_text = "User Health Profile:\n"
+    if health.firstName:
+        profile_text += f"- Name: {health.firstName}\n"
+    if health.age:
+        profile_text += f"- Age: {health.age}\n"
+    if health.weight:
+        profile_text += f"- Weight: {health.weight} kg\n"
+    if health.bloodPressure:
+        profile_text += f"- Blood Pressure: {health.bloodPressure}\n"
+    if health.bloodSugar:
+        profile_text += f"- Blood Sugar: {health.bloodSugar} mg/dL\n"
+    if health.activityLevel:
+        profile_text += f"- Activity Level: {health.activityLevel}\n"
+    if health.conditions:
+        profile_text += f"- Health Conditions: {', '.join(health.conditions)}\n"
+    if health.medications:
+        profile_text += f"- Current Medications: {', '.join(health.medications)}\n"
+    if health.allergies:
+        profile_text += f"- Allergies: {', '.join(health.allergies)}\n"
+    return profile_text
+
+
+def parse_tasks(content: str, clerk_id: str) -> List[Dict[str, Any]]:
+    """Validate the model's JSON answer. Returns up to TASKS_PER_DAY valid tasks (profile fields only).
+
+    Tasks that do not fit the schema are dropped; an answer that is not a JSON
+    object with a "tasks" list yields no tasks.
+    """
+    try:
+        parsed = json.loads(content)
+    except (TypeError, ValueError):
+        metrics.increment("task_generation_invalid")
+        return []
+    items = parsed.get("tasks") if isinstance(parsed, dict) else None
+    if not isinstance(items, list):
+        metrics.increment("task_generation_invalid")
+        return []
+
+    tasks: List[Dict[str, Any]] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        fields = {name: item.get(name) for name in TASK_FIELDS}
+        for name in ("priority", "category"):
+            if isinstance(fields[name], str):
+                fields[name] = fields[name].strip().lower()
+        try:
+            task = GeneratedTaskResponse(**fields, clerkId=clerk_id)
+        except ValidationError:
+            metrics.increment("task_generation_invalid_task")
+            continue
+        tasks.append(task.model_dump(include=set(TASK_FIELDS)))
+    return tasks[:TASKS_PER_DAY]
+
+
+def _seconds_until_tomorrow() -> float:
+    now = datetime.utcnow()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return max(60.0, (midnight - now).total_seconds())
+
+
+class TaskCache:
+    """Generated task lists by (profile fingerprint, date).
+
+    A bounded in-memory LRU sits in front of a SQLite tier shared by every
+    worker on the node. Entries expire at UTC midnight, when their date key
+    stops being asked for anyway.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS task_cache (
+            key TEXT PRIMARY KEY,
+            tasks TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_task_cache_expiry ON task_cache (expires_at);
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, path: Optional[str] = None) -> None:
+        self.memory = QueryCache(max_entries=max_entries or int(os.getenv("TASK_CACHE_SIZE", "2000")))
+        self.path = path or os.getenv("TASK_CACHE_PATH") or data_path("task_cache.db")
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        try:
+            self._conn = connect(self.path)
+            self._conn.executescript(self.SCHEMA)
+        except Exception as e:
+            print(f"⚠️ Task cache persistent tier unavailable: {type(e).__name__}: {str(e)}")
+            self._conn = None
+
+        metrics.register_gauge("task_cache", self.stats)
+
+    @staticmethod
+    def make_key(fingerprint: str, day: date, model: str) -> str:
+        raw = json.dumps([fingerprint, day.isoformat(), model, TASKS_PROMPT_VERSION])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self.memory.lookup(key)
+        if entry is not None and QueryCache.is_fresh(entry):
+            self.hits += 1
+            return [dict(task) for task in entry["value"]]
+
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT tasks, expires_at FROM task_cache WHERE key = ? AND expires_at > ?",
+                        (key, time.time()),
+                    ).fetchone()
+            except Exception as e:
+                print(f"⚠️ Task cache read failed: {type(e).__name__}: {str(e)}")
+                row = None
+            if row is not None:
+                tasks = json.loads(row["tasks"])
+                self.memory.store(key, tasks, ttl_seconds=row["expires_at"] - time.time())
+                self.hits += 1
+                return [dict(task) for task in tasks]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, tasks: List[Dict[str, Any]]) -> None:
+        ttl_seconds = _seconds_until_tomorrow()
+        self.memory.store(key, tasks, ttl_seconds=ttl_seconds)
+        if self._conn is None:
+            return
+
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO task_cache (key, tasks, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(tasks), now + ttl_seconds),
+                )
+                self._writes += 1
+                if self._writes % 500 == 0:
+                    self._conn.execute("DELETE FROM task_cache WHERE expires_at <= ?", (now,))
+        except Exception as e:
+            print(f"⚠️ Task cache write failed: {type(e).__name__}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "memory_entries": self.memory.stats()["entries"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TaskGenerator:
+    """Generates today's tasks for a health profile, calling Groq at most once per profile per day.
+
+    Rule coverage below TASK_RULES_MIN_COVERAGE marks a profile as novel; only
+    those are sent to Groq, in the scheduler's "backfill" class.
+    """
+
+    def __init__(self) -> None:
+        self.api_key = os.getenv("GROQ_API_KEY")
+        self.model = os.getenv("GROQ_TASKS_MODEL") or os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+        self.llm = get_llm_client()
+        self.quota = get_token_quota()
+        self.cache = TaskCache()
+        self.rules = TaskRulesEngine()
+        self.min_coverage = float(os.getenv("TASK_RULES_MIN_COVERAGE", "0.7"))
+        self._generations = SingleFlight("task_generation")
+        self._backfills: Set[asyncio.Task] = set()
+
+    def _build_payload(self, health: UserHealthData) -> Dict[str, Any]:
+        # Long condition/medication lists are trimmed to the prompt budget
+        budget = PromptBudget("tasks", self.model, answer_tokens=TASKS_ANSWER_TOKENS)
+        budget.reserve("system", TASKS_SYSTEM_PROMPT)
+        budget.reserve("prompt", TASKS_INSTRUCTIONS)
+        profile_text = truncate_to_tokens(build_profile_text(health), budget.remaining)
+        budget.reserve("profile", profile_text)
+        budget.record()
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": TASKS_SYSTEM_PROMPT},
+                {"role": "user", "content": f"{profile_text}{TASKS_INSTRUCTIONS}"},
+            ],
+            "temperature": 0.4,
+            "max_tokens": budget.answer_tokens,
+            "response_format": {"type": "json_object"},
+        }
+
+    async def generate(
+        self,
+        health: UserHealthData,
+        clerk_id: Optional[str] = None,
+        day: Optional[date] = None,
+        wait: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Tasks for a profile on day (default today), each with title,
+        description, priority, category, dueDate and generatedByGroq.
+
+        By default never waits on Groq: a profile the rules do not cover gets
+        its cached Groq tasks if an earlier call generated them, else the
+        rule-based tasks while Groq generation starts in the background. With
+        wait=True (batch jobs) the Groq tasks are awaited instead, falling back
+        to the rule-based tasks if generation fails.
+        """
+        day = day or utc_today()
+        # Same UTC "Z" form as the day ranges the task queries filter on
+        due_date = day_start(day)
+        plan = self.rules.evaluate(health, limit=TASKS_PER_DAY)
+        if plan.coverage >= self.min_coverage:
+            metrics.increment("task_generation_rules")
+            print(f"✓ Rule-based tasks for {clerk_id} (coverage {plan.coverage:.0%}: {', '.join(plan.matched)})")
+            return [{**task, "dueDate": due_date, "generatedByGroq": False} for task in plan.tasks]
+
+        key = TaskCache.make_key(profile_fingerprint(health), day, self.model)
+        tasks = self.cache.get(key)
+        if tasks is None and wait and self.api_key:
+            tasks = await self._generations.do_async(key, self._generate, key, health, clerk_id, "backfill") or None
+        if tasks is not None:
+            print(f"✓ Groq tasks for {clerk_id}")
+            return [{**task, "dueDate": due_date, "generatedByGroq": True} for task in tasks]
+
+        print(f"ℹ️ Rules cover {plan.coverage:.0%} of the profile for {clerk_id} (not covered: {', '.join(plan.unmatched)})")
+        if not wait:
+            self._fill_in_background(key, health, clerk_id)
+        metrics.increment("task_generation_rules_fallback")
+        return [{**task, "dueDate": due_date, "generatedByGroq": False} for task in plan.tasks]
+
+    def _fill_in_background(self, key: str, health: UserHealthData, clerk_id: Optional[str]) -> None:
+        """Start Groq generation for key (joining one already running); the result lands in the cache."""
+        if not self.api_key:
+            return
+        task = asyncio.create_task(self._generations.do_async(key, self._generate, key, health, clerk_id, "backfill"))
+        self._backfills.add(task)
+        task.add_done_callback(self._backfills.discard)
+
+    async def _generate(
+        self, key: str, health: UserHealthData, clerk_id: Optional[str], priority: str = "tasks"
+    ) -> List[Dict[str, Any]]:
+        if not self.api_key:
+            print("⚠️ GROQ_API_KEY not set, skipping Groq task generation")
+            return []
+
+        payload = self._build_payload(health)
+        exhausted = await self.quota.check_async(clerk_id, estimate_tokens(payload))
+        if exhausted is not None:
+            print(f"⚠️ Token budget {exhausted['budget']} exhausted, skipping Groq task generation")
+            return []
+
+        print(f"🤖 Generating tasks with {self.model}")
+        try:
+            data = await self.llm.chat_completion(payload, timeout=20.0, priority=priority)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.increment("task_generation_failed")
+            print(f"❌ Error generating tasks with Groq: {type(e).__name__}: {str(e)}")
+            return []
+
+        await self.quota.record_async(clerk_id, usage_tokens(data), "tasks")
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        tasks = parse_tasks(content, clerk_id or "")
+        if not tasks:
+            print("⚠️ Groq answer had no valid tasks")
+            return []
+
+        for idx, task in enumerate(tasks):
+            print(f"  📌 Task {idx+1}: {task['title']} (priority: {task['priority']}, category: {task['category']})")
+        self.cache.set(key, tasks)
+        return tasks
+
+
+_task_generator: Optional[TaskGenerator] = None
+
+
+def get_task_generator() -> TaskGenerator:
+    """Process-wide task generator shared by the tasks router and background jobs."""
+    global _task_generator
+    if _task_generator is None:
+        _task_generator = TaskGenerator()
+    return _task_generator
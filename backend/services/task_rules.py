@@ -0,0 +1,562 @@
+"""
+Daily Task Rules
+Deterministic, data-driven daily tasks from a health profile. Each rule pairs
+conditions on the profile (conditions, medications, allergies, vitals, activity
+level, age) with the task it produces, so common profiles get personalised
+tasks locally and only profiles the rules do not understand need the LLM.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from pydantic import ValidationError
+
+from models.schemas import GeneratedTaskResponse, UserHealthData
+
+# A rule's "when" holds predicates that must all match (an empty "when" always
+# matches):
+#   conditions:    one of the user's conditions mentions a listed term
+#   medications:   true if the user lists medications
+#   allergies:     true if the user lists allergies
+#   activity:      activity level is one of the listed levels
+#   bloodSugar:    {"gt"|"gte"|"lt"|"lte": mg/dL}
+#   bloodPressure: {"gte"|"lt": [systolic, diastolic]}, either number matching
+#   age:           {"gt"|"gte"|"lt"|"lte": years}
+# An optional "unless" lists further "when" objects; the rule is skipped if any
+# of them matches. Condition terms match whole words ("heart" does not match
+# "heartburn"); a trailing "*" matches any word ending ("diabet*"). A mention
+# negated by a preceding "no", "not", "low", ... ("low blood sugar", "non-diabetic")
+# does not count. Advice that could hurt when a reading is off (less salt,
+# less sugar) is keyed to the vitals themselves, not to condition wording.
+# Task titles and descriptions may use {medications} and {allergies} (the first
+# few names, then "and N more"); rendered text is cut to the task schema's limits.
+LOW_BLOOD_PRESSURE: List[Dict[str, Any]] = [
+    {"bloodPressure": {"lt": [90, 60]}},
+    {"conditions": ["hypotension", "hypotensive", "low blood pressure", "orthostatic*"]},
+]
+LOW_BLOOD_SUGAR: List[Dict[str, Any]] = [
+    {"bloodSugar": {"lt": 70}},
+    {"conditions": ["hypoglyc*", "low blood sugar", "low glucose", "hypo", "hypos"]},
+]
+# No walks or workouts while a reading or condition points to low blood pressure or sugar.
+NOT_LOW = LOW_BLOOD_PRESSURE + LOW_BLOOD_SUGAR
+
+DEFAULT_TASK_RULES: List[Dict[str, Any]] = [
+    {
+        "id": "medications",
+        "when": {"medications": True},
+        "task": {
+            "title": "Take your medications as prescribed",
+            "description": "Take {medications} at the usual time and note any missed doses",
+            "priority": "high",
+            "category": "medication",
+        },
+    },
+    {
+        "id": "blood-sugar-high",
+        "when": {"bloodSugar": {"gt": 180}},
+        "task": {
+            "title": "Recheck your blood sugar before dinner",
+            "description": "Your last reading was high; write down today's numbers to share with your doctor",
+            "priority": "high",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "blood-sugar-low",
+        "when": {"bloodSugar": {"lt": 70}},
+        "task": {
+            "title": "Keep a quick snack with you",
+            "description": "Your last reading was low; carry juice or fruit in case you feel shaky",
+            "priority": "high",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "hypoglycemia",
+        "when": {"conditions": LOW_BLOOD_SUGAR[1]["conditions"]},
+        "task": {
+            "title": "Keep a quick snack with you",
+            "description": "Carry juice or fruit in case you feel shaky, and eat regular meals",
+            "priority": "high",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "blood-pressure-high",
+        "when": {"bloodPressure": {"gte": [140, 90]}},
+        "task": {
+            "title": "Measure your blood pressure twice today",
+            "description": "Sit quietly for 5 minutes first and write down both readings",
+            "priority": "high",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "blood-pressure-low",
+        "when": {"bloodPressure": {"lt": [90, 60]}},
+        "task": {
+            "title": "Stand up slowly and stay hydrated",
+            "description": "Your last reading was low; rise slowly and drink water through the day",
+            "priority": "medium",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "hypotension",
+        "when": {"conditions": LOW_BLOOD_PRESSURE[1]["conditions"]},
+        "task": {
+            "title": "Stand up slowly and stay hydrated",
+            "description": "Rise slowly from sitting or lying down and drink water through the day",
+            "priority": "medium",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "diabetes-check",
+        "when": {"conditions": ["diabet*", "prediabet*", "high blood sugar", "hyperglyc*", "insulin resistance"]},
+        "task": {
+            "title": "Check your blood sugar",
+            "description": "Test before a meal and log the reading",
+            "priority": "high",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "blood-sugar-meal",
+        "when": {"bloodSugar": {"gte": 140}},
+        "unless": LOW_BLOOD_SUGAR,
+        "task": {
+            "title": "Plan a balanced, low-sugar meal",
+            "description": "Fill half your plate with vegetables and choose whole grains",
+            "priority": "medium",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "hypertension-check",
+        "when": {"conditions": ["hypertension", "hypertensive", "high blood pressure"]},
+        "task": {
+            "title": "Measure your blood pressure",
+            "description": "Take a reading at the same time as yesterday and log it",
+            "priority": "high",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "blood-pressure-salt",
+        "when": {"bloodPressure": {"gte": [130, 80]}},
+        "unless": LOW_BLOOD_PRESSURE,
+        "task": {
+            "title": "Cut back on salt today",
+            "description": "Skip salty snacks and check labels for sodium",
+            "priority": "medium",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "heart",
+        "when": {"conditions": ["heart", "cardiac", "coronary", "arrhythmia", "atrial fibrillation", "afib"]},
+        "unless": NOT_LOW,
+        "task": {
+            "title": "Take a gentle 15-minute walk",
+            "description": "Keep a pace where you can still talk comfortably",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "cholesterol",
+        "when": {"conditions": ["cholesterol", "hypercholesterol*", "hyperlipid*", "lipid*", "triglyceride*"]},
+        "task": {
+            "title": "Add fibre to one meal",
+            "description": "Oats, beans, fruit or vegetables all count",
+            "priority": "medium",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "respiratory",
+        "when": {"conditions": ["asthma*", "copd", "bronch*", "emphysema"]},
+        "task": {
+            "title": "Keep your inhaler with you",
+            "description": "Check it is within reach before you head out",
+            "priority": "high",
+            "category": "medication",
+        },
+    },
+    {
+        "id": "joints",
+        "when": {"conditions": ["arthritis", "osteoarthritis", "joint*", "back pain", "osteopor*"]},
+        "task": {
+            "title": "Do 10 minutes of gentle stretching",
+            "description": "Move slowly and stop if anything hurts",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "kidney",
+        "when": {"conditions": ["kidney", "renal", "ckd", "nephropathy"]},
+        "task": {
+            "title": "Keep track of how much you drink",
+            "description": "Follow the fluid amount your care team recommended",
+            "priority": "medium",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "thyroid",
+        "when": {"conditions": ["thyroid", "hypothyroid*", "hyperthyroid*", "hashimoto*", "graves"]},
+        "task": {
+            "title": "Note your energy level today",
+            "description": "A short note helps your doctor see how you are doing",
+            "priority": "low",
+            "category": "general",
+        },
+    },
+    {
+        "id": "weight",
+        "when": {"conditions": ["obes*", "overweight"]},
+        "unless": NOT_LOW,
+        "task": {
+            "title": "Take a 20-minute walk",
+            "description": "Split it into two 10-minute walks if that is easier",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "mood",
+        "when": {"conditions": ["depress*", "anxiety", "anxious", "stress", "insomnia"]},
+        "task": {
+            "title": "Take 10 minutes for slow breathing",
+            "description": "Breathe in for 4 counts and out for 6 in a quiet place",
+            "priority": "medium",
+            "category": "general",
+        },
+    },
+    {
+        "id": "allergies",
+        "when": {"allergies": True},
+        "task": {
+            "title": "Check food labels for your allergies",
+            "description": "Look for {allergies} in the ingredients before eating anything new",
+            "priority": "medium",
+            "category": "nutrition",
+        },
+    },
+    {
+        "id": "sedentary",
+        "when": {"activity": ["sedentary", "low", "inactive"]},
+        "task": {
+            "title": "Stand up and stretch every hour",
+            "description": "A minute of movement each hour adds up",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "moderate",
+        "when": {"activity": ["moderate", "medium", "light"]},
+        "unless": NOT_LOW,
+        "task": {
+            "title": "30-minute walk or exercise",
+            "description": "Keep up your usual activity for the day",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "active",
+        "when": {"activity": ["active", "high", "very active"]},
+        "unless": NOT_LOW,
+        "task": {
+            "title": "Stretch after your workout",
+            "description": "Five minutes of stretching helps recovery",
+            "priority": "low",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "older-adult",
+        "when": {"age": {"gte": 65}},
+        "task": {
+            "title": "Do a short balance exercise",
+            "description": "Stand on one foot for 10 seconds while holding a chair",
+            "priority": "low",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "water",
+        "when": {},
+        "task": {
+            "title": "Drink 8 glasses of water",
+            "description": "Stay hydrated throughout the day",
+            "priority": "medium",
+            "category": "health-check",
+        },
+    },
+    {
+        "id": "walk",
+        "when": {},
+        "unless": NOT_LOW,
+        "task": {
+            "title": "30-minute walk or exercise",
+            "description": "Light physical activity for the day",
+            "priority": "medium",
+            "category": "exercise",
+        },
+    },
+    {
+        "id": "sleep",
+        "when": {},
+        "task": {
+            "title": "Aim for 7-8 hours of sleep",
+            "description": "Put screens away 30 minutes before bed",
+            "priority": "low",
+            "category": "general",
+        },
+    },
+]
+
+PRIORITY_RANK = {"high": 3, "medium": 2, "low": 1}
+
+# Field limits of GeneratedTaskResponse, which the rendered tasks must pass
+MAX_TITLE_LENGTH = 120
+MAX_DESCRIPTION_LENGTH = 500
+LIST_NAMES = 3
+
+_BLOOD_PRESSURE = re.compile(r"(\d{2,3})\s*/\s*(\d{2,3})")
+
+# Words that, just before a term, turn a mention into its negation or opposite.
+NEGATIONS = frozenset({"no", "not", "non", "without", "denies", "denied", "never", "negative", "low"})
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+@lru_cache(maxsize=512)
+def _term_pattern(term: str) -> Pattern[str]:
+    stem = term.endswith("*")
+    words = [re.escape(word) for word in _normalize(term.rstrip("*")).split()]
+    body = r"[\s-]+".join(words)
+    return re.compile(r"(?<![a-z0-9])" + body + (r"[a-z0-9]*" if stem else r"(?![a-z0-9])"))
+
+
+def mentions(condition: str, term: str) -> bool:
+    """Whether a (normalised) condition mentions term as whole words, not negated.
+
+    "Heartburn" does not mention "heart"; "low blood sugar", "no diabetes" and
+    "non-diabetic" do not mention "blood sugar" or "diabet*".
+    """
+    for match in _term_pattern(term).finditer(condition):
+        before = re.findall(r"[a-z]+", condition[:match.start()])[-3:]
+        if NEGATIONS.intersection(before) or "ruled out" in condition[match.end():]:
+            continue
+        return True
+    return False
+
+
+def _name_list(names: List[str], limit: int = LIST_NAMES) -> str:
+    """'a, b, c and 4 more' for a template placeholder."""
+    shown = ", ".join(names[:limit])
+    return f"{shown} and {len(names) - limit} more" if len(names) > limit else shown
+
+
+def _fit(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 3].rstrip(" ,") + "..."
+
+
+def _compare(value: Optional[float], spec: Dict[str, float]) -> bool:
+    if value is None:
+        return False
+    checks = {
+        "gt": lambda limit: value > limit,
+        "gte": lambda limit: value >= limit,
+        "lt": lambda limit: value < limit,
+        "lte": lambda limit: value <= limit,
+    }
+    return all(checks[op](limit) for op, limit in spec.items() if op in checks)
+
+
+def parse_blood_pressure(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """(systolic, diastolic) from a reading like "140/90", or None."""
+    match = _BLOOD_PRESSURE.search(value or "")
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+@dataclass
+class TaskPlan:
+    """Tasks chosen by the rules, and the share of the profile they understood (0-1)."""
+
+    tasks: List[Dict[str, Any]]
+    coverage: float
+    matched: List[str] = field(default_factory=list)
+    unmatched: List[str] = field(default_factory=list)
+
+
+class TaskRulesEngine:
+    """Evaluates task rules against a health profile.
+
+    Coverage is the share of the profile's signals (each condition, the
+    medication list, the allergy list, blood pressure, blood sugar and
+    activity level) that some rule knows how to read. A condition no rule
+    mentions, or an unreadable vital, lowers coverage; a normal vital that
+    needs no task does not.
+    """
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.rules = [rule for rule in (rules if rules is not None else load_task_rules()) if _valid_rule(rule)]
+        # Terms the rules read, including the ones that only rule a task out
+        self._keywords = sorted({
+            term
+            for rule in self.rules
+            for when in [rule["when"], *rule["unless"]]
+            for term in when.get("conditions", [])
+        })
+        self._activities = {
+            _normalize(level) for rule in self.rules for level in rule["when"].get("activity", [])
+        }
+        self._fields = {name for rule in self.rules for when in [rule["when"], *rule["unless"]] for name in when}
+
+    def _matches(self, when: Dict[str, Any], profile: Dict[str, Any]) -> bool:
+        for name, spec in when.items():
+            if name == "conditions":
+                if not any(mentions(condition, term) for condition in profile["conditions"] for term in spec):
+                    return False
+            elif name in ("medications", "allergies"):
+                if bool(profile[name]) != bool(spec):
+                    return False
+            elif name == "activity":
+                if profile["activity"] not in {_normalize(level) for level in spec}:
+                    return False
+            elif name == "bloodPressure":
+                reading = profile["bloodPressure"]
+                if reading is None:
+                    return False
+                if "gte" in spec and not (reading[0] >= spec["gte"][0] or reading[1] >= spec["gte"][1]):
+                    return False
+                if "lt" in spec and not (reading[0] < spec["lt"][0] or reading[1] < spec["lt"][1]):
+                    return False
+            elif name in ("bloodSugar", "age"):
+                if not _compare(profile[name], spec):
+                    return False
+            else:
+                return False
+        return True
+
+    def _signals(self, profile: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+        """(understood, not understood) signals of a profile."""
+        understood: List[str] = []
+        missed: List[str] = []
+        for condition in profile["conditions"]:
+            known = any(mentions(condition, term) for term in self._keywords)
+            (understood if known else missed).append(condition)
+        for name in ("medications", "allergies"):
+            if profile[name]:
+                (understood if name in self._fields else missed).append(name)
+        if profile["rawBloodPressure"]:
+            readable = profile["bloodPressure"] is not None and "bloodPressure" in self._fields
+            (understood if readable else missed).append("bloodPressure")
+        if profile["bloodSugar"] is not None:
+            (understood if "bloodSugar" in self._fields else missed).append("bloodSugar")
+        if profile["activity"]:
+            (understood if profile["activity"] in self._activities else missed).append(profile["activity"])
+        return understood, missed
+
+    def evaluate(self, health: UserHealthData, limit: int = 3) -> TaskPlan:
+        profile = {
+            "conditions": [_normalize(c) for c in health.conditions or [] if c.strip()],
+            "medications": [m.strip() for m in health.medications or [] if m.strip()],
+            "allergies": [a.strip() for a in health.allergies or [] if a.strip()],
+            "activity": _normalize(health.activityLevel or ""),
+            "rawBloodPressure": (health.bloodPressure or "").strip(),
+            "bloodPressure": parse_blood_pressure(health.bloodPressure),
+            "bloodSugar": health.bloodSugar,
+            "age": health.age,
+        }
+        values = defaultdict(str, {
+            "medications": _name_list(profile["medications"]),
+            "allergies": _name_list(profile["allergies"]),
+        })
+
+        # Higher priority first, then more specific rules, then table order
+        matched = [
+            rule
+            for rule in self.rules
+            if self._matches(rule["when"], profile)
+            and not any(self._matches(when, profile) for when in rule["unless"])
+        ]
+        matched.sort(key=lambda rule: (-PRIORITY_RANK[rule["task"]["priority"]], -len(rule["when"])))
+
+        # One task per category first, then fill up with whatever is left
+        chosen: List[Dict[str, Any]] = []
+        for distinct_categories in (True, False):
+            for rule in matched:
+                if len(chosen) >= limit:
+                    break
+                if rule in chosen:
+                    continue
+                if distinct_categories and any(c["task"]["category"] == rule["task"]["category"] for c in chosen):
+                    continue
+                if any(_normalize(c["task"]["title"]) == _normalize(rule["task"]["title"]) for c in chosen):
+                    continue
+                chosen.append(rule)
+
+        understood, missed = self._signals(profile)
+        total = len(understood) + len(missed)
+        return TaskPlan(
+            tasks=[
+                {
+                    **rule["task"],
+                    "title": _fit(rule["task"]["title"].format_map(values), MAX_TITLE_LENGTH),
+                    "description": _fit((rule["task"].get("description") or "").format_map(values), MAX_DESCRIPTION_LENGTH)
+                    or None,
+                }
+                for rule in chosen
+            ],
+            coverage=round(len(understood) / total, 4) if total else 1.0,
+            matched=[rule["id"] for rule in chosen],
+            unmatched=missed,
+        )
+
+
+def _valid_rule(rule: Dict[str, Any]) -> bool:
+    try:
+        GeneratedTaskResponse(**rule["task"], clerkId="")
+        if not isinstance(rule.get("when", {}), dict):
+            raise ValueError("when must be an object")
+        unless = rule.get("unless", [])
+        if not isinstance(unless, list) or not all(isinstance(when, dict) and when for when in unless):
+            raise ValueError("unless must be a list of non-empty objects")
+        rule.setdefault("when", {})
+        rule.setdefault("unless", [])
+        rule.setdefault("id", rule["task"]["title"])
+        return True
+    except (KeyError, TypeError, ValueError, ValidationError) as e:
+        print(f"⚠️ Skipping invalid task rule {rule.get('id', '?') if isinstance(rule, dict) else rule}: {str(e)}")
+        return False
+
+
+def load_task_rules() -> List[Dict[str, Any]]:
+    """Rules from the JSON file at TASK_RULES_PATH if set, else the built-in table."""
+    path = os.getenv("TASK_RULES_PATH")
+    if not path:
+        return [dict(rule) for rule in DEFAULT_TASK_RULES]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        print(f"✓ Loaded {len(rules)} task rules from {path}")
+        return rules
+    except Exception as e:
+        print(f"⚠️ Could not load task rules from {path}, using built-in rules: {type(e).__name__}: {str(e)}")
+        return [dict(rule) for rule in DEFAULT_TASK_RULES]
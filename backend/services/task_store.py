@@ -0,0 +1,284 @@
+"""
+Daily Task Store
+Async access to dailyTask documents in Sanity over one pooled HTTP client.
+Today's tasks are cached per (user, day) and every write through the store
+invalidates that user's entries; the Sanity listener does the same for writes
+made elsewhere. Writes go out as a single Sanity transaction per call, and
+generated tasks get deterministic ids per (user, date), so replayed batch
+writes are idempotent.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from utils.metrics import metrics
+from utils.query_cache import QueryCache
+from utils.single_flight import SingleFlight
+
+TASK_FIELDS = (
+    "_id, title, description, priority, category, isCompleted, dueDate, completedAt, "
+    "generatedByGroq, createdAt, updatedAt"
+)
+
+TODAY_QUERY = f"""*[_type == "dailyTask" && clerkId == $clerkId &&
+    (dueDate == null || (dueDate >= $start && dueDate < $end)) &&
+    isCompleted == false] | order(priority desc, dueDate asc){{{TASK_FIELDS}}}"""
+
+# Fields a client may change on an existing task
+EDITABLE_FIELDS = ("title", "description", "priority", "category", "dueDate")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def utc_today() -> date:
+    """The current day in UTC, the calendar dueDate timestamps and day ranges use."""
+    return datetime.utcnow().date()
+
+
+def day_start(day: date) -> str:
+    """Start of a day in the timestamp format dailyTask dueDate filters use."""
+    return f"{day.isoformat()}T00:00:00Z"
+
+
+def day_range(day: date) -> Dict[str, str]:
+    return {"start": day_start(day), "end": day_start(day + timedelta(days=1))}
+
+
+def _owned_task(task_id: str, clerk_id: str) -> str:
+    """GROQ selector for one of a user's tasks (literals are JSON-encoded, which is valid GROQ)."""
+    return f'*[_type == "dailyTask" && _id == {json.dumps(task_id)} && clerkId == {json.dumps(clerk_id)}]'
+
+
+def daily_task_id(clerk_id: str, day: date, index: int) -> str:
+    """Deterministic document id of a user's index-th generated task for a day."""
+    digest = hashlib.sha1(clerk_id.encode("utf-8")).hexdigest()[:16]
+    return f"daily-task-{day.strftime('%Y%m%d')}-{digest}-{index}"
+
+
+class DailyTaskStore:
+    """dailyTask reads and writes against the Sanity HTTP API.
+
+    Cached lists of today's tasks live for TASKS_CACHE_SECONDS, or
+    TASKS_CACHE_PUSH_SECONDS while the Sanity listener is connected. Empty
+    lists are only cached under push invalidation, so tasks the app creates
+    directly in Sanity show up at once without the listener.
+    """
+
+    def __init__(self, max_connections: Optional[int] = None) -> None:
+        self.project_id = os.getenv("SANITY_PROJECT_ID", "q5maqr3y")
+        self.dataset = os.getenv("SANITY_DATASET", "production")
+        self.token = os.getenv("SANITY_API_TOKEN")
+        self.max_connections = max_connections or int(os.getenv("SANITY_MAX_CONNECTIONS", "20"))
+        self.ttl_seconds = float(os.getenv("TASKS_CACHE_SECONDS", "30"))
+        self.push_ttl_seconds = float(os.getenv("TASKS_CACHE_PUSH_SECONDS", "600"))
+        self.cache = QueryCache(max_entries=int(os.getenv("TASKS_CACHE_SIZE", "5000")))
+        self.push_invalidation = False
+        self._http: Optional[httpx.AsyncClient] = None
+        self._fetches = SingleFlight("task_fetch")
+        # Bumped on every invalidation; a fetch that overlapped one does not cache its result.
+        self._invalidations = 0
+
+        metrics.register_gauge("task_store_cache", self.cache.stats)
+
+    def is_available(self) -> bool:
+        return bool(self.project_id and self.dataset and self.token)
+
+    def _base_url(self) -> str:
+        return f"https://{self.project_id}.api.sanity.io/v2023-10-18/data"
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+        return self._http
+
+    async def query(self, query: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Run a GROQ query and return its result. Raises on HTTP errors."""
+        query_params = {"query": query}
+        for name, value in (params or {}).items():
+            query_params[f"${name}"] = json.dumps(value)
+        response = await self._client().get(f"{self._base_url()}/query/{self.dataset}", params=query_params)
+        response.raise_for_status()
+        return response.json().get("result")
+
+    async def mutate(self, mutations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Apply mutations as one transaction: all of them land or none do.
+
+        Returns Sanity's per-document results ({"id", "operation"}). Raises on
+        HTTP errors.
+        """
+        if not mutations:
+            return []
+        response = await self._client().post(
+            f"{self._base_url()}/mutate/{self.dataset}",
+            params={"returnIds": "true"},
+            json={"mutations": mutations},
+        )
+        response.raise_for_status()
+        return response.json().get("results") or []
+
+    def invalidate_user(self, clerk_id: str) -> None:
+        self._invalidations += 1
+        self.cache.invalidate_tags(f"user:{clerk_id}")
+
+    def set_push_invalidation(self, enabled: bool) -> None:
+        """Switch between short and listener-backed TTLs; entries that may have missed events are dropped."""
+        if self.push_invalidation and not enabled:
+            self._invalidations += 1
+            self.cache.clear()
+        self.push_invalidation = enabled
+
+    def apply_mutation(self, payload: Dict[str, Any]) -> None:
+        """Invalidate cached task lists touched by a Sanity mutation event."""
+        for doc in (payload.get("result"), payload.get("previous")):
+            if doc and doc.get("_type") == "dailyTask" and doc.get("clerkId"):
+                self.invalidate_user(doc["clerkId"])
+
+    async def today(self, clerk_id: str, day: Optional[date] = None) -> List[Dict[str, Any]]:
+        """A user's incomplete tasks due on day (default today) or undated, highest priority first."""
+        day = day or utc_today()
+        key = f"{clerk_id}|{day.isoformat()}"
+        entry = self.cache.lookup(key)
+        if entry is not None and QueryCache.is_fresh(entry):
+            return entry["value"]
+        # The home screen polls; concurrent polls for the same user share one query.
+        return await self._fetches.do_async(key, self._fetch_today, key, clerk_id, day)
+
+    async def _fetch_today(self, key: str, clerk_id: str, day: date) -> List[Dict[str, Any]]:
+        invalidations = self._invalidations
+        tasks = await self.query(TODAY_QUERY, {"clerkId": clerk_id, **day_range(day)}) or []
+        if invalidations != self._invalidations:
+            return tasks
+        if tasks or self.push_invalidation:
+            ttl = self.push_ttl_seconds if self.push_invalidation else self.ttl_seconds
+            self.cache.store(key, tasks, ttl, tags=[f"user:{clerk_id}"])
+        return tasks
+
+    async def create_tasks(self, clerk_id: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create tasks for a user in one transaction and return the new documents."""
+        now = _now()
+        docs = [
+            {
+                "_id": f"daily-task-{uuid.uuid4().hex}",
+                "_type": "dailyTask",
+                "clerkId": clerk_id,
+                "title": task["title"],
+                "description": task.get("description"),
+                "priority": task.get("priority") or "medium",
+                "category": task.get("category") or "general",
+                "isCompleted": False,
+                "dueDate": task.get("dueDate") or now,
+                "generatedByGroq": bool(task.get("generatedByGroq")),
+                "createdAt": now,
+                "updatedAt": now,
+            }
+            for task in tasks
+        ]
+        try:
+            await self.mutate([{"create": doc} for doc in docs])
+        finally:
+            self.invalidate_user(clerk_id)
+        return docs
+
+    async def update_tasks(self, clerk_id: str, updates: List[Dict[str, Any]]) -> List[str]:
+        """Apply field updates ({"id", ...fields}) to a user's tasks in one transaction.
+
+        Setting isCompleted also sets or clears completedAt. Ids that are not
+        the user's tasks are left alone. Returns the ids that were updated.
+        """
+        now = _now()
+        mutations = []
+        for update in updates:
+            fields = {name: update[name] for name in EDITABLE_FIELDS if name in update}
+            patch: Dict[str, Any] = {"query": _owned_task(update["id"], clerk_id), "set": {**fields, "updatedAt": now}}
+            if "isCompleted" in update:
+                patch["set"]["isCompleted"] = bool(update["isCompleted"])
+                if update["isCompleted"]:
+                    patch["set"]["completedAt"] = now
+                else:
+                    patch["unset"] = ["completedAt"]
+            mutations.append({"patch": patch})
+        try:
+            results = await self.mutate(mutations)
+        finally:
+            self.invalidate_user(clerk_id)
+        return [result["id"] for result in results if result.get("id")]
+
+    async def complete_task(self, clerk_id: str, task_id: str, completed: bool = True) -> bool:
+        """Mark one of a user's tasks done (or not). False if the user has no such task."""
+        return bool(await self.update_tasks(clerk_id, [{"id": task_id, "isCompleted": completed}]))
+
+    async def users_with_tasks(self, clerk_ids: List[str], day: date) -> List[str]:
+        """Which of clerk_ids already have dailyTask documents due on day."""
+        if not clerk_ids:
+            return []
+        result = await self.query(
+            '*[_type == "dailyTask" && clerkId in $ids && dueDate >= $start && dueDate < $end].clerkId',
+            {"ids": clerk_ids, **day_range(day)},
+        )
+        return sorted(set(result or []))
+
+    async def create_generated_tasks(self, tasks_by_user: Dict[str, List[Dict[str, Any]]], day: date) -> int:
+        """Create generated tasks for several users in one transaction. Returns the number of documents.
+
+        createIfNotExists with deterministic ids means re-running for the same
+        (user, day) never duplicates tasks or overwrites ones already completed.
+        """
+        now = _now()
+        mutations = [
+            {
+                "createIfNotExists": {
+                    "_id": daily_task_id(clerk_id, day, index),
+                    "_type": "dailyTask",
+                    "clerkId": clerk_id,
+                    "title": task["title"],
+                    "description": task.get("description"),
+                    "priority": task["priority"],
+                    "category": task["category"],
+                    "isCompleted": False,
+                    "dueDate": task.get("dueDate") or day_start(day),
+                    "generatedByGroq": bool(task.get("generatedByGroq")),
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+            }
+            for clerk_id, tasks in tasks_by_user.items()
+            for index, task in enumerate(tasks)
+        ]
+        try:
+            await self.mutate(mutations)
+        finally:
+            for clerk_id in tasks_by_user:
+                self.invalidate_user(clerk_id)
+        return len(mutations)
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+_task_store: Optional[DailyTaskStore] = None
+
+
+def get_task_store() -> DailyTaskStore:
+    """Process-wide task store sharing one connection pool."""
+    global _task_store
+    if _task_store is None:
+        _task_store = DailyTaskStore()
+    return _task_store
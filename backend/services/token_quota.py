@@ -0,0 +1,185 @@
+"""
+Token Quotas
+Per-user and global LLM token budgets per minute and per day, fed from the
+`usage` Groq returns with every completion. Counters live in a SQLite file
+shared by every worker on the node, so budgets hold across processes and stay
+under the provider's tokens-per-minute limit during peaks. Async callers use
+check_async/record_async, which run the SQLite work in a worker thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import metrics
+from utils.sqlite import connect, data_path
+from utils.token_budget import count_tokens
+
+GLOBAL_SCOPE = "*"
+
+# (window name, window length in seconds)
+WINDOWS: Tuple[Tuple[str, int], ...] = (("minute", 60), ("day", 86400))
+
+# A chat reserves its prompt (up to PROMPT_MAX_INPUT_TOKENS, 2000) plus a
+# 600-token answer, so a full-context chat is checked at about 2600 tokens.
+# 20000 per minute lets one user send a chat every ~8 seconds (or a chat and a
+# summary at once) while a scripted client still cannot take most of the
+# global budget.
+DEFAULT_USER_TOKENS_PER_MINUTE = 20000
+
+
+def usage_tokens(data: Optional[Dict[str, Any]]) -> int:
+    """Total tokens reported in a Groq chat completion response."""
+    return int(((data or {}).get("usage") or {}).get("total_tokens") or 0)
+
+
+def prompt_tokens(payload: Dict[str, Any]) -> int:
+    """Local estimate of a chat completion payload's prompt tokens."""
+    return sum(count_tokens(message.get("content") or "") for message in payload.get("messages", []))
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Upper estimate of a request's cost: prompt tokens plus the answer reservation."""
+    return prompt_tokens(payload) + int(payload.get("max_tokens") or 0)
+
+
+class TokenQuota:
+    """Fixed-window token counters per scope (a user, or global) and window (minute, day).
+
+    A limit of 0 disables that budget. check() is a pre-flight test against
+    what has already been spent; record() charges actual usage afterwards, so
+    a request admitted near the edge may overshoot a window slightly.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS token_usage (
+            scope TEXT NOT NULL,
+            period TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            tokens INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (scope, period, bucket)
+        );
+        CREATE INDEX IF NOT EXISTS idx_token_usage_expiry ON token_usage (expires_at);
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.enabled = os.getenv("TOKEN_QUOTA", "true").lower() != "false"
+        self.limits: Dict[Tuple[str, str], int] = {
+            ("user", "minute"): int(
+                os.getenv("TOKEN_QUOTA_USER_PER_MINUTE", str(DEFAULT_USER_TOKENS_PER_MINUTE))
+            ),
+            ("user", "day"): int(os.getenv("TOKEN_QUOTA_USER_PER_DAY", "100000")),
+            ("global", "minute"): int(os.getenv("TOKEN_QUOTA_GLOBAL_PER_MINUTE", "30000")),
+            ("global", "day"): int(os.getenv("TOKEN_QUOTA_GLOBAL_PER_DAY", "0")),
+        }
+        self.path = path or os.getenv("TOKEN_QUOTA_PATH") or data_path("token_usage.db")
+        self._lock = threading.Lock()
+        self._writes = 0
+        try:
+            self._conn = connect(self.path)
+            self._conn.executescript(self.SCHEMA)
+        except Exception as e:
+            print(f"⚠️ Shared token quota store unavailable, counting per worker: {type(e).__name__}: {str(e)}")
+            self._conn = connect(":memory:")
+            self._conn.executescript(self.SCHEMA)
+
+        metrics.register_gauge("token_quota", self.stats)
+
+    def _scopes(self, user_id: Optional[str]) -> List[Tuple[str, str]]:
+        scopes = [("global", GLOBAL_SCOPE)]
+        if user_id:
+            scopes.append(("user", user_id))
+        return scopes
+
+    def check(self, user_id: Optional[str], estimated_tokens: int = 0) -> Optional[Dict[str, Any]]:
+        """None if the request fits every budget, else {"budget": "user_minute", "wait_time": seconds}."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            for kind, scope in self._scopes(user_id):
+                for window, length in WINDOWS:
+                    limit = self.limits[(kind, window)]
+                    if limit <= 0:
+                        continue
+                    bucket = int(now // length)
+                    row = self._conn.execute(
+                        "SELECT tokens FROM token_usage WHERE scope = ? AND period = ? AND bucket = ?",
+                        (scope, window, bucket),
+                    ).fetchone()
+                    spent = row["tokens"] if row else 0
+                    if spent + estimated_tokens > limit:
+                        metrics.increment(f"token_quota_exhausted_{kind}_{window}")
+                        return {"budget": f"{kind}_{window}", "wait_time": int((bucket + 1) * length - now) + 1}
+        return None
+
+    def record(self, user_id: Optional[str], tokens: int, kind: str) -> None:
+        """Charge tokens spent on a request of the given kind (chat, summary, tasks)."""
+        if tokens <= 0:
+            return
+        metrics.increment(f"llm_tokens_{kind}", tokens)
+        if not self.enabled:
+            return
+        now = time.time()
+        rows = [
+            (scope, window, int(now // length), tokens, (int(now // length) + 1) * length)
+            for _, scope in self._scopes(user_id)
+            for window, length in WINDOWS
+        ]
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    """
+                    INSERT INTO token_usage (scope, period, bucket, tokens, expires_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (scope, period, bucket) DO UPDATE SET tokens = tokens + excluded.tokens
+                    """,
+                    rows,
+                )
+                self._writes += 1
+                if self._writes % 500 == 0:
+                    self._conn.execute("DELETE FROM token_usage WHERE expires_at <= ?", (now,))
+        except Exception as e:
+            print(f"⚠️ Token usage write failed: {type(e).__name__}: {str(e)}")
+
+    async def check_async(self, user_id: Optional[str], estimated_tokens: int = 0) -> Optional[Dict[str, Any]]:
+        """check() for coroutines: the SQLite reads run in a worker thread."""
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.check, user_id, estimated_tokens)
+
+    async def record_async(self, user_id: Optional[str], tokens: int, kind: str) -> None:
+        """record() for coroutines: the SQLite write (which may wait on another worker) runs in a worker thread."""
+        if tokens <= 0 or not self.enabled:
+            self.record(user_id, tokens, kind)
+            return
+        await asyncio.to_thread(self.record, user_id, tokens, kind)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            usage = {
+                window: self._conn.execute(
+                    "SELECT tokens FROM token_usage WHERE scope = ? AND period = ? AND bucket = ?",
+                    (GLOBAL_SCOPE, window, int(now // length)),
+                ).fetchone()
+                for window, length in WINDOWS
+            }
+        return {
+            "global_minute_tokens": usage["minute"]["tokens"] if usage["minute"] else 0,
+            "global_day_tokens": usage["day"]["tokens"] if usage["day"] else 0,
+        }
+
+
+_token_quota: Optional[TokenQuota] = None
+
+
+def get_token_quota() -> TokenQuota:
+    """Process-wide token quota shared by every LLM caller."""
+    global _token_quota
+    if _token_quota is None:
+        _token_quota = TokenQuota()
+    return _token_quota
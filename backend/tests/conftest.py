@@ -0,0 +1,15 @@
+"""
+Shared test setup: run against the backend package with throwaway data files.
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# utils.sqlite reads the data directory at import time, so set it before any service is imported.
+os.environ.setdefault("NUERACARE_DATA_DIR", tempfile.mkdtemp(prefix="nueracare-tests-"))
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+os.environ.setdefault("GROQ_API_KEY", "test-key")
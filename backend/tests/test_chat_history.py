@@ -0,0 +1,176 @@
+"""
+Incremental chat persistence, schema migrations and /chat-history paging.
+"""
+import json
+import sqlite3
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.storage_backends import SanityStorage, SQLiteStorage, conversation_id, message_key
+
+
+def message(role, text, timestamp):
+    return {"role": role, "text": text, "timestamp": timestamp}
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    return SQLiteStorage(str(tmp_path / "chat.db"))
+
+
+def texts(chat):
+    return [msg["text"] for msg in chat["messages"]]
+
+
+def test_resent_conversation_appends_only_new_messages(sqlite_storage):
+    first = [message("user", "Is my glucose fine?", "2026-01-01T10:00:00Z")]
+    sqlite_storage.append_chat_messages("r1", "u1", first)
+    second = first + [message("assistant", "It is in range.", "2026-01-01T10:00:05Z")]
+    sqlite_storage.append_chat_messages("r1", "u1", second)
+    sqlite_storage.append_chat_messages("r1", "u1", second)
+
+    chat = sqlite_storage.fetch_chat_history("r1", "u1")
+    assert texts(chat) == ["Is my glucose fine?", "It is in range."]
+    assert chat["totalMessages"] == 2
+
+
+def test_messages_sharing_the_last_timestamp_are_kept(sqlite_storage):
+    sqlite_storage.append_chat_messages("r1", "u1", [message("user", "Hello", "2026-01-01T10:00:00Z")])
+    sqlite_storage.append_chat_messages(
+        "r1",
+        "u1",
+        [
+            message("user", "Hello", "2026-01-01T10:00:00Z"),
+            message("assistant", "Hi there", "2026-01-01T10:00:00Z"),
+        ],
+    )
+    assert texts(sqlite_storage.fetch_chat_history("r1", "u1")) == ["Hello", "Hi there"]
+
+
+def test_history_pages_in_chronological_order(sqlite_storage):
+    messages = [message("user", f"m{i}", f"2026-01-01T10:00:{i:02d}Z") for i in range(5)]
+    sqlite_storage.append_chat_messages("r1", "u1", messages)
+
+    assert texts(sqlite_storage.fetch_chat_history("r1", "u1", offset=1, limit=2)) == ["m1", "m2"]
+    assert texts(sqlite_storage.fetch_chat_history("r1", "u1", offset=3)) == ["m3", "m4"]
+
+
+def test_migrates_single_document_chat_layout(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE chat_conversations (
+            _id TEXT PRIMARY KEY, reportId TEXT NOT NULL, userId TEXT NOT NULL,
+            messages TEXT NOT NULL, summary TEXT, createdAt TEXT, updatedAt TEXT
+        );
+        CREATE INDEX idx_chats_report_user ON chat_conversations (reportId, userId, updatedAt);
+        """
+    )
+    older = [message("user", "Hi", "2026-01-01T10:00:00Z")]
+    newer = older + [message("assistant", "Hello", "2026-01-01T10:00:01Z")]
+    conn.executemany(
+        "INSERT INTO chat_conversations VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("a", "r1", "u1", json.dumps(older), "", "2026-01-01T10:00:00Z", "2026-01-01T10:00:00Z"),
+            ("b", "r1", "u1", json.dumps(newer), "Greeting", "2026-01-01T10:00:01Z", "2026-01-01T10:00:01Z"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(path)
+    chat = storage.fetch_chat_history("r1", "u1")
+    assert texts(chat) == ["Hi", "Hello"]
+    assert chat["summary"] == "Greeting"
+
+    storage.append_chat_messages("r1", "u1", newer + [message("user", "Thanks", "2026-01-01T10:00:02Z")])
+    assert texts(storage.fetch_chat_history("r1", "u1")) == ["Hi", "Hello", "Thanks"]
+    assert SQLiteStorage(path).fetch_chat_history("r1", "u1")["totalMessages"] == 3
+
+
+def test_adds_message_keys_to_unkeyed_message_table(tmp_path):
+    path = str(tmp_path / "unkeyed.db")
+    doc_id = conversation_id("r1", "u1")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE chat_conversations (
+            _id TEXT PRIMARY KEY, reportId TEXT NOT NULL, userId TEXT NOT NULL,
+            summary TEXT, lastMessageAt TEXT, createdAt TEXT, updatedAt TEXT
+        );
+        CREATE TABLE chat_messages (
+            conversationId TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT, text TEXT, timestamp TEXT,
+            PRIMARY KEY (conversationId, seq)
+        );
+        """
+    )
+    conn.execute(
+        "INSERT INTO chat_conversations VALUES (?, 'r1', 'u1', NULL, '2026-01-01T10:00:00Z', NULL, NULL)", (doc_id,)
+    )
+    conn.execute("INSERT INTO chat_messages VALUES (?, 0, 'user', 'Hi', '2026-01-01T10:00:00Z')", (doc_id,))
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(path)
+    storage.append_chat_messages(
+        "r1",
+        "u1",
+        [message("user", "Hi", "2026-01-01T10:00:00Z"), message("assistant", "Hello", "2026-01-01T10:00:00Z")],
+    )
+    assert texts(storage.fetch_chat_history("r1", "u1")) == ["Hi", "Hello"]
+
+
+def test_sanity_append_is_idempotent_when_retried(monkeypatch):
+    monkeypatch.setenv("SANITY_PROJECT_ID", "test")
+    monkeypatch.setenv("SANITY_DATASET", "test")
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    monkeypatch.setenv("SANITY_OUTBOX", "false")
+    storage = SanityStorage()
+    sent = []
+
+    def sanity(request):
+        if request.method == "GET":
+            return httpx.Response(200, json={"result": None})
+        sent.append(json.loads(request.content)["mutations"])
+        return httpx.Response(200, json={"results": []})
+
+    storage._http = httpx.Client(transport=httpx.MockTransport(sanity))
+    messages = [
+        message("user", "Hello", "2026-01-01T10:00:00Z"),
+        message("assistant", "Hi there", "2026-01-01T10:00:00Z"),
+    ]
+    storage.append_chat_messages("r1", "u1", messages)
+
+    doc_id = conversation_id("r1", "u1")
+    keys = [message_key(doc_id, msg) for msg in messages]
+    unset, insert = sent[0][1]["patch"], sent[0][2]["patch"]
+    assert unset["unset"] == [f'messages[_key=="{key}"]' for key in keys]
+    assert [item["_key"] for item in insert["insert"]["items"]] == keys
+
+    # The pending appends are remembered, so a resend of the same messages is a no-op.
+    storage.append_chat_messages("r1", "u1", messages)
+    assert len(sent) == 1
+
+
+def test_chat_history_endpoint_returns_whole_conversation_without_paging(monkeypatch, sqlite_storage):
+    import routers.chat as chat_router
+
+    monkeypatch.setattr(chat_router.report_service, "backend", sqlite_storage)
+    messages = [message("user", f"m{i}", f"2026-01-01T10:{i // 60:02d}:{i % 60:02d}Z") for i in range(150)]
+    sqlite_storage.append_chat_messages("r1", "u1", messages)
+
+    app = FastAPI()
+    app.include_router(chat_router.router, prefix="/api")
+    client = TestClient(app)
+
+    body = client.get("/api/chat-history/r1/u1").json()
+    assert len(body["chat"]["messages"]) == 150
+    assert body["has_more"] is False
+
+    page = client.get("/api/chat-history/r1/u1", params={"offset": 100, "limit": 20}).json()
+    assert texts(page["chat"]) == [f"m{i}" for i in range(100, 120)]
+    assert page["has_more"] is True
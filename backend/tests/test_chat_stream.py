@@ -0,0 +1,143 @@
+"""
+/chat-with-report/stream: complete answers end with `done`, interrupted ones with `error`.
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routers.chat as chat_router
+
+REPORT_TEXT = "Hemoglobin 13.5 g/dL (13.0-17.0)"
+
+
+def sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def fake_stream(tokens, fail_after=None):
+    async def stream(payload, message, voice_mode):
+        for index, token in enumerate(tokens):
+            if index == fail_after:
+                raise ConnectionError("upstream closed the stream")
+            yield "test-model", token
+
+    return stream
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def prepare(payload):
+        return REPORT_TEXT, []
+
+    logged = []
+    monkeypatch.setattr(chat_router, "_prepare_chat", prepare)
+    monkeypatch.setattr(chat_router, "conversation_memory", None)
+    monkeypatch.setattr(chat_router, "log_response", logged.append)
+    service = chat_router.groq_service
+    monkeypatch.setattr(service, "api_key", "test-key")
+    monkeypatch.setattr(service, "response_cache", None)
+    monkeypatch.setattr(service, "semantic_cache", None)
+    monkeypatch.setattr(service.quota, "enabled", False)
+
+    app = FastAPI()
+    app.include_router(chat_router.router, prefix="/api")
+    test_client = TestClient(app)
+    test_client.logged = logged
+    return test_client
+
+
+def ask(client, message="What does my hemoglobin mean?"):
+    response = client.post(
+        "/api/chat-with-report/stream",
+        json={"report_id": "r1", "user_id": "u1", "message": message},
+    )
+    assert response.status_code == 200
+    return sse_events(response.text)
+
+
+def test_complete_stream_ends_with_done(client, monkeypatch):
+    tokens = ["Your hemoglobin ", "is within ", "the usual range.\n"]
+    monkeypatch.setattr(chat_router.groq_service.router, "stream", fake_stream(tokens))
+
+    events = ask(client)
+    assert [name for name, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    name, done = events[-1]
+    assert name == "done"
+    assert done["response"] == "".join(data["text"] for _, data in events[:-1])
+    assert done["used_model"] == "test-model"
+    assert len(client.logged) == 1
+
+
+def test_stream_failing_after_tokens_ends_with_error(client, monkeypatch):
+    tokens = ["Your hemoglobin ", "is within ", "the usual range.\n"]
+    monkeypatch.setattr(chat_router.groq_service.router, "stream", fake_stream(tokens, fail_after=2))
+
+    events = ask(client)
+    names = [name for name, _ in events]
+    assert "done" not in names
+    assert names[-1] == "error"
+    assert events[-1][1]["partial"] is True
+    assert client.logged == []
+
+
+def test_stream_failing_before_any_text_falls_back(client, monkeypatch):
+    monkeypatch.setattr(chat_router.groq_service.router, "stream", fake_stream(["unused"], fail_after=0))
+
+    events = ask(client)
+    assert events[-1][0] == "done"
+    assert events[-1][1]["response"]
+    assert events[-1][1]["used_model"] is None
+
+
+def collect(stream, stop_after=None):
+    async def run():
+        items = []
+        async for item in stream:
+            items.append(item)
+            if stop_after is not None and len(items) == stop_after:
+                # The client went away: the endpoint closes the generator mid-stream.
+                await stream.aclose()
+                break
+        return items
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def remembered(monkeypatch):
+    service = chat_router.groq_service
+    calls = []
+    monkeypatch.setattr(service, "api_key", "test-key")
+    monkeypatch.setattr(service.quota, "enabled", False)
+    monkeypatch.setattr(service, "_cached_answer", lambda *args: None)
+    monkeypatch.setattr(service, "_remember_answer", lambda *args: calls.append(args))
+    return calls
+
+
+def stream_answer(monkeypatch, tokens, fail_after=None):
+    service = chat_router.groq_service
+    monkeypatch.setattr(service.router, "stream", fake_stream(tokens, fail_after))
+    return service.stream_response("What is hemoglobin?", REPORT_TEXT, [], False, False)
+
+
+def test_only_completed_streams_are_cached(remembered, monkeypatch):
+    tokens = ["Hemoglobin carries ", "oxygen in your blood.\n"]
+    items = collect(stream_answer(monkeypatch, tokens))
+    assert items[-1].get("completed") is not False
+    assert len(remembered) == 1
+
+    items = collect(stream_answer(monkeypatch, tokens, fail_after=1))
+    assert items[-1]["completed"] is False
+    assert len(remembered) == 1
+
+
+def test_cancelled_stream_is_not_cached(remembered, monkeypatch):
+    collect(stream_answer(monkeypatch, ["Hemoglobin carries ", "oxygen in your blood.\n"]), stop_after=1)
+    assert remembered == []
@@ -0,0 +1,93 @@
+"""
+Conversation memory: recent turns verbatim, older turns folded into a bounded digest.
+"""
+import asyncio
+
+import pytest
+
+from services.conversation_memory import Conversation, ConversationMemory, compact_turn, is_follow_up
+from utils.token_budget import count_tokens
+
+
+def conversation(turns, recent_turns=2, summary_tokens=200):
+    memory = Conversation(recent_turns=recent_turns, summary_tokens=summary_tokens)
+    for question, answer in turns:
+        memory.add_turn(question, answer)
+    return memory
+
+
+TURNS = [
+    ("What is my LDL?", "Your LDL is 162 mg/dL. That is above the usual range."),
+    ("What is my HDL?", "Your HDL is 41 mg/dL. That is within range."),
+    ("What is my TSH?", "Your TSH is 6.8 uIU/mL. That is slightly high."),
+    ("Is my hemoglobin okay?", "Yes, 13.5 g/dL is normal."),
+]
+
+
+@pytest.mark.parametrize(
+    "question, follow_up",
+    [
+        ("Why is that high?", True),
+        ("And what about my HDL?", True),
+        ("Tell me more", True),
+        ("What is my LDL?", False),
+        ("Is my thyroid normal?", False),
+    ],
+)
+def test_follow_up_detection(question, follow_up):
+    assert is_follow_up(question) is follow_up
+
+
+def test_older_turns_become_digest_lines():
+    memory = conversation(TURNS)
+    assert memory.turns == TURNS[2:]
+    assert memory.summary_lines == [compact_turn(*TURNS[0]), compact_turn(*TURNS[1])]
+    assert memory.summary_lines[0] == "- Patient asked: What is my LDL? | Answer: Your LDL is 162 mg/dL."
+
+
+def test_digest_drops_oldest_lines_past_its_budget():
+    memory = conversation(TURNS * 5, recent_turns=1, summary_tokens=40)
+    assert count_tokens("\n".join(memory.summary_lines)) <= 40
+    assert memory.summary_lines[-1] == compact_turn(*TURNS[2])
+
+
+def test_context_fits_the_token_limit():
+    memory = conversation(TURNS)
+    roomy = memory.context(max_tokens=1000)
+    assert [message["content"] for message in roomy["messages"]] == [text for turn in TURNS[2:] for text in turn]
+    assert "What is my LDL?" in roomy["summary"]
+
+    tight = memory.context(max_tokens=60)
+    used = count_tokens(tight["summary"]) + sum(count_tokens(m["content"]) for m in tight["messages"])
+    assert used <= 60
+    assert len(tight["messages"]) < len(roomy["messages"])
+
+
+def test_memory_is_hydrated_from_saved_history_once():
+    saved = []
+    for question, answer in TURNS:
+        saved += [{"role": "user", "text": question}, {"role": "assistant", "text": answer}]
+    loads = []
+
+    def history_loader(report_id, user_id, offset, limit):
+        loads.append((report_id, user_id, offset, limit))
+        return {"totalMessages": len(saved), "messages": saved[offset : offset + limit]}
+
+    memory = ConversationMemory(history_loader=history_loader, recent_turns=2)
+    first = asyncio.run(memory.get("r1", "u1"))
+    assert first.turns == TURNS[2:]
+    assert len(first.summary_lines) == 2
+
+    calls = len(loads)
+    assert asyncio.run(memory.get("r1", "u1")) is first
+    assert len(loads) == calls
+
+    memory.forget("r1", "u1")
+    assert asyncio.run(memory.get("r1", "u1")) is not first
+
+
+def test_oldest_conversations_are_evicted():
+    memory = ConversationMemory(max_conversations=1, recent_turns=2)
+    asyncio.run(memory.get("r1", "u1"))
+    asyncio.run(memory.get("r2", "u1"))
+    assert memory.stats() == {"conversations": 1}
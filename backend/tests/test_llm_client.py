@@ -0,0 +1,97 @@
+"""
+Shared Groq client: one pool, a concurrency cap, and pacing from rate-limit headers.
+"""
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from services.llm_client import LLMClient, parse_reset_duration
+
+PAYLOAD = {"model": "test-model", "messages": [{"role": "user", "content": "Hi"}]}
+ANSWER = {"choices": [{"message": {"content": "Hello"}}], "usage": {"total_tokens": 5}}
+
+
+def client_for(handler, **kwargs):
+    client = LLMClient(api_key="test-key", **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("7.66s", 7.66), ("2m59.56s", 179.56), ("250ms", 0.25), ("1h", 3600.0), ("3", 3.0), (None, 0.0)],
+)
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == pytest.approx(seconds)
+
+
+def test_concurrent_calls_stay_under_the_cap():
+    peak = in_flight = 0
+
+    async def groq(request):
+        nonlocal peak, in_flight
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return httpx.Response(200, json=ANSWER)
+
+    client = client_for(groq, max_concurrency=2)
+
+    async def run():
+        return await asyncio.gather(*(client.chat_completion(PAYLOAD) for _ in range(6)))
+
+    assert all(result == ANSWER for result in asyncio.run(run()))
+    assert peak == 2
+
+
+def test_429_waits_for_retry_after_then_retries():
+    statuses = [429, 200]
+
+    def groq(request):
+        status = statuses.pop(0)
+        if status == 429:
+            return httpx.Response(429, headers={"retry-after": "0.1"})
+        return httpx.Response(200, json=ANSWER)
+
+    client = client_for(groq)
+    started = time.monotonic()
+    assert asyncio.run(client.chat_completion(PAYLOAD)) == ANSWER
+    assert time.monotonic() - started >= 0.1
+    assert statuses == []
+
+
+def test_exhausted_budget_fails_fast_instead_of_waiting_long():
+    requests = []
+
+    def groq(request):
+        requests.append(request)
+        headers = {"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m"}
+        return httpx.Response(200, json=ANSWER, headers=headers)
+
+    client = client_for(groq, max_rate_limit_wait_seconds=5)
+    asyncio.run(client.chat_completion(PAYLOAD))
+    assert client.rate_limit["remaining_tokens"] == "0"
+
+    with pytest.raises(RuntimeError, match="rate limit exhausted"):
+        asyncio.run(client.chat_completion(PAYLOAD))
+    assert len(requests) == 1
+
+
+def test_stream_yields_content_deltas():
+    chunks = [{"choices": [{"delta": {"content": text}}]} for text in ("Your ", "results ", "look fine.")]
+    body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+
+    def groq(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+    client = client_for(groq)
+
+    async def collect():
+        return [delta async for delta in client.stream_chat_completion(PAYLOAD)]
+
+    assert asyncio.run(collect()) == ["Your ", "results ", "look fine."]
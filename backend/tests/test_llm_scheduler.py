@@ -0,0 +1,79 @@
+"""
+LLM scheduler: priority order, per-class caps, and queue-time deadlines.
+"""
+import asyncio
+
+import pytest
+
+from services.llm_scheduler import LLMScheduler, QueueDeadlineExceeded, parse_class_caps
+
+
+def test_class_caps_parse_from_the_environment_format():
+    assert parse_class_caps("summary=4, tasks=2,unknown=9,chat=x") == {"summary": 4, "tasks": 2}
+    assert parse_class_caps(None) == {}
+
+
+def test_class_limit_never_exceeds_the_global_cap():
+    scheduler = LLMScheduler(max_concurrency=3, caps={"summary": 6, "backfill": 1})
+    assert scheduler.class_limit("summary") == 3
+    assert scheduler.class_limit("backfill") == 1
+    assert scheduler.class_limit("chat") == 3
+
+
+def test_freed_slots_go_to_the_highest_priority_waiter():
+    scheduler = LLMScheduler(max_concurrency=1)
+    started = []
+
+    async def call(priority):
+        await scheduler.acquire(priority)
+        started.append(priority)
+        await asyncio.sleep(0.01)
+        scheduler.release(priority)
+
+    async def run():
+        await scheduler.acquire("summary")
+        waiting = [asyncio.ensure_future(call(priority)) for priority in ("backfill", "tasks", "chat", "voice")]
+        await asyncio.sleep(0.01)
+        scheduler.release("summary")
+        await asyncio.gather(*waiting)
+
+    asyncio.run(run())
+    assert started == ["voice", "chat", "tasks", "backfill"]
+
+
+def test_capped_class_leaves_slots_for_interactive_requests():
+    scheduler = LLMScheduler(max_concurrency=4, caps={"backfill": 2})
+
+    async def run():
+        backfill = [asyncio.ensure_future(scheduler.acquire("backfill")) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        assert scheduler.in_flight["backfill"] == 2
+        await asyncio.wait_for(scheduler.acquire("chat"), timeout=0.1)
+        assert scheduler.snapshot()["backfill"] == {"in_flight": 2, "queued": 2}
+
+        scheduler.release("backfill")
+        await asyncio.sleep(0)
+        assert scheduler.in_flight["backfill"] == 2
+        for task in backfill:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_queued_request_gives_up_at_its_deadline():
+    scheduler = LLMScheduler(max_concurrency=1, deadlines={"voice": 0.05})
+
+    async def run():
+        await scheduler.acquire("chat")
+        with pytest.raises(QueueDeadlineExceeded, match="voice request waited"):
+            await scheduler.acquire("voice")
+        assert scheduler.total_queued == 0
+        scheduler.release("chat")
+        await asyncio.wait_for(scheduler.acquire("voice"), timeout=0.1)
+
+    asyncio.run(run())
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        asyncio.run(LLMScheduler(max_concurrency=1).acquire("urgent"))
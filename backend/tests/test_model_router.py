@@ -0,0 +1,85 @@
+"""
+Model routing and hedged requests: tier choice, hedge timing and the cost of hedge losers.
+"""
+import asyncio
+
+import pytest
+
+from services.model_router import ModelRouter, ModelStats
+from services.token_quota import estimate_tokens
+
+PAYLOAD = {"messages": [{"role": "user", "content": "What does my hemoglobin mean?"}], "max_tokens": 100}
+
+
+class FakeLLM:
+    """Answers after a per-model delay; delays[model] is a list consumed one call at a time."""
+
+    timeout_seconds = 15.0
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = []
+
+    async def chat_completion(self, payload, priority="chat"):
+        model = payload["model"]
+        self.calls.append(model)
+        delay = self.delays[model]
+        await asyncio.sleep(delay.pop(0) if isinstance(delay, list) else delay)
+        return {"choices": [{"message": {"content": model}}], "usage": {"total_tokens": 50}}
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setenv("GROQ_FAST_MODEL", "fast")
+    monkeypatch.setenv("GROQ_LARGE_MODEL", "large")
+    monkeypatch.setenv("GROQ_HEDGING", "true")
+    router = ModelRouter(llm=FakeLLM({}))
+    router.MIN_HEDGE_SECONDS = 0.001
+    return router
+
+
+def test_short_factual_and_voice_questions_go_to_the_fast_model(router):
+    assert router.choose("What is my LDL?", voice_mode=False) == ("fast", "large")
+    assert router.choose("Why is my LDL high?", voice_mode=False) == ("large", "fast")
+    assert router.choose("Please explain everything in this report to me in detail", voice_mode=True)[0] == "fast"
+
+
+def test_slow_primary_is_hedged_and_the_loser_is_charged(router):
+    router.llm.delays = {"large": 0.5, "fast": 0.01}
+    router.default_hedge_seconds = 0.02
+
+    data, model, abandoned = asyncio.run(router.complete(PAYLOAD, "Why is my LDL high?", False))
+    assert model == "fast"
+    assert abandoned == estimate_tokens(PAYLOAD)
+    assert router.stats["fast"].hedges_won == 1
+    # The cancelled primary still counts towards its latency window.
+    assert router.stats["large"].cancelled == 1
+    assert router.stats["large"].latencies[0] >= 0.02
+
+
+def test_hedge_delay_stays_stable_under_repeated_hedging(router):
+    # Half of the primary's calls are slow; hedging cuts every slow one short.
+    router.stats["large"] = ModelStats(window=20)
+    for index in range(20):
+        router.stats["large"].record(0.005 if index % 2 else 0.08)
+    initial = router.hedge_delay("large")
+    router.llm.delays = {"large": [0.005, 0.2] * 20, "fast": 0.002}
+
+    async def run():
+        for _ in range(40):
+            await router.complete(PAYLOAD, "Why is my LDL high?", False)
+
+    asyncio.run(run())
+    assert initial == pytest.approx(0.08)
+    # Only winners recorded would leave twenty 5ms samples and hedge every request.
+    assert initial <= router.hedge_delay("large") < 0.2
+    assert router.llm.calls.count("fast") <= 22
+
+
+def test_cancelled_sample_counts_as_no_faster_than_p95():
+    stats = ModelStats()
+    for seconds in (0.1, 0.2, 1.0):
+        stats.record(seconds)
+    stats.record_cancelled(0.05)
+    assert max(stats.latencies) == 1.0 and list(stats.latencies)[-1] == 1.0
+    assert stats.snapshot()["cancelled"] == 1
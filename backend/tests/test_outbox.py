@@ -0,0 +1,133 @@
+"""
+Sanity outbox: retry with backoff, per-document ordering and dead-lettering.
+"""
+import httpx
+import pytest
+
+from services.outbox import SanityOutbox
+
+
+class FakeSanity:
+    """Records sent transactions; fail(doc_id, status) makes writes to a document fail."""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = {}
+
+    def fail(self, doc_id, status=503):
+        self.failing[doc_id] = status
+
+    def __call__(self, mutations):
+        for mutation in mutations:
+            for body in mutation.values():
+                status = self.failing.get(body.get("_id") or body.get("id"))
+                if status:
+                    request = httpx.Request("POST", "https://sanity.test/mutate")
+                    raise httpx.HTTPStatusError("failed", request=request, response=httpx.Response(status, request=request))
+        self.sent.append(mutations)
+
+
+@pytest.fixture
+def sanity():
+    return FakeSanity()
+
+
+@pytest.fixture
+def outbox(tmp_path, sanity, monkeypatch):
+    box = SanityOutbox(send=sanity, path=str(tmp_path / "outbox.db"), base_delay_seconds=60.0)
+    # Drive flushes by hand instead of from the background thread.
+    monkeypatch.setattr(box, "start", lambda: None)
+    return box
+
+
+def create(doc_id, **fields):
+    return [{"createIfNotExists": {"_id": doc_id, "_type": "medicalReport", **fields}}]
+
+
+def patch(doc_id, **fields):
+    return [{"patch": {"id": doc_id, "set": fields}}]
+
+
+def make_due(outbox):
+    with outbox._conn:
+        outbox._conn.execute("UPDATE sanity_outbox SET next_attempt_at = 0")
+
+
+def sent_ids(sanity):
+    return [
+        body.get("_id") or body.get("id")
+        for transaction in sanity.sent
+        for mutation in transaction
+        for body in mutation.values()
+    ]
+
+
+def test_sends_due_entries_in_one_transaction(outbox, sanity):
+    sent_tags = []
+    outbox.on_sent = sent_tags.extend
+    outbox.enqueue(create("report-a"), tags=["user:u1"])
+    outbox.enqueue(patch("report-a", summary="s"), tags=["report:a"])
+
+    assert outbox.flush_once() == 2
+    assert len(sanity.sent) == 1
+    assert sent_ids(sanity) == ["report-a", "report-a"]
+    assert sent_tags == ["user:u1", "report:a"]
+    assert outbox.depth() == 0
+
+
+def test_transient_failure_is_retried_after_backoff(outbox, sanity):
+    sanity.fail("report-a")
+    outbox.enqueue(create("report-a"))
+
+    assert outbox.flush_once() == 0
+    assert outbox.depth() == 1
+    # Backing off: nothing is due yet.
+    assert outbox.flush_once() == 0
+    assert 0 < outbox._next_due_in() <= 30
+
+    del sanity.failing["report-a"]
+    make_due(outbox)
+    assert outbox.flush_once() == 1
+    assert outbox.depth() == 0
+
+
+def test_backing_off_entry_only_holds_back_its_own_document(outbox, sanity):
+    sanity.fail("report-a")
+    outbox.enqueue(create("report-a"), tags=["user:u1"])
+    outbox.flush_once()
+
+    outbox.enqueue(patch("report-a", summary="s"), tags=["report:a"])
+    outbox.enqueue(create("report-b"), tags=["user:u2"])
+    outbox.enqueue(create("report-c"), tags=["user:u1"])
+
+    # The patch waits for its create, and u1's later report stays behind u1's first one.
+    assert outbox.flush_once() == 1
+    assert sent_ids(sanity) == ["report-b"]
+
+    del sanity.failing["report-a"]
+    make_due(outbox)
+    assert outbox.flush_once() == 3
+    assert sent_ids(sanity)[1:] == ["report-a", "report-a", "report-c"]
+
+
+def test_conflict_is_dead_lettered_without_blocking_the_batch(outbox, sanity):
+    sanity.fail("report-a", status=409)
+    outbox.enqueue(create("report-a"), tags=["user:u1"])
+    outbox.enqueue(create("report-b"), tags=["user:u2"])
+
+    assert outbox.flush_once() == 1
+    assert sent_ids(sanity) == ["report-b"]
+    assert outbox.depth() == 0
+    assert outbox.dead_count() == 1
+
+
+def test_gives_up_after_max_attempts(outbox, sanity):
+    outbox.max_attempts = 3
+    sanity.fail("report-a")
+    outbox.enqueue(create("report-a"))
+    for _ in range(3):
+        make_due(outbox)
+        outbox.flush_once()
+
+    assert outbox.depth() == 0
+    assert outbox.dead_count() == 1
@@ -0,0 +1,119 @@
+"""
+Nightly task pre-generation: checkpointed resume, skipping users with tasks, backfill concurrency.
+"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import jobs.pregenerate_tasks as job
+from jobs.pregenerate_tasks import ACTIVE_USERS_QUERY, BatchCheckpoint, build_health_data, pregenerate_tasks
+from services.llm_client import get_llm_client
+from services.task_store import day_start, utc_today
+
+# Tomorrow, as the nightly run uses; older days are pruned from the checkpoint.
+DAY = utc_today() + timedelta(days=1)
+
+
+class FakeStore:
+    """Active users u1..u5 with one profile each; writes for users in fail_for raise."""
+
+    def __init__(self, users=("u1", "u2", "u3", "u4", "u5"), have_tasks=()):
+        self.users = list(users)
+        self.have_tasks = set(have_tasks)
+        self.fail_for = set()
+        self.written = {}
+
+    def is_available(self):
+        return True
+
+    async def query(self, query, params):
+        if query == ACTIVE_USERS_QUERY:
+            return {"profiles": self.users, "tasks": [None]}
+        return [
+            {"_type": "onboardingData", "clerkId": clerk_id, "healthContext": {"conditions": "Hypertension"}}
+            for clerk_id in params["ids"]
+        ]
+
+    async def users_with_tasks(self, clerk_ids, day):
+        return [clerk_id for clerk_id in clerk_ids if clerk_id in self.have_tasks]
+
+    async def create_generated_tasks(self, tasks_by_user, day):
+        if self.fail_for & set(tasks_by_user):
+            raise RuntimeError("transaction failed")
+        self.written.update(tasks_by_user)
+        return sum(len(tasks) for tasks in tasks_by_user.values())
+
+
+class FakeGenerator:
+    def __init__(self):
+        self.calls = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def generate(self, health, clerk_id, day=None, wait=False):
+        self.calls.append(clerk_id)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return [{"title": "Measure your blood pressure", "priority": "high", "category": "health-check"}]
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    fake = FakeGenerator()
+    monkeypatch.setattr(job, "get_task_generator", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return BatchCheckpoint(str(tmp_path / "task_batch.db"))
+
+
+def run(store, checkpoint, **kwargs):
+    return asyncio.run(pregenerate_tasks(DAY, store=store, checkpoint=checkpoint, batch_size=2, **kwargs))
+
+
+def test_failed_chunk_is_resumed_on_the_next_run(generator, checkpoint):
+    store = FakeStore()
+    store.fail_for = {"u3"}
+    totals = run(store, checkpoint)
+    assert totals["failed"] == 2
+    assert sorted(store.written) == ["u1", "u2", "u5"]
+    assert checkpoint.finished(DAY) == {"u1", "u2", "u5"}
+
+    store.fail_for = set()
+    generator.calls.clear()
+    totals = run(store, checkpoint)
+    assert sorted(generator.calls) == ["u3", "u4"]
+    assert totals["skipped"] == 3 and totals["failed"] == 0
+    assert checkpoint.finished(DAY) == {"u1", "u2", "u3", "u4", "u5"}
+    assert store.written["u4"][0]["dueDate"] == day_start(DAY)
+
+
+def test_users_who_already_have_tasks_are_skipped_and_checkpointed(generator, checkpoint):
+    store = FakeStore(have_tasks={"u2"})
+    totals = run(store, checkpoint)
+    assert "u2" not in generator.calls
+    assert totals["skipped"] == 1
+    assert "u2" in checkpoint.finished(DAY)
+
+
+def test_default_concurrency_matches_the_backfill_cap(generator, checkpoint):
+    store = FakeStore(users=[f"u{i}" for i in range(8)])
+    asyncio.run(pregenerate_tasks(DAY, store=store, checkpoint=checkpoint, batch_size=8))
+    assert generator.peak == get_llm_client().scheduler.class_limit("backfill") == 2
+
+
+def test_profiles_and_onboarding_merge_without_duplicates():
+    health = build_health_data(
+        [
+            {"_type": "userProfile", "firstName": "Ana", "age": 61, "chronicDiseases": "Diabetes; hypertension"},
+            {"_type": "onboardingData", "healthContext": {"conditions": ["Hypertension"], "medications": "metformin"}},
+        ]
+    )
+    assert health.conditions == ["Diabetes", "hypertension"]
+    assert health.medications == ["metformin"]
+    assert health.firstName == "Ana" and health.age == 61
@@ -0,0 +1,64 @@
+"""
+Chat prompt layout: a byte-identical prefix per report and mode, memoised report blocks.
+"""
+from services.groq_service import GroqService
+from services.prompt_builder import ReportContextCache, render_report_context, system_prompt
+from utils.token_budget import count_tokens
+
+REPORT_TEXT = "\n".join(
+    [
+        "CITY LAB - Collected 2026-01-05",
+        "LDL Cholesterol 162 mg/dL (<100)",
+        "Hemoglobin 13.5 g/dL (13-17)",
+        "TSH 6.8 uIU/mL (0.4-4.0)",
+    ]
+)
+VALUES = [
+    {"test_name": "Hemoglobin", "value": "13.5", "unit": "g/dL", "classification": "Normal"},
+    {"test_name": "LDL Cholesterol", "value": "162", "unit": "mg/dL", "classification": "Above Range"},
+    {"test_name": "TSH", "value": "6.8", "unit": "uIU/mL", "classification": "Above Range"},
+]
+
+
+def payload(question, voice_mode=False, explain_simple=False):
+    return GroqService()._build_payload(question, REPORT_TEXT, VALUES, voice_mode, explain_simple)
+
+
+def test_questions_about_one_report_share_the_system_prefix():
+    first = payload("What is my LDL?")["messages"]
+    second = payload("Is my thyroid okay?")["messages"]
+    assert first[0] == second[0]
+    assert first[-1] != second[-1]
+    assert "What is my LDL?" not in first[0]["content"]
+
+    assert payload("What is my LDL?", voice_mode=True)["messages"][0] != first[0]
+    assert payload("What is my LDL?", explain_simple=True)["messages"][0] != first[0]
+
+
+def test_system_prompts_are_interned():
+    text, tokens = system_prompt(False, True)
+    assert system_prompt(0, 1)[0] is text
+    assert tokens == count_tokens(text)
+
+
+def test_report_block_lists_out_of_range_results_first():
+    block = render_report_context(REPORT_TEXT, VALUES, max_tokens=500)
+    assert block.index("LDL Cholesterol: 162") < block.index("TSH: 6.8") < block.index("Hemoglobin: 13.5")
+    assert "CITY LAB" in block
+
+
+def test_report_block_stays_within_its_budget():
+    values = [dict(VALUES[0], test_name=f"Test {i}") for i in range(40)]
+    block = render_report_context(REPORT_TEXT, values, max_tokens=120)
+    assert count_tokens(block) <= 120 + count_tokens("  (+40 more results not shown)")
+    assert "more results not shown" in block
+
+
+def test_report_block_is_rendered_once_per_report():
+    cache = ReportContextCache(max_entries=1, max_tokens=300)
+    block, tokens = cache.get(REPORT_TEXT, VALUES)
+    assert cache.get(REPORT_TEXT, []) == (block, tokens)
+    assert tokens == count_tokens(block)
+
+    cache.get("Another report", VALUES)
+    assert cache.get(REPORT_TEXT, [])[0] != block
@@ -0,0 +1,117 @@
+"""
+Read-through Sanity query cache: TTLs, ETag revalidation, CDN reads and tag invalidation.
+"""
+import httpx
+import pytest
+
+from services.storage_backends import SanityStorage
+from utils.query_cache import QueryCache
+
+REPORT_QUERY = '*[_type == "medicalReport" && reportId == $reportId][0]'
+REPORT = {"_id": "report-r1", "reportId": "r1", "userId": "u1"}
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("SANITY_PROJECT_ID", "test")
+    monkeypatch.setenv("SANITY_DATASET", "test")
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    monkeypatch.setenv("SANITY_OUTBOX", "false")
+    monkeypatch.setenv("SANITY_USE_CDN", "true")
+    return SanityStorage()
+
+
+def serve(storage, handler):
+    requests = []
+
+    def record(request):
+        requests.append(request)
+        return handler(request)
+
+    storage._http = httpx.Client(transport=httpx.MockTransport(record))
+    return requests
+
+
+def expire_all(storage):
+    for entry in storage.query_cache._entries.values():
+        entry["expires_at"] = 0
+
+
+def query_report(storage):
+    return storage._query(REPORT_QUERY, {"reportId": "r1"}, kind="report", tags=["report:r1"])
+
+
+def test_fresh_entry_is_served_without_a_request(storage):
+    requests = serve(storage, lambda request: httpx.Response(200, json={"result": REPORT}))
+
+    assert query_report(storage) == REPORT
+    assert query_report(storage) == REPORT
+    assert len(requests) == 1
+    # Reports are personal medical data: never read through the shared CDN, even with SANITY_USE_CDN on.
+    assert requests[0].url.host == "test.api.sanity.io"
+    assert requests[0].url.params["$reportId"] == '"r1"'
+
+
+def test_stale_entry_is_revalidated_with_its_etag(storage):
+    def sanity(request):
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"result": REPORT}, headers={"ETag": '"v1"'})
+
+    requests = serve(storage, sanity)
+    query_report(storage)
+    expire_all(storage)
+
+    assert query_report(storage) == REPORT
+    assert requests[-1].headers["if-none-match"] == '"v1"'
+    assert storage.query_cache.stats()["revalidations"] == 1
+    # The 304 refreshed the entry.
+    query_report(storage)
+    assert len(requests) == 2
+
+
+def test_misses_are_not_cached(storage):
+    results = [None, REPORT]
+    requests = serve(storage, lambda request: httpx.Response(200, json={"result": results.pop(0)}))
+
+    assert query_report(storage) is None
+    assert query_report(storage) == REPORT
+    assert len(requests) == 2
+
+
+def test_invalidating_a_report_drops_its_cached_queries(storage):
+    requests = serve(storage, lambda request: httpx.Response(200, json={"result": REPORT}))
+    query_report(storage)
+    storage._query('*[_id == $id][0]', {"id": "report-r1"}, kind="summary")
+
+    storage.invalidate_report("r1")
+    query_report(storage)
+    assert len(requests) == 3
+    # The summary query was tagged with the document id, not the report tag.
+    storage._invalidate_tags(["doc:report-r1"])
+    storage._query('*[_id == $id][0]', {"id": "report-r1"}, kind="summary")
+    assert len(requests) == 4
+
+
+def test_only_kinds_marked_cdn_use_the_cdn(storage, monkeypatch):
+    from services import storage_backends
+
+    assert not any(policy["cdn"] for policy in storage_backends.QUERY_POLICIES.values())
+    monkeypatch.setitem(storage_backends.QUERY_POLICIES, "public", {"ttl": 60, "push_ttl": 60, "cdn": True})
+    requests = serve(storage, lambda request: httpx.Response(200, json={"result": []}))
+
+    storage._query('*[_type == "hospital"]', kind="public")
+    assert requests[0].url.host == "test.apicdn.sanity.io"
+
+
+def test_cache_evicts_least_recently_used_entries():
+    cache = QueryCache(max_entries=2)
+    cache.store("a", 1, 60, tags=["t"])
+    cache.store("b", 2, 60)
+    cache.lookup("a")
+    cache.store("c", 3, 60)
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a")["value"] == 1
+    assert cache.invalidate_tags("t") == 1
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,61 @@
+"""
+GCRA rate limiting and the async path over the shared SQLite store.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+
+from utils.rate_limit import MemoryRateLimitBackend, RateLimiter, SQLiteRateLimitBackend, gcra
+
+
+def test_gcra_allows_a_burst_then_spaces_requests():
+    interval, tolerance = 1.0, 3.0
+    tat, allowed = None, []
+    for _ in range(4):
+        ok, new_tat, _ = gcra(tat, 100.0, interval, tolerance)
+        allowed.append(ok)
+        tat = new_tat if ok else tat
+    assert allowed == [True, True, True, False]
+    assert gcra(tat, 101.0, interval, tolerance)[0] is True
+
+
+def test_limiter_counts_per_key_on_both_backends(tmp_path):
+    for backend in (MemoryRateLimitBackend(), SQLiteRateLimitBackend(str(tmp_path / "limits.db"))):
+        limiter = RateLimiter("test", max_calls=2, window_seconds=60, backend=backend)
+        assert [limiter.is_allowed("u1") for _ in range(3)] == [True, True, False]
+        assert limiter.is_allowed("u2") is True
+        assert 0 < limiter.get_wait_time("u1") <= 30
+
+
+def test_async_check_waits_for_sqlite_lock_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "limits.db")
+    limiter = RateLimiter("test", max_calls=5, window_seconds=60, backend=SQLiteRateLimitBackend(path))
+
+    # Another worker process holds the write lock for a moment.
+    other = sqlite3.connect(path, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, other.commit).start()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        allowed = await limiter.is_allowed_async("u1")
+        waited = time.monotonic() - started
+        task.cancel()
+        return allowed, waited, ticks
+
+    allowed, waited, ticks = asyncio.run(run())
+    other.close()
+    assert allowed is True
+    assert waited >= 0.25
+    # The loop kept running while the check waited for the lock.
+    assert ticks >= 10
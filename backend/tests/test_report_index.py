@@ -0,0 +1,73 @@
+"""
+Report retrieval: line-aligned chunks, BM25 chunk selection and parsed-value selection.
+"""
+from services.report_index import ReportIndex, ReportIndexRegistry, chunk_text, select_values
+from utils.token_budget import count_tokens
+
+HEADER = "CITY LAB - Patient: A. Patient - Collected 2026-01-05"
+SECTIONS = {
+    "lipids": "LIPID PROFILE\nTotal Cholesterol 245 mg/dL (<200)\nLDL Cholesterol 162 mg/dL (<100)\nHDL 41 mg/dL",
+    "blood": "COMPLETE BLOOD COUNT\nHemoglobin 13.5 g/dL (13-17)\nPlatelets 250 x10^3/uL (150-400)\nWBC 6.1",
+    "thyroid": "THYROID PANEL\nTSH 6.8 uIU/mL (0.4-4.0)\nFree T4 0.9 ng/dL (0.8-1.8)",
+}
+REPORT = "\n".join([HEADER, *SECTIONS.values()])
+
+VALUES = [
+    {"test_name": "Hemoglobin", "value": "13.5", "classification": "Normal"},
+    {"test_name": "LDL Cholesterol", "value": "162", "classification": "Above Range"},
+    {"test_name": "Platelets", "value": "250", "classification": "Normal"},
+    {"test_name": "TSH", "value": "6.8", "classification": "Above Range"},
+]
+
+
+def index():
+    return ReportIndex(REPORT, chunk_chars=120)
+
+
+def test_chunks_follow_lines_and_split_only_long_ones():
+    chunks = chunk_text(REPORT, chunk_chars=120)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    assert "\n".join(chunks).split("\n") == REPORT.split("\n")
+
+    long_line = "word " * 100
+    assert all(len(chunk) <= 50 for chunk in chunk_text(long_line, chunk_chars=50))
+
+
+def test_question_retrieves_the_matching_section_first():
+    best, _ = index().search("Is my LDL cholesterol too high?")[0]
+    assert "LDL Cholesterol" in index().chunks[best]
+    assert "TSH" in index().chunks[index().search("thyroid TSH")[0][0]]
+
+
+def test_selected_chunks_fit_the_budget_in_document_order():
+    report = index()
+    budget = count_tokens(report.chunks[0]) + max(count_tokens(chunk) for chunk in report.chunks)
+    chosen = report.select_chunks("What does my TSH mean?", budget)
+    assert chosen[0] == report.chunks[0]  # the header is kept for context
+    assert any("TSH" in chunk for chunk in chosen)
+    assert sum(count_tokens(chunk) for chunk in chosen) <= budget
+    assert chosen == sorted(chosen, key=report.chunks.index)
+
+    without_header = report.select_chunks("What does my TSH mean?", budget, include_header=False)
+    assert report.chunks[0] not in without_header
+
+
+def test_unmatched_question_falls_back_to_document_order():
+    report = index()
+    assert report.select_chunks("hello there", 10_000) == report.chunks
+
+
+def test_select_values_prefers_named_then_out_of_range():
+    names = lambda items: [item["test_name"] for item in items]
+    # Named tests first; in-range values the question does not mention are dropped.
+    assert names(select_values("What about my platelets?", VALUES, limit=3)) == ["Platelets", "LDL Cholesterol", "TSH"]
+    # Nothing named: out-of-range values lead, then the rest.
+    assert names(select_values("Summarise my report", VALUES, limit=3)) == ["LDL Cholesterol", "TSH", "Hemoglobin"]
+
+
+def test_registry_reuses_the_index_for_the_same_text():
+    registry = ReportIndexRegistry(max_reports=1)
+    first = registry.get(REPORT)
+    assert registry.get(REPORT) is first
+    registry.get("another report")
+    assert registry.get(REPORT) is not first
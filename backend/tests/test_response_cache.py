@@ -0,0 +1,91 @@
+"""
+Exact-match chat answer cache: keys, the persistent tier, and what GroqService caches.
+"""
+import asyncio
+import time
+
+import pytest
+
+from services.conversation_memory import Conversation
+from services.groq_service import GroqService
+from services.response_cache import ResponseCache
+
+REPORT_TEXT = "LDL Cholesterol 162 mg/dL (0-100)"
+
+
+def key(question="What is my LDL?", text=REPORT_TEXT, mode="normal", voice_mode=False):
+    return ResponseCache.make_key(text, question, mode, voice_mode, "fast|large", "v1")
+
+
+def test_key_ignores_case_spacing_and_trailing_punctuation():
+    assert key("  what is my   LDL ?? ") == key("What is my LDL")
+    assert key() != key(text=REPORT_TEXT + " ")
+    assert key() != key(mode="explain_simple")
+    assert key() != key(voice_mode=True)
+
+
+def test_answers_survive_a_restart_through_the_sqlite_tier(tmp_path):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(path=path).set(key(), "Your LDL is high.", "large")
+
+    restarted = ResponseCache(path=path)
+    assert restarted.get(key()) == {"response": "Your LDL is high.", "model": "large"}
+    assert restarted.stats()["disk_hits"] == 1
+    assert restarted.get(key()) is not None
+    assert restarted.stats()["memory_hits"] == 1
+
+
+def test_expired_answers_are_not_served(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.db"), ttl_seconds=0.001)
+    cache.set(key(), "Your LDL is high.", "large")
+    time.sleep(0.01)
+    assert cache.get(key()) is None
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_PATH", str(tmp_path / "responses.db"))
+    monkeypatch.setenv("SEMANTIC_CACHE", "false")
+    service = GroqService()
+    monkeypatch.setattr(service, "api_key", "test-key")
+    monkeypatch.setattr(service.quota, "enabled", False)
+    service.answers = []
+
+    async def complete(payload, message, voice_mode):
+        if not service.answers:
+            raise RuntimeError("Groq unavailable")
+        answer = service.answers.pop(0)
+        return {"choices": [{"message": {"content": answer}}], "usage": {"total_tokens": 10}}, "large", 0
+
+    monkeypatch.setattr(service.router, "complete", complete)
+    return service
+
+
+def ask(service, message, history=None):
+    return asyncio.run(service.generate_response(message, REPORT_TEXT, [], False, False, history=history))
+
+
+def test_repeated_question_is_answered_from_the_cache(service):
+    service.answers = ["Your LDL is above the usual range."]
+    first = ask(service, "What is my LDL?")
+    second = ask(service, "what is my ldl")
+    assert second == first
+    assert first["model"] == "large"
+
+
+def test_fallback_answers_are_not_cached(service):
+    assert ask(service, "What is my LDL?")["model"] is None
+    service.answers = ["Your LDL is above the usual range."]
+    assert ask(service, "What is my LDL?")["model"] == "large"
+
+
+def test_follow_ups_in_a_conversation_are_not_cached(service):
+    history = Conversation(recent_turns=2, summary_tokens=200)
+    history.add_turn("What is my LDL?", "It is 162 mg/dL.")
+    assert not service._cacheable("Why is that high?", history)
+    assert service._cacheable("Why is that high?", None)
+    assert service._cacheable("What is my HDL?", history)
+
+    service.answers = ["Diet and genetics both play a part.", "It can also be medication."]
+    ask(service, "Why is that high?", history)
+    assert ask(service, "Why is that high?", history)["response"].startswith("It can also")
@@ -0,0 +1,113 @@
+"""
+Sanity listener and push invalidation, against a local SSE stand-in.
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from services.sanity_listener import SanityListener, parse_sse_events
+from services.storage_backends import SanityStorage
+
+REPORT_QUERY = '*[_type == "medicalReport" && reportId == $reportId && userId == $userId][0]'
+
+
+def sse_body(*events):
+    lines = [": keep-alive", ""]
+    for index, (name, data) in enumerate(events):
+        lines += [f"id: {index}", f"event: {name}", f"data: {json.dumps(data)}", ""]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("SANITY_PROJECT_ID", "test")
+    monkeypatch.setenv("SANITY_DATASET", "test")
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    monkeypatch.setenv("SANITY_OUTBOX", "false")
+    return SanityStorage()
+
+
+def serve_queries(storage, handler):
+    storage._http = httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_parse_sse_events_joins_data_and_skips_comments():
+    async def lines():
+        for line in [": ping", "id: 7", "event: mutation", "data: {\"a\":", "data: 1}", ""]:
+            yield line
+
+    async def collect():
+        return [event async for event in parse_sse_events(lines())]
+
+    assert asyncio.run(collect()) == [{"event": "mutation", "data": "{\"a\":\n1}", "id": "7"}]
+
+
+def test_listener_invalidates_cached_report_from_sse_stand_in(storage):
+    queries = []
+
+    def sanity(request):
+        queries.append(request.url.params["query"])
+        return httpx.Response(200, json={"result": {"_id": "report-r1", "reportId": "r1", "userId": "u1"}})
+
+    serve_queries(storage, sanity)
+    listen_requests = []
+    mutation = {
+        "documentId": "report-r1",
+        "transition": "update",
+        "result": {"_id": "report-r1", "_type": "medicalReport", "reportId": "r1", "userId": "u1"},
+    }
+
+    def stand_in(request):
+        listen_requests.append(request)
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream"},
+            content=sse_body(("welcome", {"listenerName": "test"}), ("mutation", mutation)),
+        )
+
+    listener = SanityListener(base_url="http://sse.local/listen", transport=httpx.MockTransport(stand_in))
+    statuses = []
+    listener.add_handler(storage.apply_mutation)
+    listener.add_status_handler(storage.set_push_invalidation)
+    listener.add_status_handler(statuses.append)
+
+    params = {"reportId": "r1", "userId": "u1"}
+    storage._query(REPORT_QUERY, params, kind="report", tags=["report:r1"])
+    storage._query(REPORT_QUERY, params, kind="report", tags=["report:r1"])
+    assert len(queries) == 1
+
+    async def run():
+        listener.start()
+        while listener.events_received == 0:
+            await asyncio.sleep(0.01)
+        await listener.stop()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    assert listen_requests[0].url.params["query"] == '*[_type in ["medicalReport", "chatConversation", "dailyTask"]]'
+    assert statuses == [True, False]
+    storage._query(REPORT_QUERY, params, kind="report", tags=["report:r1"])
+    assert len(queries) == 2
+
+
+def test_query_overlapping_an_invalidation_is_not_cached(storage):
+    storage.set_push_invalidation(True)
+    calls = []
+
+    def sanity(request):
+        calls.append(request)
+        if len(calls) == 1:
+            # The document changes while the first read is in flight.
+            storage.apply_mutation({"documentId": "report-r1", "result": {"_type": "medicalReport", "reportId": "r1"}})
+        return httpx.Response(200, json={"result": {"_id": "report-r1", "summary": f"v{len(calls)}"}})
+
+    serve_queries(storage, sanity)
+    params = {"reportId": "r1", "userId": "u1"}
+    first = storage._query(REPORT_QUERY, params, kind="summary", tags=["report:r1"])
+    second = storage._query(REPORT_QUERY, params, kind="summary", tags=["report:r1"])
+    third = storage._query(REPORT_QUERY, params, kind="summary", tags=["report:r1"])
+
+    assert [first["summary"], second["summary"], third["summary"]] == ["v1", "v2", "v2"]
+    assert len(calls) == 2
@@ -0,0 +1,60 @@
+"""
+Semantic question cache: paraphrases hit, near-miss medical questions do not.
+"""
+import pytest
+
+from services.semantic_cache import SemanticCache, cosine, embed
+
+SCOPE = "report-1|normal|text|model|v1"
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(threshold=0.86, ttl_seconds=60)
+
+
+def answered(cache, question, response="cached answer"):
+    cache.add(SCOPE, question, response, "test-model")
+    return cache
+
+
+@pytest.mark.parametrize(
+    "asked, cached",
+    [
+        ("What does my report say?", "Explain my results"),
+        ("Is my sugar elevated?", "Is my glucose high?"),
+        ("Is my hemoglobin ok?", "Is my haemoglobin normal?"),
+    ],
+)
+def test_paraphrases_reuse_the_answer(cache, asked, cached):
+    assert answered(cache, cached).lookup(SCOPE, asked)["response"] == "cached answer"
+
+
+@pytest.mark.parametrize(
+    "asked, cached",
+    [
+        ("Should I not be worried about my glucose?", "Should I be worried about my glucose?"),
+        ("Why isn't my glucose high?", "Why is my glucose high?"),
+        ("Is my glucose low?", "Is my glucose high?"),
+        ("Is my cholesterol high?", "Is my glucose high?"),
+        ("What does my LDL mean?", "What does my HDL mean?"),
+        ("Is my TSH normal?", "Is my T4 normal?"),
+    ],
+)
+def test_near_miss_medical_questions_do_not_hit(cache, asked, cached):
+    assert answered(cache, cached).lookup(SCOPE, asked) is None
+
+
+def test_negated_question_is_similar_but_still_missed(cache):
+    asked, cached = "Should I not be worried about my glucose?", "Should I be worried about my glucose?"
+    # The wording alone would be close enough with a slightly lower threshold.
+    assert cosine(embed(asked), embed(cached)) > 0.75
+    assert answered(SemanticCache(threshold=0.75, ttl_seconds=60), cached).lookup(SCOPE, asked) is None
+
+
+def test_scopes_and_expiry_are_respected(cache):
+    answered(cache, "Explain my results")
+    assert cache.lookup("report-2|normal|text|model|v1", "Explain my results") is None
+
+    expired = answered(SemanticCache(threshold=0.86, ttl_seconds=-1), "Explain my results")
+    assert expired.lookup(SCOPE, "Explain my results") is None
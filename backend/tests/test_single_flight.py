@@ -0,0 +1,89 @@
+"""
+Single-flight coalescing: overlapping calls for a key share one upstream call.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_concurrent_blocking_calls_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    started = threading.Event()
+
+    def fetch(report_id):
+        calls.append(report_id)
+        started.set()
+        time.sleep(0.1)
+        return {"reportId": report_id}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "r1", fetch, "r1")
+        started.wait()
+        followers = [pool.submit(flight.do, "r1", fetch, "r1") for _ in range(3)]
+        results = [future.result() for future in [leader, *followers]]
+
+    assert calls == ["r1"]
+    assert all(result is results[0] for result in results)
+    assert flight.coalesced == 3
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    flight = SingleFlight("test")
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.05)
+        raise RuntimeError("Sanity unavailable")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "r1", failing)
+        started.wait()
+        follower = pool.submit(flight.do, "r1", failing)
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError, match="Sanity unavailable"):
+                future.result()
+
+    assert flight.do("r1", lambda: "fresh") == "fresh"
+
+
+def test_overlapping_coroutines_share_one_call_per_key():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def generate(report_id):
+        calls.append(report_id)
+        await asyncio.sleep(0.02)
+        return f"summary of {report_id}"
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do_async(key, generate, key) for key in ("r1", "r1", "r2", "r1"))
+        )
+
+    assert asyncio.run(run()) == ["summary of r1", "summary of r1", "summary of r2", "summary of r1"]
+    assert sorted(calls) == ["r1", "r2"]
+    assert flight.coalesced == 2
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_call():
+    flight = SingleFlight("test")
+
+    async def generate():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        impatient = asyncio.ensure_future(flight.do_async("r1", generate))
+        patient = asyncio.ensure_future(flight.do_async("r1", generate))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(run()) == "done"
@@ -0,0 +1,81 @@
+"""
+Summary cache: TTL expiry, LRU bounds, and the SQLite tier shared across workers.
+"""
+import time
+
+import pytest
+
+from services.summary_service import SummaryCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "summary_cache.db")
+
+
+def cache(path, **kwargs):
+    return SummaryCache(path=path, **kwargs)
+
+
+def test_expired_summaries_are_not_served(path):
+    summaries = cache(path, ttl_hours=0.01 / 3600)
+    summaries.set("r1", "Your glucose is slightly high.")
+    time.sleep(0.02)
+    assert summaries.get("r1") is None
+    assert summaries.stats()["expirations"] == 1
+    assert cache(path).get("r1") is None
+
+
+def test_sweep_clears_expired_entries_from_both_tiers(path):
+    summaries = cache(path, ttl_hours=0.01 / 3600)
+    summaries.set("r1", "Your glucose is slightly high.")
+    time.sleep(0.02)
+    assert summaries.sweep() == 1
+    assert summaries.stats()["memory_entries"] == 0
+    assert summaries._conn.execute("SELECT COUNT(*) FROM summary_cache").fetchone()[0] == 0
+
+
+def test_memory_tier_is_bounded_by_entries_and_bytes(path):
+    summaries = cache(path, max_entries=2, max_bytes=10_000)
+    for report_id in ("r1", "r2", "r3"):
+        summaries.set(report_id, f"Summary of {report_id}")
+    assert list(summaries.cache) == ["r2", "r3"]
+    assert summaries.stats()["evictions"] == 1
+
+    small = cache(path, max_entries=10, max_bytes=20)
+    small.set("a", "x" * 12)
+    small.set("b", "y" * 12)
+    assert list(small.cache) == ["b"]
+    small.set("huge", "z" * 50)
+    assert "huge" not in small.cache
+
+
+def test_evicted_summaries_are_still_served_from_the_shared_tier(path):
+    summaries = cache(path, max_entries=1)
+    summaries.set("r1", "First summary.")
+    summaries.set("r2", "Second summary.")
+    assert "r1" not in summaries.cache
+    assert summaries.get("r1") == "First summary."
+    assert summaries.stats()["disk_hits"] == 1
+
+
+def test_summary_from_one_worker_is_served_by_another(path):
+    writer, reader = cache(path), cache(path)
+    writer.set("r1", "Your cholesterol is high.")
+    assert reader.get("r1") == "Your cholesterol is high."
+    assert reader.get("r1") == "Your cholesterol is high."
+    assert reader.stats()["disk_hits"] == 1 and reader.stats()["memory_hits"] == 1
+
+    writer.invalidate("r1")
+    assert cache(path).get("r1") is None
+
+
+def test_memory_entries_recheck_the_shared_tier_after_a_while(path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_CACHE_MEMORY_SECONDS", "0.01")
+    writer, reader = cache(path), cache(path)
+    writer.set("r1", "Old summary.")
+    assert reader.get("r1") == "Old summary."
+
+    writer.set("r1", "Regenerated summary.")
+    time.sleep(0.02)
+    assert reader.get("r1") == "Regenerated summary."
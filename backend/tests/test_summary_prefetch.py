@@ -0,0 +1,90 @@
+"""
+Summary prefetch: persisting by report document id, and retrying rate-limited jobs.
+"""
+import asyncio
+
+from services.outbox import SanityOutbox
+from services.storage_backends import SanityStorage, report_document_id
+from services.summary_prefetch import SummaryPrefetcher
+
+
+class FakeSummaryService:
+    """Returns the queued generate_summary results in order."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.cache = {}
+
+    def _can_call_api(self):
+        return True
+
+    async def generate_summary(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.results.pop(0)
+
+
+class FakeSanityService:
+    def __init__(self):
+        self.updates = []
+
+    def update_report_summary(self, report_id, user_id, summary, document_id=None):
+        self.updates.append((report_id, user_id, summary, document_id))
+        return True
+
+
+def prefetch(summaries, wait=0.1):
+    sanity = FakeSanityService()
+    prefetcher = SummaryPrefetcher(summaries, sanity, per_minute=100)
+
+    async def run():
+        prefetcher.enqueue("r1", "u1", "Glucose 110 mg/dL", [], document_id=report_document_id("r1"))
+        await asyncio.sleep(wait)
+        await prefetcher.stop()
+
+    asyncio.run(run())
+    return sanity
+
+
+def test_prefetched_summary_is_saved_by_document_id():
+    summaries = FakeSummaryService({"summary": "Your glucose is slightly high."})
+    sanity = prefetch(summaries)
+
+    assert summaries.calls[0]["priority"] == "backfill"
+    assert sanity.updates == [("r1", "u1", "Your glucose is slightly high.", "report-r1")]
+
+
+def test_rate_limited_job_is_retried_once_it_may_run():
+    summaries = FakeSummaryService({"wait_time": 0}, {"summary": "Done."})
+    sanity = prefetch(summaries, wait=1.3)
+
+    assert len(summaries.calls) == 2
+    assert sanity.updates == [("r1", "u1", "Done.", "report-r1")]
+
+
+def test_long_waits_are_not_retried():
+    summaries = FakeSummaryService({"wait_time": SummaryPrefetcher.MAX_RETRY_DELAY_SECONDS + 1})
+    sanity = prefetch(summaries)
+
+    assert len(summaries.calls) == 1
+    assert sanity.updates == []
+
+
+def test_summary_patch_queues_behind_the_report_create(tmp_path, monkeypatch):
+    monkeypatch.setenv("SANITY_PROJECT_ID", "test")
+    monkeypatch.setenv("SANITY_DATASET", "test")
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    monkeypatch.setenv("SANITY_OUTBOX", "false")
+    storage = SanityStorage()
+    sent = []
+    storage.outbox = SanityOutbox(send=sent.append, path=str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(storage.outbox, "start", lambda: None)
+
+    storage.insert_report(
+        {"report_id": "r1", "user_id": "u1", "extracted_text": "Glucose 110", "upload_date": "2026-01-01T00:00:00Z"}
+    )
+    storage.set_report_summary("r1", "u1", "Slightly high.", document_id=report_document_id("r1"))
+    storage.outbox.flush_once()
+
+    create, patch = [mutation for transaction in sent for mutation in transaction]
+    assert create["createIfNotExists"]["_id"] == patch["patch"]["id"] == "report-r1"
@@ -0,0 +1,116 @@
+"""
+/api/generate-summary: one storage read per request and a summary write by document id.
+"""
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routers.summary as summary_router
+from services.storage_backends import SanityStorage
+
+
+class FakeSanityService:
+    """One stored report; counts reads and records summary writes."""
+
+    def __init__(self, summary=None):
+        self.report = {
+            "report_id": "r1",
+            "document_id": "report-r1",
+            "extracted_text": "Glucose 110 mg/dL (70-99)",
+            "summary": summary,
+            "summary_generated_at": "2026-01-01T00:00:00Z" if summary else None,
+        }
+        self.reads = 0
+        self.updates = []
+
+    def get_report_for_summary(self, report_id, user_id):
+        self.reads += 1
+        return self.report if report_id == "r1" else None
+
+    def update_report_summary(self, report_id, user_id, summary, document_id=None):
+        self.updates.append((report_id, summary, document_id))
+        return True
+
+
+class FakeSummaryService:
+    def __init__(self):
+        self.calls = []
+
+    async def generate_summary(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"summary": "Your glucose is slightly high.", "cached": False, "generated_at": "now", "source": "ai"}
+
+
+@pytest.fixture
+def services(monkeypatch):
+    sanity, summaries = FakeSanityService(), FakeSummaryService()
+    monkeypatch.setattr(summary_router, "sanity_service", sanity)
+    monkeypatch.setattr(summary_router, "summary_service", summaries)
+    return sanity, summaries
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(summary_router.router, prefix="/api")
+    return TestClient(app)
+
+
+def generate(client, report_id="r1", **body):
+    return client.post("/api/generate-summary", json={"report_id": report_id, "user_id": "u1", **body})
+
+
+def test_new_summary_is_saved_by_document_id_after_one_read(client, services):
+    sanity, summaries = services
+    response = generate(client)
+
+    assert response.status_code == 200
+    assert response.json()["summary"] == "Your glucose is slightly high."
+    assert sanity.reads == 1
+    assert sanity.updates == [("r1", "Your glucose is slightly high.", "report-r1")]
+    assert summaries.calls[0]["extracted_text"] == "Glucose 110 mg/dL (70-99)"
+
+
+def test_stored_summary_is_returned_from_the_same_read(client, services, monkeypatch):
+    sanity = FakeSanityService(summary="Stored summary.")
+    monkeypatch.setattr(summary_router, "sanity_service", sanity)
+    response = generate(client)
+
+    assert response.json()["summary"] == "Stored summary."
+    assert response.json()["source"] == "sanity_db"
+    assert sanity.reads == 1 and sanity.updates == []
+    assert services[1].calls == []
+
+
+def test_unknown_report_is_404(client, services):
+    assert generate(client, report_id="missing").status_code == 404
+
+
+def test_sanity_reads_and_writes_the_summary_in_one_request_each(monkeypatch):
+    monkeypatch.setenv("SANITY_PROJECT_ID", "test")
+    monkeypatch.setenv("SANITY_DATASET", "test")
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    monkeypatch.setenv("SANITY_OUTBOX", "false")
+    storage = SanityStorage()
+    requests = []
+
+    def sanity(request):
+        requests.append(request)
+        if request.method == "GET":
+            return httpx.Response(200, json={"result": {"_id": "report-r1", "extractedText": "Glucose 110"}})
+        return httpx.Response(200, json={"results": []})
+
+    storage._http = httpx.Client(transport=httpx.MockTransport(sanity))
+
+    doc = storage.fetch_report_for_summary("r1", "u1")
+    assert doc["_id"] == "report-r1"
+    assert "extractedText" in requests[0].url.params["query"]
+    assert storage.set_report_summary("r1", "u1", "Slightly high.", document_id=doc["_id"])
+
+    assert len(requests) == 2
+    (mutation,) = json.loads(requests[1].content)["mutations"]
+    assert mutation["patch"]["id"] == "report-r1"
+    assert mutation["patch"]["set"]["summary"] == "Slightly high."
@@ -0,0 +1,108 @@
+"""
+Groq task generation: the profile cache key, the shared task cache, and answer validation.
+"""
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+from models.schemas import UserHealthData
+from services.task_generator import TaskCache, TaskGenerator, parse_tasks, profile_fingerprint
+
+DAY = date(2026, 3, 1)
+TASKS = [{"title": "Avoid late meals", "description": None, "priority": "medium", "category": "nutrition"}]
+
+
+def test_fingerprint_ignores_case_spacing_and_list_order():
+    profile = UserHealthData(conditions=["Heartburn", "Asthma"], medications=["Omeprazole"], age=40)
+    same = UserHealthData(conditions=["asthma", "  heartburn "], medications=["omeprazole"], age=40, firstName="")
+    assert profile_fingerprint(profile) == profile_fingerprint(same)
+    assert profile_fingerprint(profile) != profile_fingerprint(UserHealthData(conditions=["Heartburn"], age=40))
+
+
+def test_cache_key_changes_with_day_and_model():
+    fingerprint = profile_fingerprint(UserHealthData(conditions=["Heartburn"]))
+    key = TaskCache.make_key(fingerprint, DAY, "small")
+    assert key == TaskCache.make_key(fingerprint, DAY, "small")
+    assert key != TaskCache.make_key(fingerprint, date(2026, 3, 2), "small")
+    assert key != TaskCache.make_key(fingerprint, DAY, "large")
+
+
+def test_cached_tasks_are_shared_across_workers_until_they_expire(tmp_path):
+    path = str(tmp_path / "task_cache.db")
+    TaskCache(path=path).set("k1", TASKS)
+
+    other_worker = TaskCache(path=path)
+    assert other_worker.get("k1") == TASKS
+    assert other_worker.get("missing") is None
+    assert other_worker.stats()["hits"] == 1 and other_worker.stats()["misses"] == 1
+
+    with other_worker._conn:
+        other_worker._conn.execute("UPDATE task_cache SET expires_at = 0")
+    assert TaskCache(path=path).get("k1") is None
+
+
+def test_invalid_tasks_are_dropped_and_fields_normalised():
+    answer = {
+        "tasks": [
+            {"title": "Walk after dinner", "description": "15 minutes", "priority": " HIGH ", "category": "Exercise"},
+            {"title": "", "priority": "low", "category": "general"},
+            {"title": "Nap", "priority": "urgent", "category": "general"},
+            {"title": "Drink water", "priority": "low", "category": "hydration"},
+            "not a task",
+            {"title": "Book a check-up", "priority": "low", "category": "appointment", "clerkId": "someone-else"},
+        ]
+    }
+    tasks = parse_tasks(json.dumps(answer), "u1")
+    assert [task["title"] for task in tasks] == ["Walk after dinner", "Book a check-up"]
+    assert tasks[0]["priority"] == "high" and tasks[0]["category"] == "exercise"
+    assert set(tasks[1]) == {"title", "description", "priority", "category"}
+
+
+@pytest.mark.parametrize("content", ["not json", "[]", '{"tasks": "none"}', None])
+def test_unusable_answers_yield_no_tasks(content):
+    assert parse_tasks(content, "u1") == []
+
+
+def test_only_three_tasks_are_kept():
+    answer = {"tasks": [{"title": f"Task {i}", "priority": "low", "category": "general"} for i in range(5)]}
+    assert len(parse_tasks(json.dumps(answer), "u1")) == 3
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    async def chat_completion(self, payload, timeout=None, priority="chat"):
+        self.calls.append(priority)
+        content = json.dumps({"tasks": [{**TASKS[0], "priority": "Medium"}]})
+        return {"choices": [{"message": {"content": content}}], "usage": {"total_tokens": 100}}
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    monkeypatch.setenv("TASK_CACHE_PATH", str(tmp_path / "task_cache.db"))
+    generator = TaskGenerator()
+    monkeypatch.setattr(generator, "api_key", "test-key")
+    monkeypatch.setattr(generator.quota, "enabled", False)
+    generator.llm = FakeLLM()
+    return generator
+
+
+def test_novel_profile_calls_groq_once_per_day(generator):
+    novel = UserHealthData(conditions=["Heartburn"])
+    first = asyncio.run(generator.generate(novel, "u1", day=DAY, wait=True))
+    again = asyncio.run(generator.generate(UserHealthData(conditions=["heartburn"]), "u2", day=DAY, wait=True))
+
+    assert first == again
+    assert first[0]["title"] == "Avoid late meals" and first[0]["generatedByGroq"] is True
+    assert first[0]["dueDate"].startswith("2026-03-01T00:00:00")
+    assert generator.llm.calls == ["backfill"]
+
+
+def test_profiles_the_rules_cover_never_call_groq(generator):
+    covered = UserHealthData(conditions=["Hypertension"], bloodPressure="150/95")
+    tasks = asyncio.run(generator.generate(covered, "u1", day=DAY, wait=True))
+    assert tasks and not any(task["generatedByGroq"] for task in tasks)
+    assert generator.llm.calls == []
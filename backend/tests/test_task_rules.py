@@ -0,0 +1,104 @@
+"""
+Rule-based daily tasks: term matching, negated and opposite conditions, vitals guards.
+"""
+import asyncio
+
+import pytest
+
+from models.schemas import UserHealthData
+from services.task_rules import TaskRulesEngine, mentions
+
+MIN_COVERAGE = 0.7  # TASK_RULES_MIN_COVERAGE default
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return TaskRulesEngine()
+
+
+def titles(plan):
+    return [task["title"] for task in plan.tasks]
+
+
+def categories(plan):
+    return [task["category"] for task in plan.tasks]
+
+
+@pytest.mark.parametrize(
+    "condition, term, expected",
+    [
+        ("heart disease", "heart", True),
+        ("heartburn", "heart", False),
+        ("type 2 diabetes", "diabet*", True),
+        ("non-diabetic", "diabet*", False),
+        ("no history of diabetes", "diabet*", False),
+        ("diabetes ruled out", "diabet*", False),
+        ("low blood sugar", "blood sugar", False),
+        ("high blood pressure", "high blood pressure", True),
+        ("hypothyroidism", "thyroid", False),
+        ("hypothyroidism", "hypothyroid*", True),
+    ],
+)
+def test_terms_match_whole_words(condition, term, expected):
+    assert mentions(condition, term) is expected
+
+
+def test_hypotension_gets_no_salt_or_exercise(engine):
+    plan = engine.evaluate(UserHealthData(conditions=["Low blood pressure"], bloodPressure="85/55"), limit=10)
+    assert "Cut back on salt today" not in titles(plan)
+    assert "exercise" not in categories(plan)
+    assert "Stand up slowly and stay hydrated" in titles(plan)
+    assert not {"hypertension-check", "blood-pressure-salt", "walk"} & set(plan.matched)
+
+
+def test_hypoglycemia_gets_no_low_sugar_meal_or_exercise(engine):
+    for conditions in (["Low blood sugar"], ["Hypoglycemia"]):
+        plan = engine.evaluate(UserHealthData(conditions=conditions, bloodSugar=62), limit=10)
+        assert "Plan a balanced, low-sugar meal" not in titles(plan)
+        assert "exercise" not in categories(plan)
+        assert "Keep a quick snack with you" in titles(plan)
+        assert "diabetes-check" not in plan.matched
+
+
+def test_heartburn_is_not_a_heart_condition(engine):
+    plan = engine.evaluate(UserHealthData(conditions=["Heartburn"]))
+    assert "heart" not in plan.matched
+    assert plan.unmatched == ["heartburn"]
+    # Nothing understood it, so the profile goes to the LLM.
+    assert plan.coverage < MIN_COVERAGE
+
+
+def test_salt_and_sugar_advice_follow_the_readings(engine):
+    plan = engine.evaluate(
+        UserHealthData(conditions=["Hypertension", "Type 2 diabetes"], bloodPressure="150/95", bloodSugar=190),
+        limit=10,
+    )
+    assert {"hypertension-check", "blood-pressure-salt", "diabetes-check", "blood-sugar-meal"} <= set(plan.matched)
+    assert plan.coverage == 1.0
+
+    # A controlled reading asks for monitoring only.
+    plan = engine.evaluate(
+        UserHealthData(conditions=["Hypertension", "Type 2 diabetes"], bloodPressure="118/76", bloodSugar=95),
+        limit=10,
+    )
+    assert {"hypertension-check", "diabetes-check"} <= set(plan.matched)
+    assert not {"blood-pressure-salt", "blood-sugar-meal"} & set(plan.matched)
+
+
+def test_rules_file_with_bad_unless_is_rejected():
+    rule = {"id": "x", "when": {}, "unless": {"bloodSugar": {"lt": 70}},
+            "task": {"title": "t", "priority": "low", "category": "general"}}
+    assert TaskRulesEngine([rule]).rules == []
+
+
+def test_rule_tasks_are_due_at_the_start_of_the_utc_day():
+    from services.task_generator import TaskGenerator
+    from services.task_store import day_range, utc_today
+
+    generator = TaskGenerator()
+    tasks = asyncio.run(generator.generate(UserHealthData(conditions=["Hypertension"], bloodPressure="150/95")))
+    window = day_range(utc_today())
+    assert tasks
+    for task in tasks:
+        assert task["dueDate"] == window["start"]
+        assert task["dueDate"].endswith("Z")
@@ -0,0 +1,169 @@
+"""
+/tasks endpoints: generated tasks validate, and task writes go through the task store.
+"""
+import json
+import re
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routers.tasks as tasks_router
+from services.task_store import DailyTaskStore
+
+MEDICATIONS = [
+    "metformin 500mg", "lisinopril 10mg", "atorvastatin 20mg", "aspirin 81mg", "levothyroxine 50mcg",
+    "omeprazole 20mg", "amlodipine 5mg", "metoprolol 25mg", "sertraline 50mg", "gabapentin 300mg",
+    "vitamin d3 2000iu", "furosemide 40mg",
+]
+
+
+_OWNED_TASK = re.compile(r'_id == ("[^"]*") && clerkId == ("[^"]*")')
+
+
+class FakeSanity:
+    """In-memory dailyTask documents behind the Sanity query and mutate endpoints."""
+
+    def __init__(self):
+        self.docs = {}
+        self.queries = 0
+        self.transactions = []
+
+    def __call__(self, request):
+        if request.url.path.startswith("/v2023-10-18/data/query/"):
+            self.queries += 1
+            clerk_id = json.loads(request.url.params["$clerkId"])
+            tasks = [doc for doc in self.docs.values() if doc["clerkId"] == clerk_id and not doc["isCompleted"]]
+            return httpx.Response(200, json={"result": tasks})
+
+        mutations = json.loads(request.content)["mutations"]
+        self.transactions.append(mutations)
+        results = []
+        for mutation in mutations:
+            if "create" in mutation:
+                doc = mutation["create"]
+                self.docs[doc["_id"]] = dict(doc)
+                results.append({"id": doc["_id"], "operation": "create"})
+            elif "patch" in mutation:
+                task_id, clerk_id = map(json.loads, _OWNED_TASK.search(mutation["patch"]["query"]).groups())
+                doc = self.docs.get(task_id)
+                if doc is not None and doc["clerkId"] == clerk_id:
+                    doc.update(mutation["patch"]["set"])
+                    results.append({"id": task_id, "operation": "update"})
+        return httpx.Response(200, json={"results": results})
+
+
+@pytest.fixture
+def sanity(monkeypatch):
+    monkeypatch.setenv("SANITY_API_TOKEN", "token")
+    fake = FakeSanity()
+    store = DailyTaskStore()
+    store._http = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+    monkeypatch.setattr(tasks_router, "get_task_store", lambda: store)
+    return fake
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(tasks_router.router, prefix="/api")
+    return TestClient(app)
+
+
+def create(client, *titles, clerk_id="u1"):
+    response = client.post("/api/tasks", json={"clerkId": clerk_id, "tasks": [{"title": title} for title in titles]})
+    assert response.status_code == 200
+    return [task["_id"] for task in response.json()["tasks"]]
+
+
+def today(client, clerk_id="u1"):
+    return [task["title"] for task in client.get(f"/api/tasks/today/{clerk_id}").json()["tasks"]]
+
+
+def test_tasks_are_created_in_one_transaction(client, sanity):
+    ids = create(client, "Walk for 20 minutes", "Drink water")
+    assert len(ids) == 2 and len(sanity.transactions) == 1
+    assert sorted(today(client)) == ["Drink water", "Walk for 20 minutes"]
+    assert sanity.docs[ids[0]]["priority"] == "medium" and sanity.docs[ids[0]]["category"] == "general"
+
+
+def test_todays_tasks_are_cached_until_a_write(client, sanity):
+    create(client, "Walk for 20 minutes")
+    today(client)
+    today(client)
+    assert sanity.queries == 1
+
+    create(client, "Drink water")
+    assert len(today(client)) == 2
+    assert sanity.queries == 2
+
+
+def test_completing_a_task_removes_it_from_today(client, sanity):
+    walk, _ = create(client, "Walk for 20 minutes", "Drink water")
+    assert len(today(client)) == 2
+
+    response = client.post(f"/api/tasks/{walk}/complete", json={"clerkId": "u1"})
+    assert response.status_code == 200
+    assert response.json()["updated"] == [walk]
+    assert sanity.docs[walk]["completedAt"]
+    assert today(client) == ["Drink water"]
+
+
+def test_completing_someone_elses_or_a_missing_task_is_404(client, sanity):
+    (walk,) = create(client, "Walk for 20 minutes")
+    assert client.post(f"/api/tasks/{walk}/complete", json={"clerkId": "u2"}).status_code == 404
+    assert client.post("/api/tasks/missing/complete", json={"clerkId": "u1"}).status_code == 404
+    assert not sanity.docs[walk]["isCompleted"]
+
+
+def test_bulk_update_applies_only_the_users_tasks(client, sanity):
+    walk, water = create(client, "Walk for 20 minutes", "Drink water")
+    (theirs,) = create(client, "Stretch", clerk_id="u2")
+
+    response = client.patch(
+        "/api/tasks/bulk",
+        json={
+            "clerkId": "u1",
+            "updates": [
+                {"id": walk, "priority": "high"},
+                {"id": water, "isCompleted": True},
+                {"id": theirs, "title": "Hijacked"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == {"updated": [walk, water], "message": "Updated 2 of 3 tasks"}
+    assert len(sanity.transactions[-1]) == 3
+    assert sanity.docs[walk]["priority"] == "high" and sanity.docs[walk]["title"] == "Walk for 20 minutes"
+    assert sanity.docs[theirs]["title"] == "Stretch"
+    assert today(client) == ["Walk for 20 minutes"]
+
+
+def test_invalid_task_writes_are_rejected(client, sanity):
+    assert client.post("/api/tasks", json={"clerkId": "u1", "tasks": []}).status_code == 422
+    bad_update = {"clerkId": "u1", "updates": [{"id": "t1", "priority": "urgent"}]}
+    assert client.patch("/api/tasks/bulk", json=bad_update).status_code == 422
+    assert sanity.transactions == []
+
+
+def test_writes_fail_without_sanity_credentials(client, monkeypatch):
+    monkeypatch.delenv("SANITY_API_TOKEN", raising=False)
+    monkeypatch.setattr(tasks_router, "get_task_store", DailyTaskStore)
+    assert client.post("/api/tasks", json={"clerkId": "u1", "tasks": [{"title": "Walk"}]}).status_code == 500
+
+
+def test_rule_tasks_for_a_long_medication_list_validate(client):
+    response = client.post(
+        "/api/tasks/generate-groq",
+        json={
+            "clerkId": "u1",
+            "userHealthData": {"medications": MEDICATIONS, "allergies": ["penicillin", "peanuts", "shellfish", "latex"]},
+        },
+    )
+    assert response.status_code == 200
+    tasks = response.json()["tasks"]
+    medication = next(task for task in tasks if task["category"] == "medication")
+    assert medication["title"] == "Take your medications as prescribed"
+    assert "metformin 500mg" in medication["description"] and "and 9 more" in medication["description"]
+    assert all(len(task["title"]) <= 120 and len(task["description"] or "") <= 500 for task in tasks)
@@ -0,0 +1,52 @@
+"""
+Prompt token budgets: counting, truncation, and splitting what is left across sections.
+"""
+from utils.token_budget import PromptBudget, context_window, count_tokens, truncate_to_tokens
+
+
+def budget(max_input_tokens=1000, model="llama-3.1-8b-instant", answer_tokens=300):
+    return PromptBudget("chat", model, answer_tokens, max_input_tokens=max_input_tokens)
+
+
+def test_input_limit_leaves_room_for_the_answer():
+    assert budget().input_limit == 1000
+    small = budget(model="llama3-8b-8192", answer_tokens=8000)
+    assert small.input_limit == context_window("llama3-8b-8192") - 8000
+    assert context_window("unknown-model") == context_window("llama3-8b-8192")
+
+
+def test_reserved_sections_reduce_what_is_left():
+    prompt = budget()
+    charged = prompt.reserve("system", "You are a careful medical assistant.")
+    assert charged == count_tokens("You are a careful medical assistant.") > 0
+    prompt.charge("question", 50)
+    assert prompt.used == charged + 50
+    assert prompt.remaining == 1000 - charged - 50
+
+
+def test_allocate_splits_by_share():
+    assert budget().allocate({"report": 0.75, "history": 0.25}) == {"report": 750, "history": 250}
+
+
+def test_budget_a_capped_section_cannot_use_goes_to_the_others():
+    allocation = budget().allocate({"report": 0.5, "history": 0.5}, caps={"history": 100})
+    assert allocation["history"] == 100
+    assert allocation["report"] == 900
+    assert sum(allocation.values()) <= 1000
+
+
+def test_allocate_gives_nothing_once_the_budget_is_spent():
+    prompt = budget()
+    prompt.charge("system", 1200)
+    assert prompt.remaining == 0
+    assert prompt.allocate({"report": 1.0}) == {"report": 0}
+
+
+def test_truncation_stays_within_the_limit_at_a_word_boundary():
+    text = "Your cholesterol results are above the recommended range today. " * 20
+    cut = truncate_to_tokens(text, 30)
+    assert count_tokens(cut) <= 30
+    assert text.startswith(cut)
+    assert cut.split()[-1] in text.split()
+    assert truncate_to_tokens("short", 30) == "short"
+    assert truncate_to_tokens(text, 0) == ""
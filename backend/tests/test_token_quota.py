@@ -0,0 +1,48 @@
+"""
+Token budgets per user and globally.
+"""
+import asyncio
+
+import pytest
+
+from services.token_quota import TokenQuota
+
+FULL_CHAT_TOKENS = 2600  # 2000-token prompt plus the 600-token answer reservation
+
+
+@pytest.fixture
+def quota(tmp_path, monkeypatch):
+    for name in ("USER_PER_MINUTE", "USER_PER_DAY", "GLOBAL_PER_MINUTE", "GLOBAL_PER_DAY"):
+        monkeypatch.delenv(f"TOKEN_QUOTA_{name}", raising=False)
+    return TokenQuota(str(tmp_path / "tokens.db"))
+
+
+def test_default_user_budget_fits_several_full_context_chats(quota):
+    async def chats():
+        answered = 0
+        for _ in range(10):
+            if await quota.check_async("u1", FULL_CHAT_TOKENS) is not None:
+                break
+            await quota.record_async("u1", FULL_CHAT_TOKENS, "chat")
+            answered += 1
+        return answered
+
+    assert asyncio.run(chats()) >= 7
+
+
+def test_exhausted_budget_names_the_window_and_wait(quota):
+    quota.limits[("user", "minute")] = 1000
+    quota.record("u1", 900, "chat")
+
+    exhausted = quota.check("u1", 200)
+    assert exhausted["budget"] == "user_minute"
+    assert 0 < exhausted["wait_time"] <= 61
+    assert quota.check("u2", 200) is None
+
+
+def test_global_budget_spans_users(quota):
+    quota.limits[("global", "minute")] = 1000
+    quota.record("u1", 600, "chat")
+    quota.record("u2", 300, "summary")
+
+    assert quota.check("u3", 200)["budget"] == "global_minute"
@@ -0,0 +1,53 @@
+"""
+In-process metrics registry exposed at GET /metrics.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict
+
+
+class Metrics:
+    """Counters, observations (count/sum/max) and callback gauges."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            stats = self._observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["max"] = max(stats["max"], value)
+
+    def register_gauge(self, name: str, fn: Callable[[], Any]) -> None:
+        """Register a callback evaluated whenever a snapshot is taken."""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            observations = {
+                name: {**stats, "avg": round(stats["sum"] / stats["count"], 4) if stats["count"] else 0.0}
+                for name, stats in self._observations.items()
+            }
+            gauges = dict(self._gauges)
+
+        gauge_values: Dict[str, Any] = {}
+        for name, fn in gauges.items():
+            try:
+                gauge_values[name] = fn()
+            except Exception as e:
+                gauge_values[name] = f"error: {type(e).__name__}"
+        return {"counters": counters, "observations": observations, "gauges": gauge_values}
+
+
+metrics = Metrics()
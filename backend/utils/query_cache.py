@@ -0,0 +1,126 @@
+"""
+Query Result Cache
+TTL + LRU cache for upstream query results with ETag bookkeeping and tag-based invalidation.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set
+
+
+class QueryCache:
+    """Bounded in-memory cache for query results.
+
+    Entries keep their ETag after expiry so callers can revalidate them with a
+    conditional request instead of downloading the full result again.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    @staticmethod
+    def make_key(query: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Build a stable cache key from a query and its parameters."""
+        raw = query + "|" + json.dumps(params or {}, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the entry for key (fresh or stale), or None if absent."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry["expires_at"] > time.time():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    @staticmethod
+    def is_fresh(entry: Dict[str, Any]) -> bool:
+        return entry["expires_at"] > time.time()
+
+    def store(
+        self,
+        key: str,
+        value: Any,
+        ttl_seconds: float,
+        etag: Optional[str] = None,
+        tags: Iterable[str] = (),
+    ) -> None:
+        """Store a value with a TTL, optional ETag and invalidation tags."""
+        with self._lock:
+            self._remove(key)
+            tag_set = set(tags)
+            self._entries[key] = {
+                "value": value,
+                "etag": etag,
+                "expires_at": time.time() + ttl_seconds,
+                "tags": tag_set,
+            }
+            for tag in tag_set:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def refresh(self, key: str, ttl_seconds: float) -> None:
+        """Extend an entry's lifetime after a successful revalidation (HTTP 304)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["expires_at"] = time.time() + ttl_seconds
+                self.revalidations += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Drop every entry carrying any of the given tags. Returns the number removed."""
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry["tags"]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
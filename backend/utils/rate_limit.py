@@ -0,0 +1,243 @@
+"""
+Rate Limiting
+GCRA (generic cell rate algorithm) limiters with O(1) checks. Each key stores a
+single timestamp, the theoretical arrival time (TAT) of its next request, and a
+key whose TAT has passed carries no state and is reclaimed. State lives in
+process memory or in a SQLite file shared by every worker on the node, so
+limits hold regardless of how many uvicorn workers serve the traffic. Async
+callers use the *_async methods, which run SQLite transactions in a worker
+thread so waiting on another worker's lock never stalls the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from utils.metrics import metrics
+from utils.sqlite import connect, data_path
+
+
+def gcra(tat: Optional[float], now: float, interval: float, tolerance: float) -> Tuple[bool, float, float]:
+    """One GCRA step. Returns (allowed, new TAT, seconds until allowed).
+
+    interval is the spacing between requests at the sustained rate; tolerance
+    is how far ahead of that schedule a key may run (the burst size times
+    interval). A denied request leaves the TAT unchanged.
+    """
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - tolerance
+    if now < allow_at:
+        return False, tat, allow_at - now
+    return True, new_tat, 0.0
+
+
+class MemoryRateLimitBackend:
+    """Per-process TAT store.
+
+    Keys are kept in update order. A key's TAT is at most one window past its
+    last update, so idle keys drift to the front and each check drops the
+    expired ones found there; memory is bounded by the keys active within the
+    longest window.
+    """
+
+    name = "memory"
+    # Checks never wait on I/O or other processes, so async callers run them inline.
+    blocking = False
+
+    def __init__(self) -> None:
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, interval: float, tolerance: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            allowed, new_tat, retry_after = gcra(self._tats.get(key), now, interval, tolerance)
+            if allowed:
+                self._tats[key] = new_tat
+                self._tats.move_to_end(key)
+            self._reclaim(now)
+        return allowed, retry_after
+
+    def peek(self, key: str, interval: float, tolerance: float) -> float:
+        with self._lock:
+            tat = self._tats.get(key)
+        return gcra(tat, time.time(), interval, tolerance)[2]
+
+    def size(self) -> int:
+        return len(self._tats)
+
+    def _reclaim(self, now: float, limit: int = 8) -> None:
+        for _ in range(limit):
+            if not self._tats:
+                return
+            key, tat = next(iter(self._tats.items()))
+            if tat > now:
+                return
+            del self._tats[key]
+
+
+class SQLiteRateLimitBackend:
+    """TAT store in SQLite, shared by every worker process on the node.
+
+    Each check is one read and one upsert inside an IMMEDIATE transaction, so
+    concurrent workers see each other's requests. Expired rows are deleted
+    every few hundred writes.
+    """
+
+    name = "sqlite"
+    # A check may wait up to busy_timeout for another worker's write lock.
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tat REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits (tat);
+    """
+
+    RECLAIM_EVERY = 500
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("RATE_LIMIT_PATH") or data_path("rate_limits.db")
+        self._conn = connect(self.path)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def acquire(self, key: str, interval: float, tolerance: float) -> Tuple[bool, float]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                allowed, new_tat, retry_after = gcra(row["tat"] if row else None, now, interval, tolerance)
+                if allowed:
+                    self._conn.execute(
+                        "INSERT INTO rate_limits (key, tat) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET tat = excluded.tat",
+                        (key, new_tat),
+                    )
+                    self._writes += 1
+                    if self._writes % self.RECLAIM_EVERY == 0:
+                        self._conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return allowed, retry_after
+
+    def peek(self, key: str, interval: float, tolerance: float) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        return gcra(row["tat"] if row else None, time.time(), interval, tolerance)[2]
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limits WHERE tat > ?", (time.time(),)).fetchone()[0]
+
+
+_shared_backend = None
+_backend_lock = threading.Lock()
+
+
+def default_backend():
+    """Process-wide backend from RATE_LIMIT_BACKEND (sqlite, the default, or memory)."""
+    global _shared_backend
+    with _backend_lock:
+        if _shared_backend is None:
+            if os.getenv("RATE_LIMIT_BACKEND", "sqlite").lower() == "memory":
+                _shared_backend = MemoryRateLimitBackend()
+            else:
+                try:
+                    _shared_backend = SQLiteRateLimitBackend()
+                except Exception as e:
+                    print(f"⚠️ Shared rate-limit store unavailable, limiting per worker: {type(e).__name__}: {str(e)}")
+                    _shared_backend = MemoryRateLimitBackend()
+            metrics.register_gauge("rate_limit_keys", _shared_backend.size)
+        return _shared_backend
+
+
+class RateLimiter:
+    """Allow max_calls per window_seconds per key, with bursts of up to max_calls.
+
+    On a store error the request is allowed: a rate-limit outage should not
+    take the API down with it.
+    """
+
+    def __init__(self, name: str, max_calls: int, window_seconds: float, backend=None) -> None:
+        self.name = name
+        self.max_calls = max_calls
+        self.window_seconds = window_seconds
+        self.interval = window_seconds / max_calls
+        self.tolerance = self.interval * max_calls
+        self.backend = backend or default_backend()
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def check(self, key: str) -> Tuple[bool, float]:
+        """Count a call for key. Returns (allowed, seconds until the next call would be allowed)."""
+        try:
+            allowed, retry_after = self.backend.acquire(self._key(key), self.interval, self.tolerance)
+        except Exception as e:
+            print(f"⚠️ Rate limit check failed for {self.name}: {type(e).__name__}: {str(e)}")
+            return True, 0.0
+        if not allowed:
+            metrics.increment(f"rate_limited_{self.name}")
+        return allowed, retry_after
+
+    def is_allowed(self, key: str) -> bool:
+        """Check if key is allowed to make a call (and count it if so)."""
+        return self.check(key)[0]
+
+    def get_wait_time(self, key: str) -> int:
+        """Whole seconds to wait before key's next call would be allowed."""
+        try:
+            return math.ceil(self.backend.peek(self._key(key), self.interval, self.tolerance))
+        except Exception:
+            return 0
+
+    async def check_async(self, key: str) -> Tuple[bool, float]:
+        """check() for coroutines: blocking stores run in a worker thread."""
+        if not getattr(self.backend, "blocking", True):
+            return self.check(key)
+        return await asyncio.to_thread(self.check, key)
+
+    async def is_allowed_async(self, key: str) -> bool:
+        return (await self.check_async(key))[0]
+
+    async def get_wait_time_async(self, key: str) -> int:
+        if not getattr(self.backend, "blocking", True):
+            return self.get_wait_time(key)
+        return await asyncio.to_thread(self.get_wait_time, key)
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(limiter: RateLimiter, key_func: Callable[[Request], str] = client_ip):
+    """FastAPI dependency enforcing limiter per key_func(request), answering 429 with Retry-After.
+
+    The dependency is a plain function, so FastAPI runs it in its threadpool
+    rather than on the event loop.
+    """
+
+    def dependency(request: Request) -> None:
+        allowed, retry_after = limiter.check(key_func(request))
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded. Please try again shortly.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    return dependency
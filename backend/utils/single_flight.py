@@ -0,0 +1,88 @@
+"""
+Single-Flight Request Coalescing
+Concurrent callers asking for the same key share one in-flight call instead of
+each going upstream, so a burst of identical requests against a cold cache
+costs a single upstream round trip.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.metrics import metrics
+
+
+class _Call:
+    """A blocking call in progress; followers wait on done."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce duplicate concurrent calls by key.
+
+    do() is for blocking functions called from threads; do_async() is for
+    coroutines on the event loop. Only calls that overlap in time are shared:
+    once the leader finishes, the next caller starts a fresh call. Coalesced
+    callers are counted in the "<name>_coalesced" metric.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.coalesced = 0
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def _count_coalesced(self) -> None:
+        self.coalesced += 1
+        metrics.increment(f"{self.name}_coalesced")
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._count_coalesced()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            # The shared call runs as its own task, so a caller that disconnects
+            # does not cancel the work the others are waiting on.
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        else:
+            self._count_coalesced()
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception retrieved; every waiter has already seen it.
+            task.exception()
@@ -0,0 +1,30 @@
+"""
+SQLite helpers shared by the local storage backend and on-disk caches.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+
+DATA_DIR = os.getenv("NUERACARE_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+
+
+def data_path(filename: str) -> str:
+    """Path for a database file inside the backend data directory."""
+    return os.path.join(DATA_DIR, filename)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a connection tuned for many readers and one writer per node.
+
+    WAL lets readers proceed while a write is in progress, which is what makes
+    the same file usable from every uvicorn worker on the machine.
+    """
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
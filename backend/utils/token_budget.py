@@ -0,0 +1,164 @@
+"""
+Prompt Token Budgets
+Local token counting and per-request budget allocation for LLM prompts. Each
+prompt reserves its fixed parts (system prompt, question, instructions) and
+splits what is left of its input budget across flexible context such as report
+excerpts and conversation history, keeping room for the answer.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+from typing import Dict, Optional
+
+from utils.metrics import metrics
+
+# Context windows of the Groq models we use; unknown models get the smallest.
+MODEL_CONTEXT_TOKENS = {
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "mixtral-8x7b-32768": 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+_PIECE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+_encoding = None
+_encoding_checked = False
+
+
+def _tiktoken_encoding():
+    """cl100k_base from tiktoken when it is installed and usable, else None."""
+    global _encoding, _encoding_checked
+    if not _encoding_checked:
+        _encoding_checked = True
+        try:
+            import tiktoken  # type: ignore
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally.
+
+    Uses tiktoken's cl100k_base when available (close to the Llama 3 tokenizer);
+    otherwise estimates from word shapes: short words are one token, long words
+    about four characters per token, digits about three per token, punctuation one.
+    """
+    if not text:
+        return 0
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    total = 0
+    for piece in _PIECE.findall(text):
+        if piece.isalpha():
+            total += 1 if len(piece) <= 6 else math.ceil(len(piece) / 4)
+        elif piece.isdigit():
+            total += math.ceil(len(piece) / 3)
+        else:
+            total += 1
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to at most max_tokens, cutting at a line or word boundary where possible."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    boundary = max(cut.rfind("\n"), cut.rfind(" "))
+    return cut[:boundary] if boundary > len(cut) // 2 else cut
+
+
+def context_window(model: Optional[str]) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model or "", DEFAULT_CONTEXT_TOKENS)
+
+
+class PromptBudget:
+    """Token budget for one LLM request.
+
+    max_input_tokens caps the prompt (default PROMPT_MAX_INPUT_TOKENS) and is
+    further limited by the model's context window minus answer_tokens.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        model: Optional[str],
+        answer_tokens: int,
+        max_input_tokens: Optional[int] = None,
+    ) -> None:
+        self.kind = kind
+        self.model = model
+        self.answer_tokens = answer_tokens
+        limit = max_input_tokens or int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "2000"))
+        self.input_limit = max(0, min(limit, context_window(model) - answer_tokens))
+        self.sections: Dict[str, int] = {}
+
+    @property
+    def used(self) -> int:
+        return sum(self.sections.values())
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.input_limit - self.used)
+
+    def reserve(self, section: str, *texts: str) -> int:
+        """Charge the token count of texts to section. Returns the tokens charged."""
+        tokens = sum(count_tokens(text) for text in texts)
+        self.charge(section, tokens)
+        return tokens
+
+    def charge(self, section: str, tokens: int) -> None:
+        """Charge an already-counted number of tokens to section."""
+        self.sections[section] = self.sections.get(section, 0) + tokens
+
+    def allocate(self, shares: Dict[str, float], caps: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Split the remaining budget across flexible sections by share, honouring per-section caps.
+
+        Budget a capped section cannot use is handed to the others.
+        """
+        caps = caps or {}
+        available = self.remaining
+        allocation = {name: 0 for name in shares}
+        open_sections = {name: share for name, share in shares.items() if share > 0}
+        while available > 0 and open_sections:
+            total_share = sum(open_sections.values())
+            handed_out = 0
+            for name, share in list(open_sections.items()):
+                grant = int(available * share / total_share)
+                cap = caps.get(name)
+                if cap is not None and allocation[name] + grant >= cap:
+                    grant = cap - allocation[name]
+                    del open_sections[name]
+                allocation[name] += grant
+                handed_out += grant
+            available -= handed_out
+            if handed_out == 0:
+                break
+        return allocation
+
+    def record(self) -> None:
+        """Export the request's token estimates as metrics."""
+        metrics.observe(f"prompt_tokens_{self.kind}", self.used)
+        for section, tokens in self.sections.items():
+            metrics.observe(f"prompt_tokens_{self.kind}_{section}", tokens)
+        metrics.observe(f"answer_tokens_reserved_{self.kind}", self.answer_tokens)
@@ -53,6 +53,12 @@ export default defineType({
       type: "text",
       description: "Auto-generated summary of the conversation",
     }),
+    defineField({
+      name: "lastMessageAt",
+      title: "Last Message At",
+      type: "datetime",
+      description: "Timestamp of the newest stored message; newer messages are appended",
+    }),
     defineField({
       name: "createdAt",
       title: "Created At",